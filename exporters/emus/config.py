@@ -2,6 +2,8 @@ import json
 import os
 import pathlib
 
+from integrations.dar_helper.dar_cache import DEFAULT_CACHE_FILE
+
 # flake8: noqa
 
 # TODO: Refactor this
@@ -17,6 +19,9 @@ settings = {
     "EMUS_ALLOWED_ENGAGEMENT_TYPES": top_settings.get("emus.engagement_types", []),
     "EMUS_PHONE_PRIORITY": top_settings.get("emus.phone.priority", []),
     "EMUS_EMAIL_PRIORITY": top_settings.get("emus.email.priority", []),
+    "DAR_CACHE_FILE": top_settings.get(
+        "integrations.dar_helper.cache_file", DEFAULT_CACHE_FILE
+    ),
 }
 
 logformat = '%(levelname)s %(asctime)s %(name)s %(message)s'
@@ -13,7 +13,6 @@ import sys
 import io
 import collections
 import datetime
-import requests
 from xml.sax.saxutils import escape
 from functools import partial
 from itertools import filterfalse
@@ -31,6 +30,8 @@ from exporters.sql_export.sql_table_defs import (Adresse, Bruger, ItSystem,
                                                  Engagement, Enhed, Leder,
                                                  LederAnsvar, ItForbindelse)
 from exporters.utils.priority_by_class import lcdb_choose_public_address
+from integrations.dar_helper.dar_cache import DARCache
+from integrations.dar_helper.dar_helper import sync_dar_fetch_cached
 
 
 logging.basicConfig(
@@ -65,29 +66,31 @@ def engagement_count(nodes, ou):
             ouid = None
 
 
+def fetch_dar_addresses(session, ou_uuids):
+    """Look up the postal addresses of the units in DAR, all in one go.
+
+    Tries both adresser and adgangsadresser, through the DAR cache shared with
+    the other exports, and fills dar_cache with the found addresses.
+    """
+    dar_uuids = {
+        dar_uuid for dar_uuid, in session.query(Adresse.dar_uuid).filter(and_(
+            Adresse.adressetype_titel == 'Postadresse',
+            Adresse.enhed_uuid.in_(ou_uuids),
+            Adresse.dar_uuid.isnot(None),
+        ))
+    } - set(dar_cache)
+    logger.debug('Looking up %d dar addresses', len(dar_uuids))
+    with DARCache(config.settings["DAR_CACHE_FILE"]) as cache:
+        found, missing = sync_dar_fetch_cached(list(dar_uuids), cache)
+    dar_cache.update(found)
+    dar_cache.update({dar_uuid: {} for dar_uuid in missing})
+
+
 def get_dar_address(db_address):
     if not db_address:
         address = {}
     else:
-        dar_uuid = db_address.dar_uuid
-        if dar_cache.get(dar_uuid) is None:
-            dar_cache[dar_uuid] = {}
-            for addrtype in ('adresser', 'adgangsadresser'):
-                logger.debug('Looking up dar: {}'.format(dar_uuid))
-                adr_url = 'https://dawa.aws.dk/{}'.format(addrtype)
-                # 'historik/adresser', 'historik/adgangsadresser'
-                params = {'id': dar_uuid, 'struktur': 'mini'}
-                # Note: Dar accepts up to 10 simultanious
-                # connections, consider grequests.
-                r = requests.get(url=adr_url, params=params)
-                address_data = r.json()
-                if address_data:
-                    dar_cache[dar_uuid] = address_data[0]
-                    break
-                dar_cache[dar_uuid] = {}
-        else:
-            logger.debug('Cache hit dar: {}'.format(dar_uuid))
-        address = dar_cache[dar_uuid]
+        address = dar_cache.get(db_address.dar_uuid, {})
     return {
         'zipCode': address.get("postnr", ""),
         'city': address.get("postnrnavn", ""),
@@ -123,6 +126,12 @@ def export_ou_emus(session, nodes, emus_file=sys.stdout):
     fieldnames = ['startDate', 'endDate', 'parentOrgUnit', 'manager',
                   'longName', 'street', 'zipCode', 'city', 'phoneNumber']
 
+    # Only the units with employees are exported
+    fetch_dar_addresses(session, [
+        node.unit.uuid for node in PreOrderIter(nodes['root'])
+        if engagement_counter[node.unit.uuid]
+    ])
+
     rows = []
     for node in tqdm(PreOrderIter(nodes['root']), total=len(nodes), desc="export ou"):
         ou = node.unit
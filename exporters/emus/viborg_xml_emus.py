@@ -16,7 +16,6 @@ import time
 from os2mo_helpers.mora_helpers import MoraHelper
 import exporters.common_queries as cq
 import datetime
-import requests
 import uuid
 import json
 import os
@@ -25,7 +24,10 @@ import logging
 import collections
 import pathlib
 from xml.sax.saxutils import escape
+from exporters.utils.mora_fan_out import mora_fan_out
 from exporters.utils.priority_by_class import choose_public_address
+from integrations.dar_helper.dar_cache import DEFAULT_CACHE_FILE, DARCache
+from integrations.dar_helper.dar_helper import sync_dar_fetch_cached
 
 
 LOG_LEVEL = logging._nameToLevel.get(os.environ.get('LOG_LEVEL', 'WARNING'), 20)
@@ -55,27 +57,38 @@ EMUS_RESPONSIBILITY_CLASS = settings["emus.manager_responsibility_class"]
 EMUS_FILENAME = settings.get("emus.outfile_name", 'emus_filename.xml')
 EMUS_DISCARDED_JOB_FUNCTIONS = settings.get("emus.discard_job_functions", [])
 EMUS_ALLOWED_ENGAGEMENT_TYPES = settings.get("emus.engagement_types", [])
+# Number of concurrent reads when caching the units, 0 to read them one by one
+EMUS_CONCURRENCY = settings.get("emus.concurrency", 10)
+DAR_CACHE_FILE = settings.get(
+    "integrations.dar_helper.cache_file", DEFAULT_CACHE_FILE)
 
 
 engagement_counter = collections.Counter()
 
 
-def get_emus_address(mh, ou_uuid):
+def fetch_dar_addresses(mh, ou_uuids):
+    """ look up the DAR addresses of all the units in one go
+    return the found DAR addresses by their uuid
+    """
+    adr_uuids = set()
+    for ou_uuid in ou_uuids:
+        adr_uuid = mh.read_ou_address(ou_uuid).get("value")
+        if adr_uuid and adr_uuid == str(uuid.UUID(adr_uuid)):
+            adr_uuids.add(adr_uuid)
+    with DARCache(DAR_CACHE_FILE) as cache:
+        found, _ = sync_dar_fetch_cached(list(adr_uuids), cache)
+    return found
+
+
+def get_emus_address(mh, ou_uuid, dar_addresses):
     """ try both adresse and adgangsadresse
     return {} if not found or uuid is falsy
     """
     mh_address = mh.read_ou_address(ou_uuid)
     adr_uuid = mh_address.get("value")
-    if not adr_uuid or adr_uuid != str(uuid.UUID(adr_uuid)):
+    if not adr_uuid or adr_uuid not in dar_addresses:
         return {}
-    response = requests.get(
-        "http://dawa.aws.dk/adresser?struktur=mini&id=%s" % adr_uuid)
-    if not len(response.json()):
-        response = requests.get(
-            "http://dawa.aws.dk/adgangsadresser?struktur=mini&id=%s" % adr_uuid)
-    if not len(response.json()) == 1:
-        return {}
-    address = response.json()[0]
+    address = dar_addresses[adr_uuid]
 
     pstnrby = " ".join([
         address["postnr"],
@@ -93,6 +106,12 @@ def export_ou_emus(mh, nodes, emus_file):
     fieldnames = ['startDate', 'endDate', 'parentOrgUnit', 'manager',
                   'longName', 'street', 'zipCode', 'city', 'phoneNumber']
 
+    # Only the units with employees are exported
+    dar_addresses = fetch_dar_addresses(mh, [
+        node.name for node in cq.PreOrderIter(nodes['root'])
+        if engagement_counter[node.name]
+    ])
+
     rows = []
     for node in tqdm(cq.PreOrderIter(nodes['root']), total=len(nodes), desc="export ou"):
         ou = mh.read_ou(node.name)
@@ -103,7 +122,7 @@ def export_ou_emus(mh, nodes, emus_file):
 
         manager = mh.read_ou_manager(node.name)
         manager_uuid = manager["uuid"] if manager else ''
-        address = get_emus_address(mh, node.name)
+        address = get_emus_address(mh, node.name, dar_addresses)
         fra = ou['validity']['from'] if ou['validity']['from'] else ''
         til = ou['validity']['to'] if ou['validity']['to'] else ''
         over_uuid = ou['parent']['uuid'] if ou['parent'] else ''
@@ -414,6 +433,7 @@ def main(
     root_org_unit_uuid=MORA_ROOT_ORG_UNIT_UUID,
     mh=MoraHelper(),
     t=time.time(),
+    concurrency=0,
 ):
     if not root_org_unit_uuid:
         logger.error("root_org_unit_uuid must be specified")
@@ -423,6 +443,12 @@ def main(
                    " so program may seem unresponsive temporarily")
 
     nodes = mh.read_ou_tree(root_org_unit_uuid)
+    if concurrency:
+        # Read every unit and its manager up front, the exports below are then
+        # served from the cache of mh
+        units = [(node.name,) for node in cq.PreOrderIter(nodes['root'])]
+        mora_fan_out(mh, "read_ou", units, concurrency)
+        mora_fan_out(mh, "read_ou_manager", units, concurrency)
 
     # Write the xml file
     emus_xml_file.write("<?xml version=\"1.0\" encoding=\"utf-8\"?>\n")
@@ -441,4 +467,4 @@ def main(
 if __name__ == '__main__':
     morah = MoraHelper(MORA_BASE)
     with open(EMUS_FILENAME, "w", encoding="utf-8") as emus_f:
-        main(emus_xml_file=emus_f, mh=morah)
+        main(emus_xml_file=emus_f, mh=morah, concurrency=EMUS_CONCURRENCY)
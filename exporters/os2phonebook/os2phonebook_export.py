@@ -5,7 +5,6 @@ import pathlib
 import time
 from itertools import starmap
 from functools import wraps, partial
-from operator import attrgetter
 
 import click
 from aiohttp import BasicAuth, ClientSession, TCPConnector
@@ -25,7 +24,8 @@ from exporters.sql_export.sql_table_defs import (
 from sqlalchemy import create_engine, event, or_
 from sqlalchemy.orm import sessionmaker
 
-from integrations.dar_helper.dar_helper import dar_fetch
+from integrations.dar_helper.dar_cache import DEFAULT_CACHE_FILE, DARCache
+from integrations.dar_helper.dar_helper import sync_dar_fetch_cached
 from integrations.dar_helper.utils import async_to_sync
 
 
@@ -85,6 +85,15 @@ def apply_tuple(func):
     return wrapped
 
 
+def dar_cache_file():
+    """Path of the DAR cache, shared with the other programs."""
+    cfg_file = pathlib.Path.cwd() / "settings" / "settings.json"
+    if not cfg_file.is_file():
+        return DEFAULT_CACHE_FILE
+    settings = json.loads(cfg_file.read_text())
+    return settings.get("integrations.dar_helper.cache_file", DEFAULT_CACHE_FILE)
+
+
 @click.group()
 def cli():
     # Solely used for command grouping
@@ -425,9 +434,26 @@ def generate_json():
 
         uuids = set(dawa_queue.keys())
         queryset = session.query(DARAdresse).filter(DARAdresse.uuid.in_(uuids))
-        betegnelser = map(attrgetter('betegnelse'), queryset.all())
-        betegnelser = filter(lambda x: x is not None, betegnelser)
-        for value in betegnelser:
+        betegnelser = {
+            dar_address.uuid: dar_address.betegnelse
+            for dar_address in queryset.all()
+            if dar_address.betegnelse is not None
+        }
+        # Addresses missing from the export database are looked up in DAR,
+        # all at once through the DAR cache shared with the other programs
+        not_exported = uuids - set(betegnelser)
+        if not_exported:
+            with DARCache(dar_cache_file()) as cache:
+                dar_addresses, _ = sync_dar_fetch_cached(list(not_exported), cache)
+            betegnelser.update(
+                {
+                    dar_uuid: dar_address["betegnelse"]
+                    for dar_uuid, dar_address in dar_addresses.items()
+                    if dar_address.get("betegnelse") is not None
+                }
+            )
+
+        for dar_uuid, value in betegnelser.items():
             for address in dawa_queue[dar_uuid]:
                 entry_uuid = address_to_uuid(address)
                 atype = da_address_types[address.adressetype_scope]
@@ -441,8 +467,7 @@ def generate_json():
                     formatted_address
                 )
 
-        found = set(map(attrgetter('uuid'), queryset.all()))
-        missing = uuids - found
+        missing = uuids - set(betegnelser)
         if missing:
             print(missing, "not found in DAWA")
 
@@ -19,6 +19,7 @@ from more_itertools import flatten, only
 
 from os2mo_helpers.mora_helpers import MoraHelper
 from exporters.sql_export.lora_cache import LoraCache
+from exporters.sql_export.unit_tree import UnitTree
 
 LOG_LEVEL = logging.DEBUG
 LOG_FILE = 'plan2learn.log'
@@ -521,10 +522,12 @@ def main(speedup, dry_run=False):
         lc = None
         lc_historic = None
 
-    # Todo: We need the nodes structure to keep a consistent output,
-    # consider if the 70 seconds is worth the implementation time of
-    # reading this from cache.
-    nodes = mh.read_ou_tree(root_unit)
+    # The nodes structure keeps the output consistent, with the cache it is
+    # built from the units read from LoRa, rather than walking MO.
+    if lc:
+        nodes = UnitTree.from_lora_cache(lc).anytree_nodes(root_unit)
+    else:
+        nodes = mh.read_ou_tree(root_unit)
 
     brugere_rows = export_bruger(mh, nodes, lc, lc_historic)
     print('Bruger: {}s'.format(time.time() - t))
@@ -0,0 +1,139 @@
+"""Compare the memory use of dicts and compact records in the LoraCache.
+
+Generates a historic-cache-like dataset of users, units, engagements, addresses
+and managers, and measures the memory allocated to hold it with each
+representation. Run with:
+
+    python -m exporters.sql_export.benchmark_lora_cache_records --users 20000
+"""
+import datetime
+import gc
+import random
+import tracemalloc
+from uuid import uuid4
+
+import click
+
+from exporters.sql_export.lora_cache_records import RECORD_TYPES
+
+
+def _dates(rnd, validities):
+    """Generate consecutive from/to dates, as a historic cache would contain."""
+    day = datetime.date(2000, 1, 1) + datetime.timedelta(days=rnd.randrange(3650))
+    for _ in range(validities):
+        end = day + datetime.timedelta(days=rnd.randrange(30, 1000))
+        yield day.isoformat(), end.isoformat()
+        day = end + datetime.timedelta(days=1)
+
+
+def generate_dataset(num_users, validities, seed=0):
+    """Generate LoraCache-like values for each compactable object type.
+
+    Values are plain dicts, generated as raw strings so they do not share
+    memory with each other, like values decoded from LoRa responses.
+    """
+    rnd = random.Random(seed)
+    classes = [str(uuid4()) for _ in range(200)]
+    units = [str(uuid4()) for _ in range(max(num_users // 20, 1))]
+
+    def cls():
+        # Copy the string, as json decoding would create a new one
+        return ''.join(rnd.choice(classes))
+
+    def ref(uuids):
+        return ''.join(rnd.choice(uuids))
+
+    def generate(make, count):
+        result = {}
+        for _ in range(count):
+            uuid = str(uuid4())
+            result[uuid] = [
+                make(uuid, from_date, to_date)
+                for from_date, to_date in _dates(rnd, validities)
+            ]
+        return result
+
+    users = generate(lambda uuid, from_date, to_date: {
+        'uuid': uuid, 'cpr': '{:010d}'.format(rnd.randrange(10 ** 10)),
+        'user_key': uuid, 'fornavn': 'Fornavn', 'efternavn': 'Efternavn',
+        'navn': 'Fornavn Efternavn', 'kaldenavn_fornavn': '',
+        'kaldenavn_efternavn': '', 'kaldenavn': '',
+        'from_date': from_date, 'to_date': to_date,
+    }, num_users)
+    user_uuids = list(users)
+    return {
+        'users': users,
+        'units': generate(lambda uuid, from_date, to_date: {
+            'uuid': uuid, 'user_key': uuid[:8], 'name': 'Enhed',
+            'unit_type': cls(), 'level': cls(), 'parent': ref(units),
+            'from_date': from_date, 'to_date': to_date,
+        }, len(units)),
+        'engagements': generate(lambda uuid, from_date, to_date: {
+            'uuid': uuid, 'user': ref(user_uuids), 'unit': ref(units),
+            'fraction': None, 'user_key': str(rnd.randrange(10 ** 5)),
+            'engagement_type': cls(), 'primary_type': cls(),
+            'job_function': cls(),
+            'extensions': {'udvidelse_{}'.format(i): None for i in range(1, 11)},
+            'from_date': from_date, 'to_date': to_date,
+        }, num_users * 3 // 2),
+        'addresses': generate(lambda uuid, from_date, to_date: {
+            'uuid': uuid, 'user': ref(user_uuids), 'unit': None,
+            'value': 'user@example.com', 'scope': 'E-mail', 'dar_uuid': None,
+            'adresse_type': cls(), 'visibility': cls(),
+            'from_date': from_date, 'to_date': to_date,
+        }, num_users * 2),
+        'managers': generate(lambda uuid, from_date, to_date: {
+            'uuid': uuid, 'user': ref(user_uuids), 'unit': ref(units),
+            'manager_type': cls(), 'manager_level': cls(),
+            'manager_responsibility': [cls()],
+            'from_date': from_date, 'to_date': to_date,
+        }, len(units)),
+    }
+
+
+def measure(build):
+    """Return the result of build, and the memory it allocated in bytes."""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size
+
+
+def compact(dataset):
+    return {
+        name: {
+            uuid: [RECORD_TYPES[name](**values) for values in validities]
+            for uuid, validities in objects.items()
+        }
+        for name, objects in dataset.items()
+    }
+
+
+@click.command()
+@click.option('--users', default=10000, help='Number of users to generate.')
+@click.option('--validities', default=5, help='Validities per object.')
+def cli(users, validities):
+    dataset, dict_size = measure(lambda: generate_dataset(users, validities))
+    # Measure the records built from a fresh dataset, as compact() interns the
+    # strings of the dataset it is given.
+    records, record_size = measure(
+        lambda: compact(generate_dataset(users, validities))
+    )
+    assert dataset.keys() == records.keys()
+
+    click.echo('{:<12} {:>12} {:>12}'.format('', 'dicts', 'records'))
+    rows = sum(
+        len(validity_list)
+        for objects in dataset.values() for validity_list in objects.values()
+    )
+    click.echo('{:<12} {:>12} {:>12}'.format('rows', rows, rows))
+    click.echo('{:<12} {:>11.1f}M {:>11.1f}M'.format(
+        'memory', dict_size / 2 ** 20, record_size / 2 ** 20))
+    click.echo('{:<12} {:>12} {:>11.0f}%'.format(
+        'relative', '100%', 100 * record_size / dict_size))
+
+
+if __name__ == '__main__':
+    cli()
@@ -1,6 +1,6 @@
 import json
 import time
-import pickle
+import threading
 import urllib
 import logging
 import pathlib
@@ -10,19 +10,37 @@ import lora_utils
 import requests
 from operator import itemgetter
 from itertools import starmap
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
+from uuid import uuid4
 
 import click
 from more_itertools import bucket
 
 from os2mo_helpers.mora_helpers import MoraHelper
 from integrations.dar_helper import dar_helper
+from integrations.dar_helper.dar_cache import DEFAULT_CACHE_FILE, DARCache
+from exporters.sql_export.lora_cache_records import RECORD_TYPES
+from exporters.sql_export.lora_cache_snapshot import (
+    SnapshotError, SnapshotSection, read_manifest, write_manifest, write_section
+)
+from exporters.sql_export.unit_tree import UnitTree
 
 logger = logging.getLogger("LoraCache")
 
 DEFAULT_TIMEZONE = dateutil.tz.gettz('Europe/Copenhagen')
 
-PICKLE_PROTOCOL = pickle.DEFAULT_PROTOCOL
+# Number of pages read concurrently from LoRa in a single lookup
+DEFAULT_CONCURRENT_REQUESTS = 4
+# Number of object types read concurrently when populating the cache
+DEFAULT_POPULATE_WORKERS = 4
+# Objects registered this long before the previous snapshot are re-read in
+# incremental mode, to allow for clock skew between LoRa and this host.
+INCREMENTAL_MARGIN = datetime.timedelta(minutes=5)
+# Object types carrying derived data, which are written to the snapshot once
+# the derived data is calculated
+DERIVED_NAMES = ('units', 'engagements')
 
 LOG_LEVEL = logging.DEBUG
 LOG_FILE = 'lora_cache.log'
@@ -43,6 +61,33 @@ class LoraCache(object):
 
         self.dar_map = defaultdict(list)
 
+        # At least one request must be in flight for the reads to progress
+        self.concurrent_requests = max(1, self.settings.get(
+            'exporters.lora_cache.concurrent_requests', DEFAULT_CONCURRENT_REQUESTS
+        ))
+        self.populate_workers = self.settings.get(
+            'exporters.lora_cache.populate_workers', DEFAULT_POPULATE_WORKERS
+        )
+        self.compact_records = self.settings.get(
+            'exporters.lora_cache.compact_records', False
+        )
+        # Persistent cache of DAR lookups, shared with other programs
+        self.dar_cache_file = self.settings.get(
+            'integrations.dar_helper.cache_file', DEFAULT_CACHE_FILE
+        )
+
+        # Set by populate_cache when performing an incremental read
+        self.registered_since = None
+        # Identifies the snapshot written or read by populate_cache
+        self.generation = None
+        # Generations of the sections kept from an earlier snapshot, see
+        # _carried_sections
+        self.generations = {}
+        self.changed = {}
+        # Object types whose derived data is calculated by populate_cache
+        self._derived = set()
+        self._lookup_state = threading.local()
+
         self.full_history = full_history
         self.skip_past = skip_past
         self.org_uuid = self._read_org_uuid()
@@ -125,6 +170,18 @@ class LoraCache(object):
                 from_date = to_date = None
         return from_date, to_date
 
+    def _record(self, name, values):
+        """
+        Create the cached representation of a single validity of an object.
+        :param name: Name of the cached object type, eg. 'users'.
+        :param values: Dict with the values of the validity.
+        :return: The dict itself, or a compact record with the same values if
+        compact records are enabled.
+        """
+        if self.compact_records:
+            return RECORD_TYPES[name](**values)
+        return values
+
     def _perform_lora_lookup(self, url, params, skip_history=False):
         """
         Exctract a complete set of objects in LoRa.
@@ -132,12 +189,37 @@ class LoraCache(object):
         :param skip_history: Force a validity of today, even if self.full_history
         is true.
         """
+        page_source = getattr(self._lookup_state, 'page_source', None)
+        if page_source is not None:
+            # Streaming, see _stream_pages
+            return page_source(url, params, skip_history)
+
+        complete_data = []
+        for data_list in self._lora_pages(url, params, skip_history):
+            complete_data.extend(data_list)
+
+        if self.registered_since is not None:
+            # LoRa considers every registration that overlaps registreretFra
+            # to be a match, which includes all current registrations, so the
+            # objects registered since the snapshot are picked out here.
+            seen = {lora_object['id'] for lora_object in complete_data}
+            complete_data = list(filter(self._registered_since, complete_data))
+            updated = {lora_object['id'] for lora_object in complete_data}
+            self._lookup_state.lookup = (seen, updated)
+        return complete_data
+
+    def _lora_pages(self, url, params, skip_history=False):
+        """
+        Read a set of objects in LoRa, yielding a page of objects at a time.
+        :param url: The url that should be used to extract data.
+        :param skip_history: Force a validity of today, even if self.full_history
+        is true.
+        """
         t = time.time()
         logger.debug('Start reading {}, params: {}, at t={}'.format(url, params, t))
         results_pr_request = 5000
         params['list'] = 1
         params['maximalantalresultater'] = results_pr_request
-        params['foersteresultat'] = 0
 
         # Default, this can be overwritten in the lines below
         now = datetime.datetime.today()
@@ -148,27 +230,109 @@ class LoraCache(object):
             if not self.skip_past:
                 params['virkningFra'] = '-infinity'
 
-        complete_data = []
+        count = 0
+        with requests.Session() as session:
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1, pool_maxsize=self.concurrent_requests
+            )
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+
+            with ThreadPoolExecutor(max_workers=self.concurrent_requests) as executor:
+                def submit_page(offset):
+                    page_params = dict(params, foersteresultat=offset)
+                    return executor.submit(
+                        self._fetch_lora_page, session, url, page_params
+                    )
 
-        done = False
-        while not done:
-            response = requests.get(self.settings['mox.base'] + url, params=params)
-            data = response.json()
-            results = data['results']
-            if results:
-                data_list = data['results'][0]
-            else:
-                data_list = []
-            complete_data = complete_data + data_list
-            if len(data_list) == 0:
-                done = True
-            else:
-                params['foersteresultat'] += results_pr_request
-                logger.debug('Mellemtid, {} læsninger: {}s'.format(
-                    params['foersteresultat'], time.time() - t))
+                # Speculatively keep a window of pages in flight, and consume
+                # them in the order they were requested, the first empty page
+                # marks the end of the result set.
+                next_offset = 0
+                pending = deque()
+                for _ in range(self.concurrent_requests):
+                    pending.append(submit_page(next_offset))
+                    next_offset += results_pr_request
+
+                try:
+                    while pending:
+                        data_list = pending.popleft().result()
+                        if len(data_list) == 0:
+                            break
+                        pending.append(submit_page(next_offset))
+                        next_offset += results_pr_request
+                        count += len(data_list)
+                        logger.debug('Mellemtid, {} læsninger: {}s'.format(
+                            count, time.time() - t))
+                        yield data_list
+                finally:
+                    # Also when the consumer stops early
+                    for future in pending:
+                        future.cancel()
         logger.debug('LoRa læsning færdig. {} elementer, {}s'.format(
-            len(complete_data), time.time() - t))
-        return complete_data
+            count, time.time() - t))
+
+    def _stream_pages(self, loader):
+        """
+        Run a cache loader once for each page of objects it reads from LoRa.
+
+        The lookup performed by the loader is answered with a single page at a
+        time, so only the objects of one page are held in memory.
+        :param loader: Cache loader performing a single lookup, eg.
+        self._cache_lora_users.
+        :return: Iterator of the cached objects of each page.
+        """
+        state = self._lookup_state
+        pages = None
+        exhausted = False
+
+        def next_page(url, params, skip_history):
+            nonlocal pages, exhausted
+            if pages is None:
+                pages = self._lora_pages(url, params, skip_history)
+            page = next(pages, None)
+            if page is None:
+                exhausted = True
+                return []
+            return page
+
+        state.page_source = next_page
+        try:
+            while True:
+                objects = loader()
+                if exhausted:
+                    return
+                yield objects
+        finally:
+            state.page_source = None
+            if pages is not None:
+                pages.close()
+
+    def _registered_since(self, lora_object):
+        """
+        Check if the object was registered in LoRa after self.registered_since.
+        :param lora_object: The object as returned by LoRa.
+        """
+        registration = lora_object['registreringer'][0]
+        registered = dateutil.parser.isoparse(
+            registration['fratidspunkt']['tidsstempeldatotid']
+        )
+        return registered >= self.registered_since
+
+    def _fetch_lora_page(self, session, url, params):
+        """
+        Read a single page of objects from LoRa.
+        :param session: The requests session used for the lookup.
+        :param url: The url that should be used to extract data.
+        :param params: The query parameters, including the page offset.
+        :return: List of the objects on the page, empty if past the last page.
+        """
+        response = session.get(self.settings['mox.base'] + url, params=params)
+        data = response.json()
+        results = data['results']
+        if results:
+            return results[0]
+        return []
 
     def _cache_lora_facets(self):
         # Facets are eternal i MO and does not need a historic dump
@@ -274,7 +438,7 @@ class LoraCache(object):
                 kaldenavn_fornavn = udv.get('kaldenavn_fornavn', '')
                 kaldenavn_efternavn = udv.get('kaldenavn_efternavn', '')
                 users[uuid].append(
-                    {
+                    self._record('users', {
                         'uuid': uuid,
                         'cpr': cpr,
                         'user_key': user_key,
@@ -287,7 +451,7 @@ class LoraCache(object):
                                                kaldenavn_efternavn]).strip(),
                         'from_date': from_date,
                         'to_date': to_date
-                    }
+                    })
                 )
         return users
 
@@ -328,7 +492,7 @@ class LoraCache(object):
                 else:
                     level = None
                 units[uuid].append(
-                    {
+                    self._record('units', {
                         'uuid': uuid,
                         'user_key': egenskaber['brugervendtnoegle'],
                         'name': egenskaber['enhedsnavn'],
@@ -337,7 +501,7 @@ class LoraCache(object):
                         'parent': parent,
                         'from_date': from_date,
                         'to_date': to_date
-                    }
+                    })
                 )
         return units
 
@@ -425,7 +589,7 @@ class LoraCache(object):
                         synlighed = relationer['opgaver'][0]['uuid']
 
                 addresses[uuid].append(
-                    {
+                    self._record('addresses', {
                         'uuid': uuid,
                         'user': user_uuid,
                         'unit': unit_uuid,
@@ -436,7 +600,7 @@ class LoraCache(object):
                         'visibility': synlighed,
                         'from_date': from_date,
                         'to_date': to_date
-                    }
+                    })
                 )
         return addresses
 
@@ -518,7 +682,7 @@ class LoraCache(object):
                 }
 
                 engagement_effects.append(
-                    {
+                    self._record('engagements', {
                         'uuid': uuid,
                         'user': user_uuid,
                         'unit': unit_uuid,
@@ -530,7 +694,7 @@ class LoraCache(object):
                         'extensions': extensions,
                         'from_date': from_date,
                         'to_date': to_date
-                    }
+                    })
                 )
             if engagement_effects:
                 engagements[uuid] = engagement_effects
@@ -824,7 +988,7 @@ class LoraCache(object):
                         manager_responsibility.append(opgave['uuid'])
 
                 managers[uuid].append(
-                    {
+                    self._record('managers', {
                         'uuid': uuid,
                         'user': user_uuid,
                         'unit': unit_uuid,
@@ -833,11 +997,65 @@ class LoraCache(object):
                         'manager_responsibility': manager_responsibility,
                         'from_date': from_date,
                         'to_date': to_date
-                    }
+                    })
                 )
         return managers
 
+    def _affected_users(self):
+        """
+        Find the users whose primary engagement must be recalculated.
+        :return: Set of user uuids, or None if all users are affected.
+        """
+        if self.registered_since is None or self.changed.get('classes'):
+            return None
+        affected = {
+            engagement['user']
+            for old, new in self.changed.get('engagements', {}).values()
+            for engagement in old + new
+        }
+        # Engagements without derived data, eg. if the previous run stopped
+        # before calculating it.
+        affected.update(
+            validities[0]['user'] for validities in self.engagements.values()
+            if 'primary_boolean' not in validities[0]
+        )
+        return affected
+
+    def _affected_units(self):
+        """
+        Find the units whose derived data must be recalculated.
+
+        The location and acting manager of a unit depends on all of its
+        ancestors, so all descendants of a changed unit are affected.
+        :return: Set of unit uuids, or None if all units are affected.
+        """
+        if self.registered_since is None:
+            return None
+        changed_units = set(self.changed.get('units', {}))
+        changed_units.update(
+            manager['unit']
+            for old, new in self.changed.get('managers', {}).values()
+            for manager in old + new
+        )
+        changed_units.update(
+            unit for unit, validities in self.units.items()
+            if validities and 'location' not in validities[0]
+        )
+
+        affected = set()
+        for unit in self.units:
+            current_unit = unit
+            while current_unit is not None:
+                if current_unit in changed_units:
+                    affected.add(unit)
+                    break
+                validities = self.units.get(current_unit)
+                current_unit = validities[0]['parent'] if validities else None
+        return affected
+
     def calculate_primary_engagements(self):
+        if 'engagements' in self._derived:
+            return
         if self.full_history:
             msg = """
             Calculation of primary engagements is currently not implemented for
@@ -869,6 +1087,12 @@ class LoraCache(object):
 
         # List of 2-tuples: uuid, engagement validities
         engagement_validities = self.engagements.items()
+        affected_users = self._affected_users()
+        if affected_users is not None:
+            engagement_validities = [
+                (uuid, validities) for uuid, validities in engagement_validities
+                if validities[0]['user'] in affected_users
+            ]
         # Iterator of 2-tuples: uuid, engagement
         engagements = starmap(extract_engagement, engagement_validities)
         # Buckets of iterators of 2-tuples: uuid, engagement
@@ -894,6 +1118,8 @@ class LoraCache(object):
                 self.engagements[uuid][0]['primary_boolean'] = is_primary
 
     def calculate_derived_unit_data(self):
+        if 'units' in self._derived:
+            return
         if self.full_history:
             msg = """
             Calculation of derived unit data is currently not implemented for
@@ -905,7 +1131,10 @@ class LoraCache(object):
         responsibility_class = self.settings.get(
             'exporters.actual_state.manager_responsibility_class', None
         )
+        affected_units = self._affected_units()
         for unit, unit_validities in self.units.items():
+            if affected_units is not None and unit not in affected_units:
+                continue
             assert(len(unit_validities)) == 1
             unit_info = unit_validities[0]
             manager_uuid = None
@@ -959,7 +1188,12 @@ class LoraCache(object):
             self.units[unit][0]['manager_uuid'] = manager_uuid
             self.units[unit][0]['acting_manager_uuid'] = acting_manager_uuid
 
-    def _cache_dar(self):
+    def _cache_dar(self, addresses=None):
+        """
+        Look up the DAR addresses in self.dar_map, and set the address values.
+        :param addresses: The cached addresses to update, self.addresses by
+        default.
+        """
         # Initialize cache for entries we cannot lookup
         dar_uuids = self.dar_map.keys()
         dar_cache = dict(map(
@@ -967,236 +1201,420 @@ class LoraCache(object):
         ))
         total_dar = len(dar_uuids)
         total_missing = total_dar
-
-        # Start looking entries up in DAR
-        if self.resolve_dar:
-            dar_addresses, missing = dar_helper.sync_dar_fetch(dar_uuids)
-            dar_adgange, missing = dar_helper.sync_dar_fetch(
-                list(missing), addrtype="adgangsadresser"
-            )
+        cache_hits = cache_misses = 0
+
+        # Start looking entries up in DAR, only the entries not in the
+        # persistent cache are fetched
+        if self.resolve_dar and dar_uuids:
+            with DARCache(self.dar_cache_file) as cache:
+                dar_addresses, missing = dar_helper.sync_dar_fetch_cached(
+                    list(dar_uuids), cache
+                )
+                cache_hits = cache.stats['hit'] + cache.stats['negative_hit']
+                cache_misses = cache.stats['miss']
             total_missing = len(missing)
 
             dar_cache.update(dar_addresses)
-            dar_cache.update(dar_adgange)
 
         # Update all addresses with betegnelse
         for dar_uuid, uuid_list in self.dar_map.items():
             for uuid in uuid_list:
-                for address in self.addresses[uuid]:
+                validities = (self.addresses if addresses is None else addresses)
+                for address in validities[uuid]:
                     address['value'] = dar_cache[dar_uuid].get('betegnelse')
 
-        logger.info('Total dar: {}, no-hit: {}'.format(total_dar, total_missing))
+        logger.info('Total dar: {}, no-hit: {}, cache hits: {}, cache misses: {}'.format(
+            total_dar, total_missing, cache_hits, cache_misses))
+
+        if self.registered_since is not None:
+            # Only the addresses registered since the snapshot were looked up,
+            # keep the previous lookups which are still in use.
+            in_use = {
+                address['dar_uuid']
+                for address_validities in self.addresses.values()
+                for address in address_validities
+                if address['dar_uuid'] is not None
+            }
+            previous = {
+                dar_uuid: address for dar_uuid, address in self.dar_cache.items()
+                if dar_uuid in in_use
+            }
+            previous.update(dar_cache)
+            dar_cache = previous
         return dar_cache
 
-    def populate_cache(self, dry_run=False, skip_associations=False):
+    def _cache_file(self, name):
+        """
+        Return the path of the snapshot file used to cache an object type.
+        :param name: Name of the cached object type, eg. 'users', or
+        'manifest' for the snapshot manifest.
+        """
+        if self.full_history:
+            return 'tmp/{}_historic.snapshot'.format(name)
+        return 'tmp/{}.snapshot'.format(name)
+
+    def _read_cache(self, name):
+        generation = self.generations.get(name, self.generation)
+        section = SnapshotSection(self._cache_file(name), name, generation)
+        setattr(self, name, section)
+
+    def _write_cache(self, name):
+        write_section(
+            self._cache_file(name), name, self.generation, getattr(self, name)
+        )
+
+    def _cache_names(self, skip_associations=False):
+        names = [
+            'facets', 'classes', 'users', 'units', 'addresses', 'engagements',
+            'managers', 'associations', 'leaves', 'roles', 'itsystems',
+            'it_connections', 'kles', 'related', 'dar_cache'
+        ]
+        if skip_associations:
+            names.remove('associations')
+        return names
+
+    def _read_snapshot(self, skip_associations=False):
+        """
+        Open the snapshot written by a previous run.
+
+        The object types are opened lazily, so objects are only read from disk
+        when they are accessed.
+        :return: The manifest of the snapshot.
+        :raises SnapshotError: If the snapshot is missing, incomplete or was
+        written with a different configuration.
+        """
+        manifest = read_manifest(
+            self._cache_file('manifest'),
+            full_history=self.full_history,
+            skip_past=self.skip_past
+        )
+        # Eg. associations are not part of the snapshot if they were skipped
+        missing = set(self._cache_names(skip_associations))
+        missing -= set(manifest['names'])
+        if missing:
+            msg = 'Incomplete LoRa cache snapshot, missing: {}'
+            raise SnapshotError(msg.format(sorted(missing)))
+
+        self.generation = manifest['generation']
+        self.generations = manifest.get('generations', {})
+        for name in self._cache_names(skip_associations):
+            self._read_cache(name)
+        return manifest
+
+    def _read_registered_since(self, skip_associations=False):
+        """
+        Open the previous snapshot as the starting point of an incremental read.
+        :return: The time the previous snapshot was read from LoRa, or None if
+        a full read is needed.
+        """
+        try:
+            manifest = self._read_snapshot(skip_associations)
+        except SnapshotError as e:
+            logger.info('{}, performing full read'.format(e))
+            return None
+        carried = set(self.generations) & set(self._cache_names(skip_associations))
+        if carried:
+            # Kept from an older snapshot, they might have changed before the
+            # snapshot was read
+            msg = 'LoRa cache snapshot has older {}, performing full read'
+            logger.info(msg.format(sorted(carried)))
+            return None
+
+        registered_since = datetime.datetime.fromisoformat(manifest['read_time'])
+        # Validities are calculated relative to today, so an old snapshot
+        # might contain rows that are no longer (or not yet) in effect.
+        now = datetime.datetime.now(DEFAULT_TIMEZONE)
+        if registered_since.date() != now.date():
+            msg = 'LoRa cache snapshot is from {}, performing full read'
+            logger.info(msg.format(registered_since.date()))
+            return None
+        return registered_since - INCREMENTAL_MARGIN
+
+    def _carried_sections(self, names):
+        """
+        Find the sections of the current snapshot which are kept by a run
+        skipping them, so a partial run does not make the snapshot incomplete.
+        :param names: The skipped object types.
+        :return: Dict from object type to the generation of its section.
+        """
+        try:
+            manifest = read_manifest(
+                self._cache_file('manifest'),
+                full_history=self.full_history,
+                skip_past=self.skip_past
+            )
+        except SnapshotError:
+            return {}
+
+        carried = {}
+        for name in names:
+            if name not in manifest['names']:
+                continue
+            generation = manifest.get('generations', {}).get(
+                name, manifest['generation'])
+            try:
+                SnapshotSection(self._cache_file(name), name, generation)
+            except SnapshotError as e:
+                logger.info('{}, not keeping {}'.format(e, name))
+                continue
+            carried[name] = generation
+        return carried
+
+    def populate_cache(self, dry_run=False, skip_associations=False,
+                       incremental=False):
         """
         Perform the actual data import.
         :param skip_associations: If associations are not needed, they can be
         skipped for increased performance.
         :param dry_run: For testing purposes it is possible to read from cache.
+        Objects are then read lazily from the snapshot of the previous run, and
+        the snapshot is not modified.
+        :param incremental: Start from the snapshot of the previous run, and only
+        process objects registered in LoRa since then. A full read is performed
+        if no usable snapshot exists.
         """
-        if self.full_history:
-            facets_file = 'tmp/facets_historic.p'
-            classes_file = 'tmp/classes_historic.p'
-            users_file = 'tmp/users_historic.p'
-            units_file = 'tmp/units_historic.p'
-            addresses_file = 'tmp/addresses_historic.p'
-            engagements_file = 'tmp/engagements_historic.p'
-            managers_file = 'tmp/managers_historic.p'
-            associations_file = 'tmp/associations_historic.p'
-            leaves_file = 'tmp/leaves_historic.p'
-            roles_file = 'tmp/roles_historic.p'
-            itsystems_file = 'tmp/itsystems_historic.p'
-            it_connections_file = 'tmp/it_connections_historic.p'
-            kles_file = 'tmp/kles_historic.p'
-            related_file = 'tmp/related_historic.p'
-        else:
-            facets_file = 'tmp/facets.p'
-            classes_file = 'tmp/classes.p'
-            users_file = 'tmp/users.p'
-            units_file = 'tmp/units.p'
-            addresses_file = 'tmp/addresses.p'
-            engagements_file = 'tmp/engagements.p'
-            managers_file = 'tmp/managers.p'
-            associations_file = 'tmp/associations.p'
-            leaves_file = 'tmp/leaves.p'
-            roles_file = 'tmp/roles.p'
-            itsystems_file = 'tmp/itsystems.p'
-            it_connections_file = 'tmp/it_connections.p'
-            kles_file = 'tmp/kles.p'
-            related_file = 'tmp/related.p'
-
+        self._derived = set()
         if dry_run:
             logger.info('LoRa cache dry run - no actual read')
-            with open(facets_file, 'rb') as f:
-                self.facets = pickle.load(f)
-            with open(classes_file, 'rb') as f:
-                self.classes = pickle.load(f)
-            with open(users_file, 'rb') as f:
-                self.users = pickle.load(f)
-            with open(units_file, 'rb') as f:
-                self.units = pickle.load(f)
-            with open(addresses_file, 'rb') as f:
-                self.addresses = pickle.load(f)
-            with open(engagements_file, 'rb') as f:
-                self.engagements = pickle.load(f)
-            with open(managers_file, 'rb') as f:
-                self.managers = pickle.load(f)
-
-            if not skip_associations:
-                with open(associations_file, 'rb') as f:
-                    self.associations = pickle.load(f)
-
-            with open(leaves_file, 'rb') as f:
-                self.leaves = pickle.load(f)
-            with open(roles_file, 'rb') as f:
-                self.roles = pickle.load(f)
-            with open(itsystems_file, 'rb') as f:
-                self.itsystems = pickle.load(f)
-            with open(it_connections_file, 'rb') as f:
-                self.it_connections = pickle.load(f)
-            with open(kles_file, 'rb') as f:
-                self.kles = pickle.load(f)
-            with open(related_file, 'rb') as f:
-                self.related = pickle.load(f)
+            self._read_snapshot(skip_associations)
             return
 
-        t = time.time()
-        msg = 'Kørselstid: {:.1f}s, {} elementer, {:.0f}/s'
+        self.registered_since = None
+        if incremental:
+            self.registered_since = self._read_registered_since(skip_associations)
+        if self.registered_since is not None:
+            logger.info('Incremental LoRa read, registered since {}'.format(
+                self.registered_since))
+        carried = {}
+        if skip_associations:
+            # Keep the associations of the previous snapshot, for the programs
+            # reading the full snapshot
+            carried = self._carried_sections(['associations'])
+        self.generation = uuid4().hex
+        self.generations = {}
+        self.changed = {}
+        read_time = datetime.datetime.now(DEFAULT_TIMEZONE)
+
+        # Stages are listed in the order they are started, each with the set
+        # of stages that must be completed before it can run.
+        stages = {
+            'facets': ('Læs facetter', self._cache_lora_facets, ()),
+            'classes': ('Læs klasser', self._cache_lora_classes, ()),
+            'users': ('Læs brugere', self._cache_lora_users, ()),
+            'units': ('Læs enheder', self._cache_lora_units, ()),
+            'addresses': ('Læs adresser', self._cache_lora_address, ()),
+            'engagements': ('Læs engagementer', self._cache_lora_engagements, ()),
+            'managers': ('Læs ledere', self._cache_lora_managers, ()),
+            'associations': ('Læs tilknytninger', self._cache_lora_associations,
+                             ()),
+            'leaves': ('Læs orlover', self._cache_lora_leaves, ()),
+            'roles': ('Læs roller', self._cache_lora_roles, ()),
+            'itsystems': ('Læs it-systemer', self._cache_lora_itsystems, ()),
+            'it_connections': ('Læs it-forbindelser',
+                               self._cache_lora_it_connections, ()),
+            'kles': ('Læs kles', self._cache_lora_kles, ()),
+            'related': ('Læs enhedssammenkobling', self._cache_lora_related, ()),
+            # DAR lookups need the dar_map built while reading addresses
+            'dar_cache': ('Læs dar', self._cache_dar, ('addresses',)),
+        }
+        if skip_associations:
+            del stages['associations']
 
         # Here we should activate read-only mode
-        logger.info('Læs facetter og klasser')
-        self.facets = self._cache_lora_facets()
-        self.classes = self._cache_lora_classes()
-        dt = time.time() - t
-        elements = len(self.classes) + len(self.facets)
-        with open(facets_file, 'wb') as f:
-            pickle.dump(self.facets, f, PICKLE_PROTOCOL)
-        with open(classes_file, 'wb') as f:
-            pickle.dump(self.classes, f, PICKLE_PROTOCOL)
-        logger.info(msg.format(dt, elements, elements/dt))
-
-        t = time.time()
-        logger.info('Læs brugere')
-        self.users = self._cache_lora_users()
-        dt = time.time() - t
-        with open(users_file, 'wb') as f:
-            pickle.dump(self.users, f, PICKLE_PROTOCOL)
-        logger.info(msg.format(dt, len(self.users), len(self.users)/dt))
-
-        t = time.time()
-        logger.info('Læs enheder')
-        self.units = self._cache_lora_units()
-        dt = time.time() - t
-        with open(units_file, 'wb') as f:
-            pickle.dump(self.units, f, PICKLE_PROTOCOL)
-        logger.info(msg.format(dt, len(self.units), len(self.units)/dt))
-
-        t = time.time()
-        logger.info('Læs adresser:')
-        self.addresses = self._cache_lora_address()
-        dt = time.time() - t
-        with open(addresses_file, 'wb') as f:
-            pickle.dump(self.addresses, f, PICKLE_PROTOCOL)
-        logger.info(msg.format(dt, len(self.addresses), len(self.addresses)/dt))
-
-        t = time.time()
-        logger.info('Læs engagementer')
-        self.engagements = self._cache_lora_engagements()
-        dt = time.time() - t
-        with open(engagements_file, 'wb') as f:
-            pickle.dump(self.engagements, f, PICKLE_PROTOCOL)
-        logger.info(msg.format(dt, len(self.engagements), len(self.engagements)/dt))
-
-        t = time.time()
-        logger.info('Læs ledere')
-        self.managers = self._cache_lora_managers()
-        dt = time.time() - t
-        with open(managers_file, 'wb') as f:
-            pickle.dump(self.managers, f, PICKLE_PROTOCOL)
-        logger.info(msg.format(dt, len(self.managers), len(self.managers)/dt))
-
-        if not skip_associations:
-            t = time.time()
-            logger.info('Læs tilknytninger')
-            self.associations = self._cache_lora_associations()
-            dt = time.time() - t
-            with open(associations_file, 'wb') as f:
-                pickle.dump(self.associations, f, PICKLE_PROTOCOL)
-                logger.info(msg.format(dt, len(self.associations),
-                                       len(self.associations)/dt))
+        self._run_stages(stages)
+        # Here we should de-activate read-only mode
 
-        t = time.time()
-        logger.info('Læs orlover')
-        self.leaves = self._cache_lora_leaves()
-        dt = time.time() - t
-        with open(leaves_file, 'wb') as f:
-            pickle.dump(self.leaves, f, PICKLE_PROTOCOL)
-        logger.info(msg.format(dt, len(self.leaves), len(self.leaves)/dt))
+        # The derived data is kept in the snapshot, so an incremental read
+        # only recalculates it for the changed objects
+        logger.info('Calculate derived data')
+        self.calculate_derived_unit_data()
+        self.calculate_primary_engagements()
+        for name in DERIVED_NAMES:
+            self._write_cache(name)
+        self._derived = set(DERIVED_NAMES)
+        # Shared by the programs reading the snapshot, see UnitTree
+        UnitTree.from_units(self.units, self.generation).save(
+            self._cache_file('unit_tree')
+        )
 
-        t = time.time()
-        logger.info('Læs roller')
-        t = time.time()
-        self.roles = self._cache_lora_roles()
-        dt = time.time() - t
-        with open(roles_file, 'wb') as f:
-            pickle.dump(self.roles, f, PICKLE_PROTOCOL)
-        logger.info(msg.format(dt, len(self.roles), len(self.roles)/dt))
+        write_manifest(self._cache_file('manifest'), {
+            'generation': self.generation,
+            'full_history': self.full_history,
+            'skip_past': self.skip_past,
+            'read_time': read_time.isoformat(),
+            'names': list(stages) + list(carried),
+            'generations': carried,
+        })
+        self.generations = carried
+
+    def populate_stream(self):
+        """
+        Prepare a streaming read of LoRa, instead of reading it into memory.
 
-        t = time.time()
-        logger.info('Læs it')
-        self.itsystems = self._cache_lora_itsystems()
-        self.it_connections = self._cache_lora_it_connections()
-        elements = len(self.itsystems) + len(self.it_connections)
-        dt = time.time() - t
-        with open(itsystems_file, 'wb') as f:
-            pickle.dump(self.itsystems, f, PICKLE_PROTOCOL)
-        with open(it_connections_file, 'wb') as f:
-            pickle.dump(self.it_connections, f, PICKLE_PROTOCOL)
-        logger.info(msg.format(dt, elements, elements/dt))
+        Only the object types needed to convert other objects (facets, classes,
+        IT systems, units and managers) are read into memory. The remaining
+        object types are read from LoRa a page at a time, each time their
+        items are iterated, so memory use is bounded by the page size.
+        """
+        logger.info('Streaming LoRa read')
+        self.registered_since = None
+        self.generation = None
+        self.generations = {}
+        self._derived = set()
+        lookups = {
+            'facets': self._cache_lora_facets,
+            'classes': self._cache_lora_classes,
+            'itsystems': self._cache_lora_itsystems,
+            'units': self._cache_lora_units,
+            'managers': self._cache_lora_managers,
+        }
+        with ThreadPoolExecutor(max_workers=self.populate_workers) as executor:
+            futures = {
+                name: executor.submit(loader) for name, loader in lookups.items()
+            }
+        for name, future in futures.items():
+            setattr(self, name, future.result())
+
+        streamed = {
+            'users': self._cache_lora_users,
+            'engagements': self._cache_lora_engagements,
+            'associations': self._cache_lora_associations,
+            'leaves': self._cache_lora_leaves,
+            'roles': self._cache_lora_roles,
+            'it_connections': self._cache_lora_it_connections,
+            'kles': self._cache_lora_kles,
+            'related': self._cache_lora_related,
+        }
+        for name, loader in streamed.items():
+            setattr(self, name, StreamedObjects(partial(self._stream_pages, loader)))
+        self.addresses = StreamedObjects(self._stream_addresses)
+        # Filled in as the addresses are streamed
+        self.dar_cache = {}
+
+    def _stream_addresses(self):
+        """Stream the addresses, looking up the DAR addresses of each page."""
+        for addresses in self._stream_pages(self._cache_lora_address):
+            self.dar_cache.update(self._cache_dar(addresses))
+            self.dar_map = defaultdict(list)
+            yield addresses
+
+    def _merge_incremental(self, name, result, seen, updated):
+        """
+        Patch the previous snapshot of an object type with updated objects.
+        :param name: Name of the cached object type, eg. 'users'.
+        :param result: The cached objects, for the updated objects only.
+        :param seen: Uuids of all objects currently found in LoRa.
+        :param updated: Uuids of the objects registered since the snapshot.
+        :return: The complete set of cached objects.
+        """
+        previous = getattr(self, name)
+        merged = {
+            uuid: value for uuid, value in previous.items()
+            if uuid in seen and uuid not in updated
+        }
+        merged.update(result)
 
-        t = time.time()
-        logger.info('Læs kles')
-        self.kles = self._cache_lora_kles()
-        dt = time.time() - t
-        with open(kles_file, 'wb') as f:
-            pickle.dump(self.kles, f, PICKLE_PROTOCOL)
-        logger.info(msg.format(dt, len(self.kles), len(self.kles)/dt))
+        removed = previous.keys() - seen
+        self.changed[name] = {
+            uuid: (previous.get(uuid, []), merged.get(uuid, []))
+            for uuid in updated | removed
+        }
+        logger.info('{}: {} opdaterede, {} fjernede'.format(
+            name, len(updated), len(removed)))
+        return merged
 
+    def _run_stage(self, name, description, loader):
+        """
+        Run a single cache stage, store the result on self and in the snapshot.
+        :param name: Name of the cached object type, eg. 'users'.
+        :param description: Log message for the stage.
+        :param loader: Function returning the cached objects.
+        """
+        logger.info(description)
         t = time.time()
-        logger.info('Læs enhedssammenkobling')
-        self.related = self._cache_lora_related()
+        self._lookup_state.lookup = None
+        result = loader()
+        lookup = self._lookup_state.lookup
+        if self.registered_since is not None and lookup is not None:
+            result = self._merge_incremental(name, result, *lookup)
         dt = time.time() - t
-        with open(related_file, 'wb') as f:
-            pickle.dump(self.related, f, pickle.HIGHEST_PROTOCOL)
-        logger.info(msg.format(dt, len(self.related), len(self.related)/dt))
+        setattr(self, name, result)
+        if name not in DERIVED_NAMES:
+            self._write_cache(name)
+        msg = 'Kørselstid: {:.1f}s, {} elementer, {:.0f}/s'
+        logger.info(msg.format(dt, len(result), len(result) / max(dt, 1e-9)))
 
-        t = time.time()
-        logger.info('Læs dar')
-        self.dar_cache = self._cache_dar()
-        dt = time.time() - t
-        #with open(cache_file, 'wb') as f:
-        #    pickle.dump(self.dar_cache, f, pickle.HIGHEST_PROTOCOL)
-        logger.info(msg.format(dt, len(self.dar_cache), len(self.dar_cache)/dt))
+    def _run_stages(self, stages):
+        """
+        Run cache stages in parallel, respecting their dependencies.
 
+        A stage is started as soon as all the stages it depends on are done,
+        using at most self.populate_workers concurrent stages.
+        :param stages: Dict from stage name to a 3-tuple of description,
+        loader and names of the stages it depends on.
+        """
+        done = set()
+        waiting = dict(stages)
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.populate_workers) as executor:
+            while waiting or running:
+                ready = [
+                    name for name, (_, _, dependencies) in waiting.items()
+                    if done.issuperset(dependencies)
+                ]
+                for name in ready:
+                    description, loader, _ = waiting.pop(name)
+                    future = executor.submit(
+                        self._run_stage, name, description, loader
+                    )
+                    running[future] = name
+                if not running:
+                    msg = 'Unsatisfiable cache stage dependencies: {}'
+                    raise Exception(msg.format(sorted(waiting)))
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        future.result()
+                    except Exception:
+                        for other in running:
+                            other.cancel()
+                        raise
+                    done.add(name)
+
+
+class StreamedObjects(object):
+    """
+    Stand-in for the cached objects of a type, which are read from LoRa a
+    page at a time each time they are iterated with items().
+    """
+
+    def __init__(self, stream):
+        """
+        :param stream: Function returning an iterator of dicts, each holding
+        the cached objects of one page.
+        """
+        self._stream = stream
 
-        # Here we should de-activate read-only mode
+    def items(self):
+        for objects in self._stream():
+            yield from objects.items()
 
 
 @click.command()
 @click.option("--historic/--no-historic", default=True, help="Do full historic export")
 @click.option("--resolve-dar/--no-resolve-dar", default=False, help="Resolve DAR addresses")
-def cli(historic, resolve_dar):
+@click.option("--incremental/--no-incremental", default=False,
+              help="Only read objects changed since the previous run")
+def cli(historic, resolve_dar, incremental):
     lc = LoraCache(
         full_history=historic,
         skip_past=True,
         resolve_dar=resolve_dar
     )
-    lc.populate_cache(dry_run=False)
-
-    logger.info('Now calcualate derived data')
-    lc.calculate_derived_unit_data()
-    lc.calculate_primary_engagements()
+    # The derived data is calculated and stored by populate_cache
+    lc.populate_cache(dry_run=False, incremental=incremental)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,118 @@
+"""Compact records for the LoraCache.
+
+By default the LoraCache stores every validity of an object as a plain dict,
+which repeats the keys of the dict for each of the potentially millions of
+validities in a historic cache. The records in this module store the values
+in ``__slots__`` instead, and intern the string values, most of which (class
+uuids, unit uuids and dates) are shared between many records.
+
+The records implement the mutable mapping interface, so code reading the
+cache (eg. ``lc.users[uuid][0]['cpr']``) works with either representation.
+Only the keys of the record type can be set, keys which are declared but not
+set (eg. derived data which has not been calculated) are not in the record.
+"""
+import sys
+from collections.abc import MutableMapping
+
+
+def _intern(value):
+    if isinstance(value, str):
+        return sys.intern(value)
+    return value
+
+
+class Record(MutableMapping):
+    """Base class for compact records, subclasses declare their keys as slots."""
+
+    __slots__ = ()
+
+    def __init__(self, **values):
+        for key, value in values.items():
+            self[key] = value
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, _intern(value))
+
+    def __delitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        try:
+            delattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __iter__(self):
+        return (key for key in self.__slots__ if hasattr(self, key))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __getstate__(self):
+        return dict(self)
+
+    def __setstate__(self, state):
+        # Strings are interned again when read from a snapshot
+        self.update(state)
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, dict(self))
+
+
+class UserRecord(Record):
+    __slots__ = (
+        'uuid', 'cpr', 'user_key', 'fornavn', 'efternavn', 'navn',
+        'kaldenavn_fornavn', 'kaldenavn_efternavn', 'kaldenavn',
+        'from_date', 'to_date',
+    )
+
+
+class UnitRecord(Record):
+    __slots__ = (
+        'uuid', 'user_key', 'name', 'unit_type', 'level', 'parent',
+        'from_date', 'to_date',
+        # Derived data, see LoraCache.calculate_derived_unit_data
+        'location', 'manager_uuid', 'acting_manager_uuid',
+    )
+
+
+class EngagementRecord(Record):
+    __slots__ = (
+        'uuid', 'user', 'unit', 'fraction', 'user_key', 'engagement_type',
+        'primary_type', 'job_function', 'extensions', 'from_date', 'to_date',
+        # Derived data, see LoraCache.calculate_primary_engagements
+        'primary_boolean',
+    )
+
+
+class AddressRecord(Record):
+    __slots__ = (
+        'uuid', 'user', 'unit', 'value', 'scope', 'dar_uuid', 'adresse_type',
+        'visibility', 'from_date', 'to_date',
+    )
+
+
+class ManagerRecord(Record):
+    __slots__ = (
+        'uuid', 'user', 'unit', 'manager_type', 'manager_level',
+        'manager_responsibility', 'from_date', 'to_date',
+    )
+
+
+# Record type for each of the compactable object types in the LoraCache
+RECORD_TYPES = {
+    'users': UserRecord,
+    'units': UnitRecord,
+    'engagements': EngagementRecord,
+    'addresses': AddressRecord,
+    'managers': ManagerRecord,
+}
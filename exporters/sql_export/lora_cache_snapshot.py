@@ -0,0 +1,170 @@
+"""On-disk snapshots of the LoraCache.
+
+A snapshot consists of a manifest and one section file per cached object type
+(users, units, engagements, ...). A section file contains the pickled value of
+each object, followed by an index from uuid to the position of the value in
+the file. Sections are opened memory-mapped, and values are only unpickled when
+they are looked up, so a consumer needing a few objects does not pay for
+deserialising the entire cache.
+
+The manifest records the schema version and the generation of the snapshot.
+Every section carries the generation it was written with, so a section left
+over from another run is rejected, instead of being mixed into the snapshot.
+"""
+import json
+import mmap
+import os
+import pickle
+import struct
+from collections.abc import Mapping
+from uuid import uuid4
+
+SCHEMA_VERSION = 1
+
+PICKLE_PROTOCOL = pickle.DEFAULT_PROTOCOL
+
+MAGIC = b'LORACACH'
+# Magic, schema version and the offset of the index
+PREAMBLE = struct.Struct('<8sIQ')
+
+
+class SnapshotError(Exception):
+    """Raised when a snapshot is missing, stale or inconsistent."""
+
+
+def _replace_atomically(path, mode, write):
+    """Write a file next to its destination and move it into place.
+
+    The temporary file has a unique name, so concurrent writers of the same
+    file do not write into each other's file, the last one to finish wins.
+
+    Args:
+        path: Path of the file.
+        mode: Mode to create the temporary file with, 'x' or 'xb'.
+        write: Function writing the content to the open file.
+    """
+    tmp_path = '{}.{}.tmp'.format(path, uuid4().hex)
+    f = open(tmp_path, mode)
+    try:
+        with f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def write_section(path, name, generation, objects):
+    """Write the cached objects of one object type to a section file.
+
+    The file is written next to its destination and moved into place, so
+    readers holding the previous file open are not affected.
+
+    Args:
+        path: Path of the section file.
+        name: Name of the object type, eg. 'users'.
+        generation: The generation of the snapshot the section belongs to.
+        objects: Map from uuid to the cached value.
+    """
+    def write(f):
+        index = {}
+        f.write(PREAMBLE.pack(MAGIC, SCHEMA_VERSION, 0))
+        for uuid, value in objects.items():
+            data = pickle.dumps(value, PICKLE_PROTOCOL)
+            index[uuid] = (f.tell(), len(data))
+            f.write(data)
+
+        index_offset = f.tell()
+        header = {'name': name, 'generation': generation}
+        pickle.dump((header, index), f, PICKLE_PROTOCOL)
+        f.seek(0)
+        f.write(PREAMBLE.pack(MAGIC, SCHEMA_VERSION, index_offset))
+
+    _replace_atomically(path, 'xb', write)
+
+
+class SnapshotSection(Mapping):
+    """Read-only, lazily deserialised view of a section file.
+
+    Values are unpickled on first access and kept, so modifications made to
+    a value (eg. derived data) are seen by later lookups.
+    """
+
+    def __init__(self, path, name, generation):
+        try:
+            with open(path, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            raise SnapshotError('Unable to open {}: {}'.format(path, e))
+
+        magic, version, index_offset = PREAMBLE.unpack_from(self._mmap)
+        if magic != MAGIC:
+            raise SnapshotError('{} is not a LoraCache snapshot'.format(path))
+        if version != SCHEMA_VERSION:
+            msg = '{} has schema version {}, expected {}'
+            raise SnapshotError(msg.format(path, version, SCHEMA_VERSION))
+
+        header, self._index = pickle.loads(self._mmap[index_offset:])
+        if header != {'name': name, 'generation': generation}:
+            msg = '{} does not belong to the snapshot, expected {} got {}'
+            raise SnapshotError(msg.format(
+                path, {'name': name, 'generation': generation}, header))
+        self._values = {}
+
+    def __getitem__(self, uuid):
+        if uuid not in self._values:
+            offset, length = self._index[uuid]
+            self._values[uuid] = pickle.loads(self._mmap[offset:offset + length])
+        return self._values[uuid]
+
+    def __contains__(self, uuid):
+        return uuid in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+
+def write_manifest(path, manifest):
+    """Write the manifest, making the snapshot it describes current.
+
+    Args:
+        path: Path of the manifest file.
+        manifest: Dict with at least 'generation' and 'names', the latter
+            being the object types included in the snapshot.
+    """
+    _replace_atomically(
+        path, 'x', lambda f: json.dump(dict(manifest, version=SCHEMA_VERSION), f)
+    )
+
+
+def read_manifest(path, **expected):
+    """Read the manifest, and check that it describes a usable snapshot.
+
+    Args:
+        path: Path of the manifest file.
+        expected: Manifest values that must match, eg. full_history=True.
+
+    Returns:
+        dict: The manifest.
+
+    Raises:
+        SnapshotError: If the manifest is missing, or from another version
+            or configuration.
+    """
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        raise SnapshotError('Unable to read manifest {}: {}'.format(path, e))
+
+    if manifest.get('version') != SCHEMA_VERSION:
+        msg = 'Snapshot has schema version {}, expected {}'
+        raise SnapshotError(msg.format(manifest.get('version'), SCHEMA_VERSION))
+    for key, value in expected.items():
+        if manifest.get(key) != value:
+            msg = 'Snapshot has {} = {}, expected {}'
+            raise SnapshotError(msg.format(key, manifest.get(key), value))
+    return manifest
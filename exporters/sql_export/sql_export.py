@@ -1,3 +1,4 @@
+import os
 import json
 import atexit
 import logging
@@ -5,8 +6,11 @@ import pathlib
 import argparse
 import urllib.parse
 import datetime
+import time
+from uuid import uuid4
 
-from sqlalchemy import create_engine, Index
+from more_itertools import chunked
+from sqlalchemy import create_engine, inspect, select, Index
 from sqlalchemy.orm import sessionmaker
 
 from exporters.sql_export.lora_cache import LoraCache
@@ -24,6 +28,9 @@ LOG_FILE = 'sql_export.log'
 
 logger = logging.getLogger('SqlExport')
 
+# Number of rows sent to the database in each INSERT when bulk inserting
+DEFAULT_BATCH_SIZE = 5000
+
 
 class SqlExport(object):
     def __init__(self, force_sqlite=False, historic=False, settings=None):
@@ -54,8 +61,10 @@ class SqlExport(object):
         pw_raw = self.settings.get('exporters.actual_state.password', '')
         pw = urllib.parse.quote_plus(pw_raw)
         engine_settings = {"pool_pre_ping": True}
+        self.db_type = db_type
         if db_type == 'SQLite':
-            db_string = 'sqlite:///{}.db'.format(db_name)
+            self.db_file = '{}.db'.format(db_name)
+            db_string = 'sqlite:///{}'.format(self.db_file)
         elif db_type == 'MS-SQL':
             db_string = 'mssql+pymssql://{}:{}@{}/{}'.format(
                 user, pw, db_host, db_name)
@@ -76,15 +85,59 @@ class SqlExport(object):
 
         self.engine = create_engine(db_string, **engine_settings)
 
-    def perform_export(self, resolve_dar=True, use_pickle=False):
+        # Bulk insert rows with executemany, or fall back to adding an ORM
+        # object to the session per row
+        self.bulk_insert = self.settings.get(
+            'exporters.actual_state.bulk_insert', True)
+        self.batch_size = self.settings.get(
+            'exporters.actual_state.batch_size', DEFAULT_BATCH_SIZE)
+
+        # Write the export to a shadow database and swap it in when complete,
+        # instead of rewriting the live tables
+        self.atomic_swap = self.settings.get(
+            'exporters.actual_state.atomic_swap', False)
+        self.shadow_schema = self.settings.get(
+            'exporters.actual_state.shadow_schema', '{}_shadow'.format(db_name))
+        self.generation = None
+
+    def perform_export(self, resolve_dar=True, use_pickle=False, incremental=False,
+                       streaming=False):
+        if streaming and (not self.historic or use_pickle or incremental):
+            msg = 'Streaming is only supported for a full read of the historic export'
+            logger.error(msg)
+            raise Exception(msg)
+
+        # Identifies this export in the receipt table
+        self.generation = uuid4().hex
+
+        live_engine = self.engine
+        if self.atomic_swap:
+            self.engine = self._shadow_engine()
+        try:
+            self._export(resolve_dar, use_pickle, incremental, streaming,
+                         live_engine)
+            if self.atomic_swap:
+                self.session.close()
+                self._swap(live_engine)
+        finally:
+            self.engine = live_engine
+
+    def _export(self, resolve_dar, use_pickle, incremental, streaming, live_engine):
         def timestamp():
             return datetime.datetime.now()
 
-        trunc_tables=dict(Base.metadata.tables)
-        trunc_tables.pop("kvittering")
+        if self.atomic_swap:
+            # The shadow database starts empty, except for the receipts
+            Base.metadata.drop_all(self.engine)
+            Base.metadata.create_all(self.engine)
+            self._copy_receipts(live_engine)
+        else:
+            trunc_tables=dict(Base.metadata.tables)
+            trunc_tables.pop("kvittering")
 
-        Base.metadata.drop_all(self.engine, tables=trunc_tables.values())
-        Base.metadata.create_all(self.engine)
+            Base.metadata.drop_all(self.engine, tables=trunc_tables.values())
+            Base.metadata.create_all(self.engine)
+            self._upgrade_receipts(self.engine)
         Session = sessionmaker(bind=self.engine, autoflush=False)
         self.session = Session()
 
@@ -92,16 +145,27 @@ class SqlExport(object):
         kvittering = self._add_receipt(query_time)
         if self.historic:
             self.lc = LoraCache(resolve_dar=resolve_dar, full_history=True)
-            self.lc.populate_cache(dry_run=use_pickle)
+            if streaming:
+                # Objects are read from LoRa as they are written to the tables
+                self.lc.populate_stream()
+            else:
+                self.lc.populate_cache(dry_run=use_pickle, incremental=incremental)
         else:
             self.lc = LoraCache(resolve_dar=resolve_dar)
-            self.lc.populate_cache(dry_run=use_pickle)
+            self.lc.populate_cache(dry_run=use_pickle, incremental=incremental)
             self.lc.calculate_derived_unit_data()
             self.lc.calculate_primary_engagements()
 
         start_delivery_time = timestamp()
         self._update_receipt(kvittering, start_delivery_time)
 
+        self._export_cache()
+
+        end_delivery_time = timestamp()
+        self._update_receipt(kvittering, start_delivery_time, end_delivery_time)
+
+    def _export_cache(self):
+        """Write the contents of the LoraCache to the (empty) tables."""
         self._add_classification()
         self._add_users_and_units()
         self._add_addresses()
@@ -112,9 +176,142 @@ class SqlExport(object):
         self._add_it_systems()
         self._add_kles()
         self._add_related()
+        self._create_indexes()
+
+    def _create_indexes(self):
+        # Indexes are created after the tables are filled, when rewriting
+        # whole tables this is quicker than maintaining the index for every
+        # row inserted
+        logger.info('Create indexes')
+        # Supplementary index for quick toplevel lookup
+        organisatorisk_sti_index = Index(
+            "organisatorisk_sti_index",
+            Enhed.organisatorisk_sti
+        )
+        try:
+            organisatorisk_sti_index.create(bind=self.engine)
+        finally:
+            # The index is attached to the table definition when constructed,
+            # detach it so later calls to create_all do not create it before
+            # the table is filled
+            Enhed.__table__.indexes.discard(organisatorisk_sti_index)
+
+    def _shadow_file(self):
+        return '{}.shadow'.format(self.db_file)
+
+    def _shadow_engine(self):
+        """Return an engine writing to the shadow copy of the database.
+
+        For SQLite the shadow is a separate file, for database servers it is
+        a schema (a database on Mysql) holding the shadow tables.
+        """
+        if self.db_type == 'SQLite':
+            return create_engine('sqlite:///{}'.format(self._shadow_file()))
+
+        if self.shadow_schema not in inspect(self.engine).get_schema_names():
+            logger.info('Create schema {}'.format(self.shadow_schema))
+            quote = self.engine.dialect.identifier_preparer.quote
+            self.engine.execute('CREATE SCHEMA {}'.format(
+                quote(self.shadow_schema)))
+        return self.engine.execution_options(
+            schema_translate_map={None: self.shadow_schema})
+
+    def _upgrade_receipts(self, engine):
+        """Add the generation column to receipt tables created without it."""
+        columns = inspect(engine).get_columns(Kvittering.__tablename__)
+        if 'generation' not in {column['name'] for column in columns}:
+            logger.info('Add generation column to kvittering')
+            column = Kvittering.__table__.c.generation
+            engine.execute('ALTER TABLE {} ADD {} {}'.format(
+                Kvittering.__tablename__, column.name,
+                column.type.compile(engine.dialect)))
+
+    def _copy_receipts(self, live_engine):
+        """Copy the receipts of previous exports to the shadow database."""
+        if not inspect(live_engine).has_table(Kvittering.__tablename__):
+            return
+        # Select the columns present, the live table might be without the
+        # generation column
+        table = Kvittering.__table__
+        live_columns = inspect(live_engine).get_columns(table.name)
+        columns = [table.c[column['name']] for column in live_columns]
+        receipts = [dict(row) for row in live_engine.execute(select(columns))]
+        if receipts:
+            self.engine.execute(table.insert(), receipts)
+
+    def _swap(self, live_engine):
+        """Replace the live tables with the shadow tables in one step.
+
+        Readers see either the previous or the new export, and are not
+        blocked while the export is written.
+        """
+        logger.info('Swap in generation {}'.format(self.generation))
+        if self.db_type == 'SQLite':
+            # Connections opened before the swap keep reading the old file
+            self.engine.dispose()
+            live_engine.dispose()
+            os.replace(self._shadow_file(), self.db_file)
+            return
+
+        quote = live_engine.dialect.identifier_preparer.quote
+        shadow = quote(self.shadow_schema)
+        live_tables = set(inspect(live_engine).get_table_names())
+        tables = Base.metadata.sorted_tables
+        if self.db_type == 'Mysql':
+            # RENAME TABLE renames all the tables atomically
+            renames = []
+            for table in tables:
+                name = quote(table.name)
+                if table.name in live_tables:
+                    renames.append('{} TO {}.{}'.format(
+                        name, shadow, quote(table.name + '_retired')))
+                renames.append('{}.{} TO {}'.format(shadow, name, name))
+            with live_engine.begin() as connection:
+                connection.execute('RENAME TABLE {}'.format(', '.join(renames)))
+                for table in reversed(tables):
+                    if table.name in live_tables:
+                        connection.execute('DROP TABLE {}.{}'.format(
+                            shadow, quote(table.name + '_retired')))
+        else:
+            # DDL is transactional on MS-SQL, the swap is committed as a whole
+            live_schema = quote(inspect(live_engine).default_schema_name)
+            with live_engine.begin() as connection:
+                for table in reversed(tables):
+                    if table.name in live_tables:
+                        connection.execute('DROP TABLE {}.{}'.format(
+                            live_schema, quote(table.name)))
+                for table in tables:
+                    connection.execute('ALTER SCHEMA {} TRANSFER {}.{}'.format(
+                        live_schema, shadow, quote(table.name)))
+
+    def _insert(self, model, rows):
+        """Insert rows into the table of a model, and commit.
+
+        :param model: The table definition, eg. Bruger.
+        :param rows: Iterable of dicts from column name to value.
+        :return: The number of rows inserted.
+        """
+        start = time.monotonic()
+        count = 0
+        if self.bulk_insert:
+            table = model.__table__
+            for batch in chunked(rows, self.batch_size):
+                # executemany requires the same columns in every row, columns
+                # left out are NULL as when adding ORM objects
+                columns = set().union(*batch)
+                batch = [{c: row.get(c) for c in columns} for row in batch]
+                self.session.execute(table.insert(), batch)
+                count += len(batch)
+        else:
+            for row in rows:
+                self.session.add(model(**row))
+                count += 1
+        self.session.commit()
 
-        end_delivery_time = timestamp()
-        self._update_receipt(kvittering, start_delivery_time, end_delivery_time)
+        elapsed = time.monotonic() - start
+        logger.info('Inserted {} rows into {} in {:.1f}s, {:.0f} rows/s'.format(
+            count, model.__tablename__, elapsed, count / max(elapsed, 1e-6)))
+        return count
 
     def at_exit(self):
         logger.info('*SQL export ended*')
@@ -123,24 +320,25 @@ class SqlExport(object):
         logger.info('Add classification')
         print('Add classification')
         logger.info('Add classification')
-        for facet, facet_info in self.lc.facets.items():
-            sql_facet = Facet(
-                uuid=facet,
-                bvn=facet_info['user_key'],
-            )
-            self.session.add(sql_facet)
-        self.session.commit()
 
-        for klasse, klasse_info in self.lc.classes.items():
-            sql_class = Klasse(
-                uuid=klasse,
-                bvn=klasse_info['user_key'],
-                titel=klasse_info['title'],
-                facet_uuid=klasse_info['facet'],
-                facet_bvn=self.lc.facets[klasse_info['facet']]['user_key']
-            )
-            self.session.add(sql_class)
-        self.session.commit()
+        def facets():
+            for facet, facet_info in self.lc.facets.items():
+                yield dict(
+                    uuid=facet,
+                    bvn=facet_info['user_key'],
+                )
+        self._insert(Facet, facets())
+
+        def classes():
+            for klasse, klasse_info in self.lc.classes.items():
+                yield dict(
+                    uuid=klasse,
+                    bvn=klasse_info['user_key'],
+                    titel=klasse_info['title'],
+                    facet_uuid=klasse_info['facet'],
+                    facet_bvn=self.lc.facets[klasse_info['facet']]['user_key']
+                )
+        self._insert(Klasse, classes())
 
         if output:
             for result in self.engine.execute('select * from facetter limit 4'):
@@ -151,56 +349,50 @@ class SqlExport(object):
     def _add_users_and_units(self, output=False):
         logger.info('Add users and units')
         print('Add users and units')
-        for user, user_effects in self.lc.users.items():
-            for user_info in user_effects:
-                sql_user = Bruger(
-                    uuid=user,
-                    bvn=user_info['user_key'],
-                    fornavn=user_info['fornavn'],
-                    efternavn=user_info['efternavn'],
-                    kaldenavn_fornavn=user_info['kaldenavn_fornavn'],
-                    kaldenavn_efternavn=user_info['kaldenavn_efternavn'],
-                    cpr=user_info['cpr'],
-                    startdato=user_info['from_date'],
-                    slutdato=user_info['to_date'],
-                )
-                self.session.add(sql_user)
-
-        for unit, unit_validities in self.lc.units.items():
-            for unit_info in unit_validities:
-                location = unit_info.get('location')
-                manager_uuid = unit_info.get('manager_uuid')
-                acting_manager_uuid = unit_info.get('acting_manager_uuid')
-
-                unit_type = unit_info['unit_type']
-                enhedsniveau_titel = ''
-                if unit_info['level']:
-                    enhedsniveau_titel = self.lc.classes[unit_info['level']]['title']
-                sql_unit = Enhed(
-                    uuid=unit,
-                    navn=unit_info['name'],
-                    forældreenhed_uuid=unit_info['parent'],
-                    enhedstype_uuid=unit_type,
-                    enhedsniveau_uuid=unit_info['level'],
-                    organisatorisk_sti=location,
-                    leder_uuid=manager_uuid,
-                    fungerende_leder_uuid=acting_manager_uuid,
-                    enhedstype_titel=self.lc.classes[unit_type]['title'],
-                    enhedsniveau_titel=enhedsniveau_titel,
-                    startdato=unit_info['from_date'],
-                    slutdato=unit_info['to_date']
-                )
-                self.session.add(sql_unit)
-        self.session.commit()
 
-        # create supplementary index for quick toplevel lookup
-        # when rewriting whole table this is quicker than maintaining
-        # the index for every row inserted
-        organisatorisk_sti_index = Index(
-            "organisatorisk_sti_index",
-            Enhed.organisatorisk_sti
-        )
-        organisatorisk_sti_index.create(bind=self.engine)
+        def users():
+            for user, user_effects in self.lc.users.items():
+                for user_info in user_effects:
+                    yield dict(
+                        uuid=user,
+                        bvn=user_info['user_key'],
+                        fornavn=user_info['fornavn'],
+                        efternavn=user_info['efternavn'],
+                        kaldenavn_fornavn=user_info['kaldenavn_fornavn'],
+                        kaldenavn_efternavn=user_info['kaldenavn_efternavn'],
+                        cpr=user_info['cpr'],
+                        startdato=user_info['from_date'],
+                        slutdato=user_info['to_date'],
+                    )
+        self._insert(Bruger, users())
+
+        def units():
+            for unit, unit_validities in self.lc.units.items():
+                for unit_info in unit_validities:
+                    location = unit_info.get('location')
+                    manager_uuid = unit_info.get('manager_uuid')
+                    acting_manager_uuid = unit_info.get('acting_manager_uuid')
+
+                    unit_type = unit_info['unit_type']
+                    enhedsniveau_titel = ''
+                    if unit_info['level']:
+                        enhedsniveau_titel = self.lc.classes[
+                            unit_info['level']]['title']
+                    yield dict(
+                        uuid=unit,
+                        navn=unit_info['name'],
+                        forældreenhed_uuid=unit_info['parent'],
+                        enhedstype_uuid=unit_type,
+                        enhedsniveau_uuid=unit_info['level'],
+                        organisatorisk_sti=location,
+                        leder_uuid=manager_uuid,
+                        fungerende_leder_uuid=acting_manager_uuid,
+                        enhedstype_titel=self.lc.classes[unit_type]['title'],
+                        enhedsniveau_titel=enhedsniveau_titel,
+                        startdato=unit_info['from_date'],
+                        slutdato=unit_info['to_date']
+                    )
+        self._insert(Enhed, units())
 
         if output:
             for result in self.engine.execute('select * from brugere limit 5'):
@@ -211,35 +403,36 @@ class SqlExport(object):
     def _add_engagements(self, output=False):
         logger.info('Add engagements')
         print('Add engagements')
-        for engagement, engagement_validity in self.lc.engagements.items():
-            for engagement_info in engagement_validity:
-                if engagement_info['primary_type'] is not None:
-                    primærtype_titel = self.lc.classes[
-                        engagement_info['primary_type']]['title']
-                else:
-                    primærtype_titel = ''
-
-                sql_engagement = Engagement(
-                    uuid=engagement,
-                    enhed_uuid=engagement_info['unit'],
-                    bruger_uuid=engagement_info['user'],
-                    bvn=engagement_info['user_key'],
-                    primærtype_uuid=engagement_info['primary_type'],
-                    stillingsbetegnelse_uuid=engagement_info['job_function'],
-                    engagementstype_uuid=engagement_info['engagement_type'],
-                    primær_boolean=engagement_info.get('primary_boolean'),
-                    arbejdstidsfraktion=engagement_info['fraction'],
-                    engagementstype_titel=self.lc.classes[
-                        engagement_info['engagement_type']]['title'],
-                    stillingsbetegnelse_titel=self.lc.classes[
-                        engagement_info['job_function']]['title'],
-                    primærtype_titel=primærtype_titel,
-                    startdato=engagement_info['from_date'],
-                    slutdato=engagement_info['to_date'],
-                    **engagement_info['extensions']
-                )
-                self.session.add(sql_engagement)
-        self.session.commit()
+
+        def engagements():
+            for engagement, engagement_validity in self.lc.engagements.items():
+                for engagement_info in engagement_validity:
+                    if engagement_info['primary_type'] is not None:
+                        primærtype_titel = self.lc.classes[
+                            engagement_info['primary_type']]['title']
+                    else:
+                        primærtype_titel = ''
+
+                    yield dict(
+                        uuid=engagement,
+                        enhed_uuid=engagement_info['unit'],
+                        bruger_uuid=engagement_info['user'],
+                        bvn=engagement_info['user_key'],
+                        primærtype_uuid=engagement_info['primary_type'],
+                        stillingsbetegnelse_uuid=engagement_info['job_function'],
+                        engagementstype_uuid=engagement_info['engagement_type'],
+                        primær_boolean=engagement_info.get('primary_boolean'),
+                        arbejdstidsfraktion=engagement_info['fraction'],
+                        engagementstype_titel=self.lc.classes[
+                            engagement_info['engagement_type']]['title'],
+                        stillingsbetegnelse_titel=self.lc.classes[
+                            engagement_info['job_function']]['title'],
+                        primærtype_titel=primærtype_titel,
+                        startdato=engagement_info['from_date'],
+                        slutdato=engagement_info['to_date'],
+                        **engagement_info['extensions']
+                    )
+        self._insert(Engagement, engagements())
 
         if output:
             for result in self.engine.execute('select * from engagementer limit 5'):
@@ -248,39 +441,41 @@ class SqlExport(object):
     def _add_addresses(self, output=False):
         logger.info('Add addresses')
         print('Add addresses')
-        for address, address_validities in self.lc.addresses.items():
-            for address_info in address_validities:
-                visibility_text = None
-                if address_info['visibility'] is not None:
-                    visibility_text = self.lc.classes[
-                        address_info['visibility']]['title']
-                visibility_scope = None
-                if address_info['visibility'] is not None:
-                    visibility_scope = self.lc.classes[
-                        address_info['visibility']]['scope']
-
-                sql_address = Adresse(
-                    uuid=address,
-                    enhed_uuid=address_info['unit'],
-                    bruger_uuid=address_info['user'],
-                    værdi=address_info['value'],
-                    dar_uuid=address_info['dar_uuid'],
-                    adressetype_uuid=address_info['adresse_type'],
-                    adressetype_bvn=self.lc.classes[
-                        address_info['adresse_type']
-                    ]['user_key'],
-                    adressetype_scope=address_info['scope'],
-                    adressetype_titel=self.lc.classes[
-                        address_info['adresse_type']
-                    ]['title'],
-                    synlighed_uuid=address_info['visibility'],
-                    synlighed_scope=visibility_scope,
-                    synlighed_titel=visibility_text,
-                    startdato=address_info['from_date'],
-                    slutdato=address_info['to_date']
-                )
-                self.session.add(sql_address)
-        self.session.commit()
+
+        def addresses():
+            for address, address_validities in self.lc.addresses.items():
+                for address_info in address_validities:
+                    visibility_text = None
+                    if address_info['visibility'] is not None:
+                        visibility_text = self.lc.classes[
+                            address_info['visibility']]['title']
+                    visibility_scope = None
+                    if address_info['visibility'] is not None:
+                        visibility_scope = self.lc.classes[
+                            address_info['visibility']]['scope']
+
+                    yield dict(
+                        uuid=address,
+                        enhed_uuid=address_info['unit'],
+                        bruger_uuid=address_info['user'],
+                        værdi=address_info['value'],
+                        dar_uuid=address_info['dar_uuid'],
+                        adressetype_uuid=address_info['adresse_type'],
+                        adressetype_bvn=self.lc.classes[
+                            address_info['adresse_type']
+                        ]['user_key'],
+                        adressetype_scope=address_info['scope'],
+                        adressetype_titel=self.lc.classes[
+                            address_info['adresse_type']
+                        ]['title'],
+                        synlighed_uuid=address_info['visibility'],
+                        synlighed_scope=visibility_scope,
+                        synlighed_titel=visibility_text,
+                        startdato=address_info['from_date'],
+                        slutdato=address_info['to_date']
+                    )
+        self._insert(Adresse, addresses())
+
         if output:
             for result in self.engine.execute('select * from adresser limit 10'):
                 print(result.items())
@@ -288,14 +483,17 @@ class SqlExport(object):
     def _add_dar_addresses(self, output=False):
         logger.info('Add DAR addresses')
         print('Add DAR addresses')
-        for address, address_info in self.lc.dar_cache.items():
-            sql_address = DARAdresse(
-                uuid=address,
-                **{key: value for key, value in address_info.items()
-                   if key in DARAdresse.__table__.columns.keys() and key != "id"}
-            )
-            self.session.add(sql_address)
-        self.session.commit()
+
+        def dar_addresses():
+            columns = DARAdresse.__table__.columns.keys()
+            for address, address_info in self.lc.dar_cache.items():
+                yield dict(
+                    uuid=address,
+                    **{key: value for key, value in address_info.items()
+                       if key in columns and key != "id"}
+                )
+        self._insert(DARAdresse, dar_addresses())
+
         if output:
             for result in self.engine.execute('select * from dar_adresser limit 10'):
                 print(result.items())
@@ -303,48 +501,53 @@ class SqlExport(object):
     def _add_associactions_leaves_and_roles(self, output=False):
         logger.info('Add associactions leaves and roles')
         print('Add associactions leaves and roles')
-        for association, association_validity in self.lc.associations.items():
-            for association_info in association_validity:
-                sql_association = Tilknytning(
-                    uuid=association,
-                    bruger_uuid=association_info['user'],
-                    enhed_uuid=association_info['unit'],
-                    bvn=association_info['user_key'],
-                    tilknytningstype_uuid=association_info['association_type'],
-                    tilknytningstype_titel=self.lc.classes[
-                        association_info['association_type']]['title'],
-                    startdato=association_info['from_date'],
-                    slutdato=association_info['to_date']
-                )
-                self.session.add(sql_association)
-
-        for role, role_validity in self.lc.roles.items():
-            for role_info in role_validity:
-                sql_role = Rolle(
-                    uuid=role,
-                    bruger_uuid=role_info['user'],
-                    enhed_uuid=role_info['unit'],
-                    rolletype_uuid=role_info['role_type'],
-                    rolletype_titel=self.lc.classes[role_info['role_type']]['title'],
-                    startdato=role_info['from_date'],
-                    slutdato=role_info['to_date']
-                )
-                self.session.add(sql_role)
-
-        for leave, leave_validity in self.lc.leaves.items():
-            for leave_info in leave_validity:
-                leave_type = leave_info['leave_type']
-                sql_leave = Orlov(
-                    uuid=leave,
-                    bvn=leave_info['user_key'],
-                    bruger_uuid=leave_info['user'],
-                    orlovstype_uuid=leave_type,
-                    orlovstype_titel=self.lc.classes[leave_type]['title'],
-                    startdato=leave_info['from_date'],
-                    slutdato=leave_info['to_date']
-                )
-                self.session.add(sql_leave)
-        self.session.commit()
+
+        def associations():
+            for association, association_validity in self.lc.associations.items():
+                for association_info in association_validity:
+                    yield dict(
+                        uuid=association,
+                        bruger_uuid=association_info['user'],
+                        enhed_uuid=association_info['unit'],
+                        bvn=association_info['user_key'],
+                        tilknytningstype_uuid=association_info['association_type'],
+                        tilknytningstype_titel=self.lc.classes[
+                            association_info['association_type']]['title'],
+                        startdato=association_info['from_date'],
+                        slutdato=association_info['to_date']
+                    )
+        self._insert(Tilknytning, associations())
+
+        def roles():
+            for role, role_validity in self.lc.roles.items():
+                for role_info in role_validity:
+                    yield dict(
+                        uuid=role,
+                        bruger_uuid=role_info['user'],
+                        enhed_uuid=role_info['unit'],
+                        rolletype_uuid=role_info['role_type'],
+                        rolletype_titel=self.lc.classes[
+                            role_info['role_type']]['title'],
+                        startdato=role_info['from_date'],
+                        slutdato=role_info['to_date']
+                    )
+        self._insert(Rolle, roles())
+
+        def leaves():
+            for leave, leave_validity in self.lc.leaves.items():
+                for leave_info in leave_validity:
+                    leave_type = leave_info['leave_type']
+                    yield dict(
+                        uuid=leave,
+                        bvn=leave_info['user_key'],
+                        bruger_uuid=leave_info['user'],
+                        orlovstype_uuid=leave_type,
+                        orlovstype_titel=self.lc.classes[leave_type]['title'],
+                        startdato=leave_info['from_date'],
+                        slutdato=leave_info['to_date']
+                    )
+        self._insert(Orlov, leaves())
+
         if output:
             for result in self.engine.execute('select * from tilknytninger limit 4'):
                 print(result.items())
@@ -356,26 +559,30 @@ class SqlExport(object):
     def _add_it_systems(self, output=False):
         logger.info('Add IT systems')
         print('Add IT systems')
-        for itsystem, itsystem_info in self.lc.itsystems.items():
-            sql_itsystem = ItSystem(
-                uuid=itsystem,
-                navn=itsystem_info['name']
-            )
-            self.session.add(sql_itsystem)
-
-        for it_connection, it_connection_validity in self.lc.it_connections.items():
-            for it_connection_info in it_connection_validity:
-                sql_it_connection = ItForbindelse(
-                    uuid=it_connection,
-                    it_system_uuid=it_connection_info['itsystem'],
-                    bruger_uuid=it_connection_info['user'],
-                    enhed_uuid=it_connection_info['unit'],
-                    brugernavn=it_connection_info['username'],
-                    startdato=it_connection_info['from_date'],
-                    slutdato=it_connection_info['to_date']
+
+        def itsystems():
+            for itsystem, itsystem_info in self.lc.itsystems.items():
+                yield dict(
+                    uuid=itsystem,
+                    navn=itsystem_info['name']
                 )
-                self.session.add(sql_it_connection)
-        self.session.commit()
+        self._insert(ItSystem, itsystems())
+
+        def it_connections():
+            connections = self.lc.it_connections
+            for it_connection, it_connection_validity in connections.items():
+                for it_connection_info in it_connection_validity:
+                    yield dict(
+                        uuid=it_connection,
+                        it_system_uuid=it_connection_info['itsystem'],
+                        bruger_uuid=it_connection_info['user'],
+                        enhed_uuid=it_connection_info['unit'],
+                        brugernavn=it_connection_info['username'],
+                        startdato=it_connection_info['from_date'],
+                        slutdato=it_connection_info['to_date']
+                    )
+        self._insert(ItForbindelse, it_connections())
+
         if output:
             for result in self.engine.execute('select * from it_systemer limit 2'):
                 print(result.items())
@@ -387,20 +594,24 @@ class SqlExport(object):
     def _add_kles(self, output=False):
         logger.info('Add KLES')
         print('Add KLES')
-        for kle, kle_validity in self.lc.kles.items():
-            for kle_info in kle_validity:
-                sql_kle = KLE(
-                    uuid=kle,
-                    enhed_uuid=kle_info['unit'],
-                    kle_aspekt_uuid=kle_info['kle_aspect'],
-                    kle_aspekt_titel=self.lc.classes[kle_info['kle_aspect']]['title'],
-                    kle_nummer_uuid=kle_info['kle_number'],
-                    kle_nummer_titel=self.lc.classes[kle_info['kle_number']]['title'],
-                    startdato=kle_info['from_date'],
-                    slutdato=kle_info['to_date']
-                )
-                self.session.add(sql_kle)
-        self.session.commit()
+
+        def kles():
+            for kle, kle_validity in self.lc.kles.items():
+                for kle_info in kle_validity:
+                    yield dict(
+                        uuid=kle,
+                        enhed_uuid=kle_info['unit'],
+                        kle_aspekt_uuid=kle_info['kle_aspect'],
+                        kle_aspekt_titel=self.lc.classes[
+                            kle_info['kle_aspect']]['title'],
+                        kle_nummer_uuid=kle_info['kle_number'],
+                        kle_nummer_titel=self.lc.classes[
+                            kle_info['kle_number']]['title'],
+                        startdato=kle_info['from_date'],
+                        slutdato=kle_info['to_date']
+                    )
+        self._insert(KLE, kles())
+
         if output:
             for result in self.engine.execute('select * from kle limit 10'):
                 print(result.items())
@@ -412,6 +623,7 @@ class SqlExport(object):
             query_tid=query_time,
             start_levering_tid=start_time,
             slut_levering_tid=end_time,
+            generation=self.generation,
         )
         self.session.add(sql_kvittering)
         self.session.commit()
@@ -433,17 +645,19 @@ class SqlExport(object):
     def _add_related(self, output=False):
         logger.info('Add Enhedssammenkobling')
         print('Add Enhedssammenkobling')
-        for related, related_validity in self.lc.related.items():
-            for related_info in related_validity:
-                sql_related = Enhedssammenkobling(
-                    uuid=related,
-                    enhed1_uuid=related_info['unit1_uuid'],
-                    enhed2_uuid=related_info['unit2_uuid'],
-                    startdato=related_info['from_date'],
-                    slutdato=related_info['to_date']
-                )
-                self.session.add(sql_related)
-        self.session.commit()
+
+        def related():
+            for related, related_validity in self.lc.related.items():
+                for related_info in related_validity:
+                    yield dict(
+                        uuid=related,
+                        enhed1_uuid=related_info['unit1_uuid'],
+                        enhed2_uuid=related_info['unit2_uuid'],
+                        startdato=related_info['from_date'],
+                        slutdato=related_info['to_date']
+                    )
+        self._insert(Enhedssammenkobling, related())
+
         if output:
             for result in self.engine.execute('select * from enhedssammenkobling limit 10'):
                 print(result.items())
@@ -451,40 +665,45 @@ class SqlExport(object):
     def _add_managers(self, output=False):
         logger.info('Add managers')
         print('Add managers')
-        for manager, manager_validity in self.lc.managers.items():
-            for manager_info in manager_validity:
-                sql_manager = Leder(
-                    uuid=manager,
-                    bruger_uuid=manager_info['user'],
-                    enhed_uuid=manager_info['unit'],
-                    niveautype_uuid=manager_info['manager_level'],
-                    ledertype_uuid=manager_info['manager_type'],
-                    niveautype_titel=self.lc.classes[
-                        manager_info['manager_level']]['title'],
-                    ledertype_titel=self.lc.classes[
-                        manager_info['manager_type']]['title'],
-                    startdato=manager_info['from_date'],
-                    slutdato=manager_info['to_date']
-                )
-                self.session.add(sql_manager)
 
-                for responsibility in manager_info['manager_responsibility']:
-                    sql_responsibility = LederAnsvar(
-                        leder_uuid=manager,
-                        lederansvar_uuid=responsibility,
-                        lederansvar_titel=self.lc.classes[responsibility]['title'],
+        def managers():
+            for manager, manager_validity in self.lc.managers.items():
+                for manager_info in manager_validity:
+                    yield dict(
+                        uuid=manager,
+                        bruger_uuid=manager_info['user'],
+                        enhed_uuid=manager_info['unit'],
+                        niveautype_uuid=manager_info['manager_level'],
+                        ledertype_uuid=manager_info['manager_type'],
+                        niveautype_titel=self.lc.classes[
+                            manager_info['manager_level']]['title'],
+                        ledertype_titel=self.lc.classes[
+                            manager_info['manager_type']]['title'],
                         startdato=manager_info['from_date'],
                         slutdato=manager_info['to_date']
                     )
-                    self.session.add(sql_responsibility)
-        self.session.commit()
+        self._insert(Leder, managers())
+
+        def responsibilities():
+            for manager, manager_validity in self.lc.managers.items():
+                for manager_info in manager_validity:
+                    for responsibility in manager_info['manager_responsibility']:
+                        yield dict(
+                            leder_uuid=manager,
+                            lederansvar_uuid=responsibility,
+                            lederansvar_titel=self.lc.classes[
+                                responsibility]['title'],
+                            startdato=manager_info['from_date'],
+                            slutdato=manager_info['to_date']
+                        )
+        self._insert(LederAnsvar, responsibilities())
+
         if output:
             for result in self.engine.execute('select * from ledere limit 10'):
                 print(result.items())
             for result in self.engine.execute('select * from leder_ansvar limit 10'):
                 print(result.items())
 
-
 def cli():
     """
     Command line interface.
@@ -494,6 +713,8 @@ def cli():
     parser.add_argument('--historic', action='store_true')
     parser.add_argument('--use-pickle', action='store_true')
     parser.add_argument('--force-sqlite', action='store_true')
+    parser.add_argument('--incremental', action='store_true')
+    parser.add_argument('--streaming', action='store_true')
 
     args = vars(parser.parse_args())
 
@@ -510,7 +731,9 @@ def cli():
 
     sql_export.perform_export(
         resolve_dar=args.get('resolve_dar'),
-        use_pickle=args.get('use_pickle')
+        use_pickle=args.get('use_pickle'),
+        incremental=args.get('incremental'),
+        streaming=args.get('streaming'),
     )
 
 
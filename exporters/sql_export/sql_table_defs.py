@@ -216,6 +216,8 @@ class Kvittering(Base):
     query_tid = Column(DateTime)
     start_levering_tid = Column(DateTime)
     slut_levering_tid = Column(DateTime)
+    # Identifies the export, see SqlExport.perform_export
+    generation = Column(String(32), nullable=True)
 
 
 class Enhedssammenkobling(Base):
@@ -0,0 +1,217 @@
+import datetime
+import os
+import tempfile
+import unittest
+
+from exporters.sql_export import lora_cache
+from exporters.sql_export.lora_cache_snapshot import write_manifest
+
+
+def lora_object(uuid, registered):
+    return {
+        "id": uuid,
+        "registreringer": [
+            {"fratidspunkt": {"tidsstempeldatotid": registered.isoformat()}}
+        ],
+    }
+
+
+def unit(uuid, parent, **derived):
+    return [{"uuid": uuid, "name": uuid, "parent": parent, **derived}]
+
+
+class LoraCacheTest(lora_cache.LoraCache):
+    """Subclass to override methods with side-effects."""
+
+    def _load_settings(self):
+        """We want to avoid reading settings.json."""
+        return {"mox.base": "http://lora"}
+
+    def _read_org_uuid(self):
+        """We want to avoid MO lookups."""
+        pass
+
+    def _cache_file(self, name):
+        """We want to avoid writing to tmp/."""
+        return "{}/{}.snapshot".format(self.tmp_dir, name)
+
+    def _fetch_lora_page(self, session, url, params):
+        if params["foersteresultat"] > 0:
+            return []
+        return self.objects
+
+
+class TestIncremental(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.lc = LoraCacheTest()
+        self.lc.tmp_dir = tmp_dir.name
+        self.now = datetime.datetime.now(lora_cache.DEFAULT_TIMEZONE)
+
+    def test_lookup_only_returns_objects_registered_since(self):
+        old = lora_object("old", self.now - datetime.timedelta(hours=1))
+        new = lora_object("new", self.now)
+        self.lc.objects = [old, new]
+        self.lc.registered_since = self.now - datetime.timedelta(minutes=1)
+
+        result = self.lc._perform_lora_lookup("/organisation/bruger", {})
+        self.assertEqual(result, [new])
+        self.assertEqual(self.lc._lookup_state.lookup, ({"old", "new"}, {"new"}))
+
+    def test_merge_incremental(self):
+        self.lc.users = {
+            "kept": ["kept"],
+            "updated": ["before"],
+            "removed": ["gone"],
+        }
+        merged = self.lc._merge_incremental(
+            "users",
+            {"updated": ["after"], "created": ["created"]},
+            seen={"kept", "updated", "created"},
+            updated={"updated", "created"},
+        )
+        self.assertEqual(
+            merged,
+            {"kept": ["kept"], "updated": ["after"], "created": ["created"]},
+        )
+        self.assertEqual(
+            self.lc.changed["users"],
+            {
+                "updated": (["before"], ["after"]),
+                "created": ([], ["created"]),
+                "removed": (["gone"], []),
+            },
+        )
+
+    def test_affected_units(self):
+        derived = {"location": "", "manager_uuid": None}
+        self.lc.units = {
+            "root": unit("root", None, **derived),
+            "a": unit("a", "root", **derived),
+            "a1": unit("a1", "a", **derived),
+            "b": unit("b", "root", **derived),
+            "b1": unit("b1", "b", **derived),
+            "c": unit("c", "root"),
+        }
+        self.lc.registered_since = self.now
+        self.lc.changed = {
+            "units": {"a": (unit("a", "root"), unit("a", "root"))},
+            "managers": {"m": ([{"unit": "b1"}], [])},
+        }
+        # c is missing derived data, and is included too
+        self.assertEqual(self.lc._affected_units(), {"a", "a1", "b1", "c"})
+
+        self.lc.registered_since = None
+        self.assertIsNone(self.lc._affected_units())
+
+    def test_affected_users(self):
+        self.lc.engagements = {
+            "e1": [{"user": "u1", "primary_boolean": True}],
+            "e2": [{"user": "u2", "primary_boolean": True}],
+            "e3": [{"user": "u3"}],
+        }
+        self.lc.registered_since = self.now
+        self.lc.changed = {
+            "engagements": {"e1": ([{"user": "u0"}], [{"user": "u1"}])}
+        }
+        self.assertEqual(self.lc._affected_users(), {"u0", "u1", "u3"})
+
+        # Primary scopes are stored on classes
+        self.lc.changed["classes"] = {"c1": ({}, {})}
+        self.assertIsNone(self.lc._affected_users())
+
+    def write_snapshot(self, read_time, names):
+        self.lc.generation = "previous"
+        for name in names:
+            setattr(self.lc, name, {})
+            self.lc._write_cache(name)
+        manifest = {
+            "generation": "previous",
+            "full_history": False,
+            "skip_past": False,
+            "read_time": read_time.isoformat(),
+            "names": names,
+        }
+        write_manifest(self.lc._cache_file("manifest"), manifest)
+
+    def test_read_registered_since(self):
+        # No previous snapshot
+        self.assertIsNone(self.lc._read_registered_since())
+
+        self.write_snapshot(self.now, self.lc._cache_names())
+        self.assertEqual(
+            self.lc._read_registered_since(),
+            self.now - lora_cache.INCREMENTAL_MARGIN,
+        )
+        self.assertEqual(len(self.lc.users), 0)
+
+        # Associations were skipped when the snapshot was taken
+        self.write_snapshot(self.now, self.lc._cache_names(skip_associations=True))
+        self.assertIsNotNone(self.lc._read_registered_since(skip_associations=True))
+        self.assertIsNone(self.lc._read_registered_since())
+
+        # Validities might have changed since yesterday
+        self.write_snapshot(
+            self.now - datetime.timedelta(days=1), self.lc._cache_names()
+        )
+        self.assertIsNone(self.lc._read_registered_since())
+
+    def test_read_registered_since_mismatched_section(self):
+        self.write_snapshot(self.now, self.lc._cache_names())
+        # A section left behind by an interrupted run
+        self.lc.generation = "interrupted"
+        self.lc._write_cache("users")
+        self.assertIsNone(self.lc._read_registered_since())
+
+    def test_dry_run_is_read_only(self):
+        self.write_snapshot(self.now, self.lc._cache_names())
+        self.lc.units = {"a": unit("a", None)}
+        self.lc.engagements = {"e1": [{"user": "u1", "primary_type": None}]}
+        self.lc._write_cache("units")
+        self.lc._write_cache("engagements")
+        snapshot = {
+            name: os.stat(self.lc._cache_file(name)).st_mtime_ns
+            for name in self.lc._cache_names()
+        }
+
+        self.lc.populate_cache(dry_run=True)
+        self.lc.calculate_derived_unit_data()
+        self.lc.calculate_primary_engagements()
+        # Derived data is calculated in memory only
+        self.assertEqual(self.lc.units["a"][0]["location"], "a")
+        self.assertTrue(self.lc.engagements["e1"][0]["primary_boolean"])
+        self.assertEqual(
+            snapshot,
+            {
+                name: os.stat(self.lc._cache_file(name)).st_mtime_ns
+                for name in self.lc._cache_names()
+            },
+        )
+
+    def stub_loaders(self, value):
+        for name in self.lc._cache_names():
+            if name == "dar_cache":
+                setattr(self.lc, "_cache_dar", lambda: {})
+                continue
+            loader = "_cache_lora_" + {"addresses": "address"}.get(name, name)
+            setattr(self.lc, loader, lambda: {value: [{"value": value}]})
+        self.lc._cache_lora_units = lambda: {}
+        self.lc._cache_lora_engagements = lambda: {}
+
+    def test_partial_run_keeps_skipped_sections(self):
+        self.stub_loaders("full")
+        self.lc.populate_cache()
+        self.stub_loaders("partial")
+        self.lc.populate_cache(skip_associations=True)
+        self.lc.populate_cache(skip_associations=True)
+
+        lc = LoraCacheTest()
+        lc.tmp_dir = self.lc.tmp_dir
+        lc.populate_cache(dry_run=True)
+        self.assertEqual(dict(lc.associations), {"full": [{"value": "full"}]})
+        self.assertEqual(dict(lc.roles), {"partial": [{"value": "partial"}]})
+
+        # The kept associations are older than the snapshot
+        self.assertIsNone(lc._read_registered_since())
+        self.assertIsNotNone(lc._read_registered_since(skip_associations=True))
@@ -0,0 +1,88 @@
+import pickle
+import tempfile
+import unittest
+
+from exporters.sql_export import lora_cache, lora_cache_snapshot
+from exporters.sql_export.lora_cache_records import UnitRecord
+
+
+class LoraCacheTest(lora_cache.LoraCache):
+    """Subclass to override methods with side-effects."""
+
+    def _load_settings(self):
+        """We want to avoid reading settings.json."""
+        return {"mox.base": "http://lora", **self.test_settings}
+
+    def _read_org_uuid(self):
+        """We want to avoid MO lookups."""
+        pass
+
+
+class TestRecords(unittest.TestCase):
+    def setUp(self):
+        self.values = {
+            "uuid": "u1",
+            "user_key": "Enhed",
+            "name": "Enhed",
+            "unit_type": None,
+            "level": None,
+            "parent": "root",
+            "from_date": "2020-01-01",
+            "to_date": None,
+        }
+
+    def test_behaves_like_dict(self):
+        record = UnitRecord(**self.values)
+        self.assertEqual(record, self.values)
+        self.assertEqual(dict(record), self.values)
+        self.assertEqual(record["parent"], "root")
+        self.assertEqual(record.get("manager_uuid"), None)
+
+    def test_derived_keys(self):
+        record = UnitRecord(**self.values)
+        self.assertNotIn("location", record)
+        record["location"] = "root\\Enhed"
+        self.assertIn("location", record)
+        self.assertEqual(record["location"], "root\\Enhed")
+        del record["location"]
+        self.assertNotIn("location", record)
+
+    def test_unknown_key(self):
+        record = UnitRecord(**self.values)
+        with self.assertRaises(KeyError):
+            record["unknown"]
+        with self.assertRaises(KeyError):
+            record["unknown"] = 1
+        with self.assertRaises(KeyError):
+            UnitRecord(unknown=1)
+
+    def test_strings_are_interned(self):
+        first = UnitRecord(parent="".join(["unit", "-uuid"]))
+        second = UnitRecord(parent="".join(["unit", "-uuid"]))
+        self.assertIs(first["parent"], second["parent"])
+
+    def test_pickle(self):
+        record = UnitRecord(**self.values, manager_uuid="m1")
+        copy = pickle.loads(pickle.dumps(record))
+        self.assertIsInstance(copy, UnitRecord)
+        self.assertEqual(copy, record)
+
+    def test_snapshot_roundtrip(self):
+        objects = {"u1": [UnitRecord(**self.values)]}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = "{}/units.snapshot".format(tmp_dir)
+            lora_cache_snapshot.write_section(path, "units", "g1", objects)
+            section = lora_cache_snapshot.SnapshotSection(path, "units", "g1")
+            self.assertEqual(dict(section), objects)
+            self.assertIsInstance(section["u1"][0], UnitRecord)
+
+    def test_compact_records_setting(self):
+        LoraCacheTest.test_settings = {}
+        lc = LoraCacheTest()
+        self.assertIs(type(lc._record("units", self.values)), dict)
+
+        LoraCacheTest.test_settings = {"exporters.lora_cache.compact_records": True}
+        lc = LoraCacheTest()
+        record = lc._record("units", self.values)
+        self.assertIsInstance(record, UnitRecord)
+        self.assertEqual(record, self.values)
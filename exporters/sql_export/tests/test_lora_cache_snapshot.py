@@ -0,0 +1,105 @@
+import json
+import pathlib
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from hypothesis import given
+from hypothesis.strategies import dictionaries, integers, lists, text, uuids
+
+from exporters.sql_export import lora_cache_snapshot
+
+
+class TestLoraCacheSnapshot(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.path = pathlib.Path(tmp_dir.name)
+
+    @given(dictionaries(uuids().map(str), lists(dictionaries(text(), integers()))))
+    def test_roundtrip(self, objects):
+        path = self.path / "users.snapshot"
+        lora_cache_snapshot.write_section(path, "users", "generation", objects)
+
+        section = lora_cache_snapshot.SnapshotSection(path, "users", "generation")
+        self.assertEqual(len(section), len(objects))
+        self.assertEqual(list(section), list(objects))
+        self.assertEqual(dict(section), objects)
+
+    def test_lazy_values_keep_modifications(self):
+        path = self.path / "units.snapshot"
+        lora_cache_snapshot.write_section(
+            path, "units", "generation", {"a": [{}], "b": [{}]}
+        )
+
+        section = lora_cache_snapshot.SnapshotSection(path, "units", "generation")
+        self.assertIn("a", section)
+        self.assertNotIn("c", section)
+        self.assertEqual(section._values, {})
+
+        section["a"][0]["location"] = "Andeby"
+        self.assertEqual(section["a"], [{"location": "Andeby"}])
+        self.assertEqual(list(section._values), ["a"])
+
+    def test_concurrent_writers(self):
+        path = self.path / "units.snapshot"
+        objects = {str(i): [{"name": "x" * 1000}] for i in range(1000)}
+
+        def write(generation):
+            lora_cache_snapshot.write_section(path, "units", generation, objects)
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(write, map(str, range(8))))
+
+        # One of the writers wins, with an intact section
+        generations = [
+            generation
+            for generation in map(str, range(8))
+            if self._section_or_none(path, generation) is not None
+        ]
+        self.assertEqual(len(generations), 1)
+        section = lora_cache_snapshot.SnapshotSection(path, "units", generations[0])
+        self.assertEqual(dict(section), objects)
+        self.assertEqual(list(self.path.iterdir()), [path])
+
+    def _section_or_none(self, path, generation):
+        try:
+            return lora_cache_snapshot.SnapshotSection(path, "units", generation)
+        except lora_cache_snapshot.SnapshotError:
+            return None
+
+    def test_mismatched_sections_are_rejected(self):
+        path = self.path / "units.snapshot"
+        lora_cache_snapshot.write_section(path, "units", "generation", {})
+
+        with self.assertRaises(lora_cache_snapshot.SnapshotError):
+            lora_cache_snapshot.SnapshotSection(path, "units", "other-generation")
+        with self.assertRaises(lora_cache_snapshot.SnapshotError):
+            lora_cache_snapshot.SnapshotSection(path, "users", "generation")
+        with self.assertRaises(lora_cache_snapshot.SnapshotError):
+            lora_cache_snapshot.SnapshotSection(
+                self.path / "missing.snapshot", "units", "generation"
+            )
+
+        path.write_bytes(b"\x80\x04not a snapshot at all")
+        with self.assertRaises(lora_cache_snapshot.SnapshotError):
+            lora_cache_snapshot.SnapshotSection(path, "units", "generation")
+
+    def test_manifest(self):
+        path = self.path / "manifest.snapshot"
+        with self.assertRaises(lora_cache_snapshot.SnapshotError):
+            lora_cache_snapshot.read_manifest(path)
+
+        lora_cache_snapshot.write_manifest(
+            path, {"generation": "generation", "full_history": True}
+        )
+        manifest = lora_cache_snapshot.read_manifest(path, full_history=True)
+        self.assertEqual(manifest["generation"], "generation")
+        with self.assertRaises(lora_cache_snapshot.SnapshotError):
+            lora_cache_snapshot.read_manifest(path, full_history=False)
+
+        # Snapshots from other versions are rejected
+        manifest["version"] = 0
+        path.write_text(json.dumps(manifest))
+        with self.assertRaises(lora_cache_snapshot.SnapshotError):
+            lora_cache_snapshot.read_manifest(path, full_history=True)
@@ -0,0 +1,63 @@
+import time
+import unittest
+
+from hypothesis import given, settings
+from hypothesis.strategies import integers
+
+from exporters.sql_export.lora_cache import LoraCache
+
+
+class LoraCacheTest(LoraCache):
+    """Subclass to override methods with side-effects."""
+
+    def __init__(self, objects, concurrent_requests, *args, **kwargs):
+        self.objects = objects
+        self.requested_offsets = []
+        self._concurrent_requests = concurrent_requests
+        super().__init__(*args, **kwargs)
+
+    def _load_settings(self):
+        """We want to avoid reading settings.json."""
+        return {
+            "mox.base": "http://lora",
+            "exporters.lora_cache.concurrent_requests": self._concurrent_requests,
+        }
+
+    def _read_org_uuid(self):
+        """We want to avoid MO lookups."""
+        pass
+
+    def _fetch_lora_page(self, session, url, params):
+        """Serve pages from self.objects, finishing out of order."""
+        offset = params["foersteresultat"]
+        limit = params["maximalantalresultater"]
+        self.requested_offsets.append(offset)
+        # Later pages finish first, to check that ordering is kept
+        time.sleep(0.01 / (1 + offset // limit))
+        return self.objects[offset : offset + limit]
+
+
+class TestPerformLoraLookup(unittest.TestCase):
+    @settings(max_examples=20, deadline=None)
+    @given(integers(min_value=0, max_value=12000), integers(0, 5))
+    def test_lookup_is_complete_and_ordered(self, num_objects, concurrent_requests):
+        objects = [{"id": str(i)} for i in range(num_objects)]
+        lc = LoraCacheTest(objects, concurrent_requests)
+
+        result = lc._perform_lora_lookup("/organisation/bruger", {"bvn": "%"})
+        self.assertEqual(result, objects)
+        # Every page up to and including the first empty page is requested
+        num_pages = num_objects // 5000 + 1
+        self.assertEqual(
+            sorted(lc.requested_offsets)[:num_pages],
+            [page * 5000 for page in range(num_pages)],
+        )
+
+    def test_params_are_not_shared_between_pages(self):
+        objects = [{"id": str(i)} for i in range(7000)]
+        lc = LoraCacheTest(objects, 3)
+
+        params = {"bvn": "%"}
+        lc._perform_lora_lookup("/organisation/bruger", params)
+        self.assertNotIn("foersteresultat", params)
+        self.assertEqual(params["maximalantalresultater"], 5000)
@@ -1,6 +1,6 @@
 import logging
 import unittest
-from unittest.mock import call, patch
+from unittest.mock import patch
 from uuid import uuid4
 
 import pytest
@@ -48,25 +48,29 @@ class TestResolveDar(unittest.TestCase):
 
         with self._caplog.at_level(logging.INFO):
             dar_cache = lc._cache_dar()
-            self.assertEqual(self.get_last_log(), "Total dar: 0, no-hit: 0")
+            self.assertEqual(
+                self.get_last_log(),
+                "Total dar: 0, no-hit: 0, cache hits: 0, cache misses: 0",
+            )
         self.assertEqual(dar_cache, {})
 
-    @patch("exporters.sql_export.lora_cache.dar_helper.sync_dar_fetch")
-    @given(booleans(), lists(uuids()))
-    def test_cache_dar(self, sync_dar_fetch, resolve_dar, dar_uuids):
+    @patch("exporters.sql_export.lora_cache.dar_helper.dar_fetch")
+    @given(booleans(), lists(uuids(), unique=True))
+    def test_cache_dar(self, dar_fetch, resolve_dar, dar_uuids):
         """With filled dar_map, resolve does matter."""
-        sync_dar_fetch.reset_mock()
-        # Mock sync_dar_fetch to be noop
-        def noop_sync_dar_fetch(dar_uuids, addrtype="adresser"):
-            return {}, dar_uuids
+        dar_fetch.reset_mock()
+        # Mock dar_fetch to be noop
+        async def noop_dar_fetch(dar_uuids, addrtype, chunk_size, client):
+            return {}, set(dar_uuids)
 
-        sync_dar_fetch.side_effect = noop_sync_dar_fetch
+        dar_fetch.side_effect = noop_dar_fetch
 
         # Setup LoraCache Object
         lc = LoraCacheTest(resolve_dar)
         self.assertEqual(lc.resolve_dar, resolve_dar)
         self.assertEqual(lc.dar_map, {})
         lc.addresses = {}
+        lc.dar_cache_file = ":memory:"
 
         # Prepare dar_map with provided dar_uuids
         num_uuids = len(dar_uuids)
@@ -77,18 +81,21 @@ class TestResolveDar(unittest.TestCase):
         # Fire the call and check log output
         with self._caplog.at_level(logging.INFO):
             dar_cache = lc._cache_dar()
-            expected_log_message = f"Total dar: {num_uuids}, no-hit: {num_uuids}"
+            misses = num_uuids if resolve_dar else 0
+            expected_log_message = (
+                f"Total dar: {num_uuids}, no-hit: {num_uuids}, "
+                f"cache hits: 0, cache misses: {misses}"
+            )
             self.assertEqual(self.get_last_log(), expected_log_message)
 
-        # Ensure that sync_dar_fetch is only called when resolve_dar is True
-        if resolve_dar:
-            calls = [
-                call(lc.dar_map.keys()),
-                call(dar_uuids, addrtype="adgangsadresser"),
-            ]
-            sync_dar_fetch.assert_has_calls(calls)
+        # Ensure that dar_fetch is only called when resolve_dar is True
+        if resolve_dar and dar_uuids:
+            addrtypes = [c.args[1] for c in dar_fetch.call_args_list]
+            self.assertEqual(addrtypes, ["adresser", "adgangsadresser"])
+            for c in dar_fetch.call_args_list:
+                self.assertCountEqual(c.args[0], dar_uuids)
         else:
-            sync_dar_fetch.assert_not_called()
+            dar_fetch.assert_not_called()
 
         # Check that all our betegnelser has been set
         for dar_uuid in dar_uuids:
@@ -0,0 +1,79 @@
+import tempfile
+import threading
+import unittest
+
+from exporters.sql_export.lora_cache import LoraCache
+
+
+class LoraCacheTest(LoraCache):
+    """Subclass to override methods with side-effects."""
+
+    def _load_settings(self):
+        """We want to avoid reading settings.json."""
+        return {"exporters.lora_cache.populate_workers": 3}
+
+    def _cache_file(self, name):
+        """We want to avoid writing to tmp/."""
+        return "{}/{}.snapshot".format(self.tmp_dir, name)
+
+    def _read_org_uuid(self):
+        """We want to avoid MO lookups."""
+        pass
+
+
+class TestRunStages(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.lc = LoraCacheTest()
+        self.lc.tmp_dir = tmp_dir.name
+        self.finished = []
+
+    def loader(self, name, barrier=None):
+        def load():
+            if barrier is not None:
+                # Only passes if all parties of the barrier run concurrently
+                barrier.wait(timeout=5)
+            self.finished.append(name)
+            return {name: name}
+
+        return load
+
+    def test_independent_stages_run_concurrently(self):
+        barrier = threading.Barrier(3)
+        stages = {
+            name: (name, self.loader(name, barrier), ())
+            for name in ["facets", "classes", "users"]
+        }
+        self.lc._run_stages(stages)
+        self.assertEqual(self.lc.facets, {"facets": "facets"})
+        self.assertEqual(self.lc.classes, {"classes": "classes"})
+        self.assertEqual(self.lc.users, {"users": "users"})
+
+    def test_dependencies_are_respected(self):
+        stages = {
+            "dar_cache": ("dar", self.loader("dar_cache"), ("addresses",)),
+            "addresses": ("addresses", self.loader("addresses"), ()),
+            "units": ("units", self.loader("units"), ("dar_cache",)),
+        }
+        self.lc._run_stages(stages)
+        self.assertEqual(self.finished, ["addresses", "dar_cache", "units"])
+
+    def test_failing_stage_is_raised(self):
+        def fail():
+            raise ValueError("LoRa is down")
+
+        stages = {
+            "facets": ("facets", fail, ()),
+            "classes": ("classes", self.loader("classes"), ("facets",)),
+        }
+        with self.assertRaises(ValueError):
+            self.lc._run_stages(stages)
+        self.assertEqual(self.finished, [])
+
+    def test_unsatisfiable_dependencies(self):
+        stages = {
+            "classes": ("classes", self.loader("classes"), ("facets",)),
+        }
+        with self.assertRaises(Exception):
+            self.lc._run_stages(stages)
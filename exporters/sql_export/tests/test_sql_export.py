@@ -0,0 +1,228 @@
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from sqlalchemy.orm import sessionmaker
+
+from exporters.sql_export.sql_export import SqlExport
+from exporters.sql_export.sql_table_defs import Base
+
+
+def validity(**values):
+    return dict(values, from_date="2020-01-01", to_date=None)
+
+
+def lora_cache():
+    """A LoraCache with one of each kind of object."""
+    extensions = {"udvidelse_{}".format(i): None for i in range(1, 11)}
+    return SimpleNamespace(
+        facets={"f1": {"user_key": "facet"}},
+        classes={
+            c: {"user_key": c, "title": c.upper(), "facet": "f1", "scope": "s"}
+            for c in ["type", "level", "visibility", "aspect", "number"]
+        },
+        users={
+            "u1": [
+                validity(
+                    user_key="u1",
+                    fornavn="For",
+                    efternavn="Efter",
+                    kaldenavn_fornavn="",
+                    kaldenavn_efternavn="",
+                    cpr="0101010101",
+                )
+            ]
+        },
+        units={
+            "ou1": [
+                validity(
+                    name="Enhed",
+                    parent=None,
+                    unit_type="type",
+                    level="level",
+                    location="Enhed",
+                    manager_uuid="m1",
+                )
+            ],
+            # Without derived data
+            "ou2": [
+                validity(name="Under", parent="ou1", unit_type="type", level=None)
+            ],
+        },
+        addresses={
+            "a1": [
+                validity(
+                    unit="ou1",
+                    user=None,
+                    value="Vej 1",
+                    dar_uuid="d1",
+                    adresse_type="type",
+                    scope="DAR",
+                    visibility=None,
+                )
+            ],
+            "a2": [
+                validity(
+                    unit=None,
+                    user="u1",
+                    value="a@b.dk",
+                    dar_uuid=None,
+                    adresse_type="type",
+                    scope="EMAIL",
+                    visibility="visibility",
+                )
+            ],
+        },
+        # The DAR cache holds different keys for each address
+        dar_cache={"d1": {"id": "d1", "betegnelse": "Vej 1"}, "d2": {}},
+        engagements={
+            "e1": [
+                validity(
+                    unit="ou1",
+                    user="u1",
+                    user_key="1",
+                    primary_type=None,
+                    job_function="type",
+                    engagement_type="type",
+                    fraction=None,
+                    primary_boolean=True,
+                    extensions=extensions,
+                )
+            ]
+        },
+        associations={
+            "as1": [
+                validity(
+                    unit="ou1", user="u1", user_key="1", association_type="type"
+                )
+            ]
+        },
+        roles={"r1": [validity(unit="ou1", user="u1", role_type="type")]},
+        leaves={"l1": [validity(user="u1", user_key="1", leave_type="type")]},
+        managers={
+            "m1": [
+                validity(
+                    unit="ou1",
+                    user="u1",
+                    manager_level="level",
+                    manager_type="type",
+                    manager_responsibility=["type", "level"],
+                )
+            ]
+        },
+        itsystems={"it1": {"name": "AD"}},
+        it_connections={
+            "itc1": [validity(itsystem="it1", user="u1", unit=None, username="u")]
+        },
+        kles={
+            "k1": [validity(unit="ou1", kle_aspect="aspect", kle_number="number")]
+        },
+        related={"re1": [validity(unit1_uuid="ou1", unit2_uuid="ou2")]},
+        populate_cache=lambda **kwargs: None,
+        calculate_derived_unit_data=lambda: None,
+        calculate_primary_engagements=lambda: None,
+    )
+
+
+class TestSqlExport(unittest.TestCase):
+    def export(self, **settings):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        settings = {
+            "exporters.actual_state.type": "SQLite",
+            "exporters.actual_state.db_name": "{}/actual_state".format(tmp_dir.name),
+            **settings,
+        }
+        sql_export = SqlExport(settings=settings)
+        Base.metadata.create_all(sql_export.engine)
+        sql_export.session = sessionmaker(bind=sql_export.engine)()
+        sql_export.lc = lora_cache()
+        sql_export._export_cache()
+
+        return {
+            name: sorted(map(tuple, sql_export.engine.execute(table.select())))
+            for name, table in Base.metadata.tables.items()
+        }
+
+    def test_bulk_insert_matches_orm(self):
+        orm = self.export(**{"exporters.actual_state.bulk_insert": False})
+        bulk = self.export(**{"exporters.actual_state.batch_size": 1})
+
+        self.assertEqual(bulk, orm)
+        self.assertEqual(len(bulk["leder_ansvar"]), 2)
+        self.assertEqual(len(bulk["dar_adresser"]), 2)
+        for name, rows in bulk.items():
+            if name != "kvittering":
+                self.assertTrue(rows, name)
+
+
+@patch("exporters.sql_export.sql_export.LoraCache", lambda **kwargs: lora_cache())
+class TestAtomicSwap(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.settings = {
+            "exporters.actual_state.type": "SQLite",
+            "exporters.actual_state.db_name": "{}/actual_state".format(tmp_dir.name),
+            "exporters.actual_state.atomic_swap": True,
+        }
+
+    def export(self):
+        sql_export = SqlExport(settings=self.settings)
+        sql_export.perform_export()
+        return sql_export
+
+    def receipts(self, connectable):
+        rows = connectable.execute("select generation from kvittering")
+        return [generation for generation, in rows]
+
+    def test_swap(self):
+        first = self.export()
+        self.assertFalse(os.path.exists(first._shadow_file()))
+        self.assertEqual(self.receipts(first.engine), [first.generation])
+
+        # A reader of the previous export neither blocks nor sees the swap
+        reader = first.engine.connect()
+        self.addCleanup(reader.close)
+        reader.execute("begin")
+        self.assertEqual(self.receipts(reader), [first.generation])
+
+        second = self.export()
+        self.assertEqual(
+            self.receipts(second.engine), [first.generation, second.generation]
+        )
+        self.assertEqual(self.receipts(reader), [first.generation])
+        self.assertEqual(
+            len(list(second.engine.execute("select * from brugere"))), 1
+        )
+
+    def test_failed_export_keeps_live_database(self):
+        first = self.export()
+        with patch.object(SqlExport, "_add_kles", side_effect=ValueError):
+            with self.assertRaises(ValueError):
+                self.export()
+        self.assertEqual(self.receipts(first.engine), [first.generation])
+        self.assertEqual(len(list(first.engine.execute("select * from kle"))), 1)
+
+    def test_receipts_without_generation(self):
+        sql_export = SqlExport(settings=self.settings)
+        sql_export.engine.execute(
+            "create table kvittering (id integer primary key, query_tid datetime, "
+            "start_levering_tid datetime, slut_levering_tid datetime)"
+        )
+        sql_export.engine.execute("insert into kvittering (id) values (1)")
+
+        sql_export.perform_export()
+        self.assertEqual(
+            self.receipts(sql_export.engine), [None, sql_export.generation]
+        )
+
+        # The receipt table is upgraded when written in place
+        self.settings["exporters.actual_state.atomic_swap"] = False
+        sql_export.engine.execute("alter table kvittering drop column generation")
+        in_place = self.export()
+        self.assertEqual(
+            self.receipts(in_place.engine), [None, None, in_place.generation]
+        )
@@ -0,0 +1,76 @@
+import unittest
+
+from exporters.sql_export import lora_cache
+from exporters.sql_export.sql_export import SqlExport
+
+
+def facet(uuid):
+    return {
+        "id": uuid,
+        "registreringer": [
+            {"attributter": {"facetegenskaber": [{"brugervendtnoegle": uuid}]}}
+        ],
+    }
+
+
+class LoraCacheTest(lora_cache.LoraCache):
+    """Subclass to override methods with side-effects."""
+
+    def _load_settings(self):
+        """We want to avoid reading settings.json."""
+        return {"mox.base": "http://lora"}
+
+    def _read_org_uuid(self):
+        """We want to avoid MO lookups."""
+        pass
+
+    def _fetch_lora_page(self, session, url, params):
+        page = params["foersteresultat"] // params["maximalantalresultater"]
+        if page < len(self.pages):
+            return self.pages[page]
+        return []
+
+
+class TestStreaming(unittest.TestCase):
+    def setUp(self):
+        self.lc = LoraCacheTest()
+        self.lc.pages = [[facet("f1"), facet("f2")], [facet("f3")]]
+
+    def test_stream_pages(self):
+        pages = list(self.lc._stream_pages(self.lc._cache_lora_facets))
+        self.assertEqual(
+            pages,
+            [
+                {"f1": {"user_key": "f1"}, "f2": {"user_key": "f2"}},
+                {"f3": {"user_key": "f3"}},
+            ],
+        )
+        # Lookups outside the stream read everything again
+        self.assertEqual(len(self.lc._cache_lora_facets()), 3)
+
+    def test_stream_closed_early(self):
+        pages = self.lc._stream_pages(self.lc._cache_lora_facets)
+        self.assertEqual(len(next(pages)), 2)
+        pages.close()
+        self.assertEqual(len(self.lc._cache_lora_facets()), 3)
+
+    def test_streamed_objects(self):
+        facets = lora_cache.StreamedObjects(
+            lambda: self.lc._stream_pages(self.lc._cache_lora_facets)
+        )
+        # Read from LoRa on every iteration
+        self.assertEqual([uuid for uuid, _ in facets.items()], ["f1", "f2", "f3"])
+        self.lc.pages = [[facet("f4")]]
+        self.assertEqual(dict(facets.items()), {"f4": {"user_key": "f4"}})
+
+    def test_streaming_requires_historic_export(self):
+        settings = {
+            "exporters.actual_state.type": "SQLite",
+            "exporters.actual_state.db_name": ":memory:",
+        }
+        with self.assertRaises(Exception):
+            SqlExport(settings=settings).perform_export(streaming=True)
+        with self.assertRaises(Exception):
+            SqlExport(historic=True, settings=settings).perform_export(
+                streaming=True, incremental=True
+            )
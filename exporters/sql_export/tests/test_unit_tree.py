@@ -0,0 +1,124 @@
+import pathlib
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+from anytree import PreOrderIter
+
+from exporters.sql_export.lora_cache_snapshot import SnapshotError
+from exporters.sql_export.unit_tree import UnitTree
+
+# root
+# ├── a
+# │   ├── a1
+# │   └── a2
+# │       └── a21
+# └── b
+PARENTS = {
+    "root": None,
+    "b": "root",
+    "a": "root",
+    "a2": "a",
+    "a1": "a",
+    "a21": "a2",
+}
+
+
+def units(parents):
+    return {
+        uuid: [{"uuid": uuid, "parent": parent, "name": uuid.upper()}]
+        for uuid, parent in parents.items()
+    }
+
+
+class TestUnitTree(unittest.TestCase):
+    def setUp(self):
+        self.tree = UnitTree.from_units(units(PARENTS))
+
+    def test_order(self):
+        self.assertEqual(list(self.tree), ["root", "a", "a1", "a2", "a21", "b"])
+        self.assertEqual(self.tree.roots, ["root"])
+        self.assertEqual(self.tree.children("root"), ["a", "b"])
+        self.assertEqual(self.tree.children("a21"), [])
+
+    def test_queries(self):
+        self.assertEqual(self.tree.ancestors("a21"), ["a2", "a", "root"])
+        self.assertEqual(self.tree.ancestors("root"), [])
+        self.assertEqual(self.tree.depth("a21"), 3)
+        self.assertEqual(self.tree.descendants("a"), ["a1", "a2", "a21"])
+        self.assertEqual(self.tree.subtree("a2"), ["a2", "a21"])
+        self.assertTrue(self.tree.in_subtree("a21", "a"))
+        self.assertTrue(self.tree.in_subtree("a", "a"))
+        self.assertFalse(self.tree.in_subtree("b", "a"))
+        self.assertFalse(self.tree.in_subtree("a", "a21"))
+        self.assertFalse(self.tree.in_subtree("missing", "root"))
+
+    def test_detached_units(self):
+        tree = UnitTree({"a": "missing", "b": "a", "c": "d", "d": "c"})
+        self.assertEqual(list(tree), ["a", "b"])
+        self.assertIsNone(tree.parent("a"))
+
+    def test_from_full_history_units(self):
+        def validity(parent, name, from_date, to_date):
+            return {
+                "parent": parent,
+                "name": name,
+                "from_date": from_date,
+                "to_date": to_date,
+            }
+
+        history = units(PARENTS)
+        # a2 moved from a to b, and is renamed in the future
+        history["a2"] = [
+            validity("a", "OLD", "1900-01-01", "2000-01-01"),
+            validity("b", "A2", "2000-01-02", "9999-01-01"),
+            validity("b", "NEW", "9999-01-02", None),
+        ]
+        tree = UnitTree.from_units(history)
+        self.assertEqual(tree.parent("a2"), "b")
+        self.assertEqual(tree.name("a2"), "A2")
+        self.assertEqual(tree.subtree("b"), ["b", "a2", "a21"])
+
+        # A unit which has ended is placed as it was last
+        history["a2"] = history["a2"][:1]
+        history["a1"] = [
+            validity("a", "A1", "1900-01-01", "1950-01-01"),
+            validity("b", "A1", "1950-01-02", "2000-01-01"),
+        ]
+        tree = UnitTree.from_units(history)
+        self.assertEqual(tree.parent("a1"), "b")
+
+    def test_anytree_nodes(self):
+        nodes = self.tree.anytree_nodes("a")
+        self.assertEqual(set(nodes), {"root", "a1", "a2", "a21"})
+        self.assertEqual(
+            [node.name for node in PreOrderIter(nodes["root"])],
+            ["a", "a1", "a2", "a21"],
+        )
+        self.assertEqual(nodes["a21"].parent, nodes["a2"])
+
+    def test_from_lora_cache(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        path = pathlib.Path(tmp_dir.name) / "unit_tree.snapshot"
+
+        lc = MagicMock(generation="generation", units=units(PARENTS))
+        lc._cache_file.return_value = path
+        # Without a persisted tree, it is built but not persisted
+        tree = UnitTree.from_lora_cache(lc)
+        self.assertEqual(tree.children("root"), ["a", "b"])
+        self.assertFalse(path.exists())
+
+        # The tree persisted by populate_cache is used for the same generation
+        tree.save(path)
+        lc.units = {}
+        persisted = UnitTree.from_lora_cache(lc)
+        self.assertEqual(list(persisted), list(tree))
+        self.assertEqual(persisted.descendants("a"), ["a1", "a2", "a21"])
+        self.assertEqual(persisted.children("root"), ["a", "b"])
+        self.assertEqual(persisted.name("a"), "A")
+
+        with self.assertRaises(SnapshotError):
+            UnitTree.load(path, "other-generation")
+        lc.generation = "other-generation"
+        self.assertEqual(len(UnitTree.from_lora_cache(lc)), 0)
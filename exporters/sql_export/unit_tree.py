@@ -0,0 +1,248 @@
+"""Index of the organisation unit tree.
+
+The tree is built from the parent of each unit, eg. the units of a LoraCache,
+instead of walking MO with one children lookup per unit. The units are numbered
+in pre-order, each unit with the range of numbers of its subtree (nested-set
+numbering), so membership of a subtree is answered in constant time and
+ancestors in time proportional to the depth of the unit.
+
+The index is persisted next to the snapshot of a LoraCache by the program
+populating the cache, stamped with its generation, so programs reading the
+same snapshot share it.
+"""
+import datetime
+import logging
+from collections import defaultdict
+
+from anytree import Node
+
+from exporters.sql_export.lora_cache_snapshot import (
+    SnapshotError, SnapshotSection, write_section
+)
+
+logger = logging.getLogger("LoraCache")
+
+
+def _current_validity(validities):
+    """Return the validity which is valid today, otherwise the latest one.
+
+    The validities of a full history LoraCache span the past and the future,
+    the tree is that of today.
+    """
+    if len(validities) == 1:
+        return validities[0]
+    today = datetime.date.today().isoformat()
+    validities = sorted(validities, key=lambda validity: validity['from_date'])
+    for validity in validities:
+        if validity['from_date'] <= today and (
+            validity['to_date'] is None or today <= validity['to_date']
+        ):
+            return validity
+    return validities[-1]
+
+
+class UnitTree(object):
+    """
+    Nested-set index of the organisation unit tree.
+
+    Units whose parent is not among the units are roots. Siblings are ordered
+    by name, like the children of a unit in MO.
+    :param parents: Map from unit uuid to the uuid of the parent, None for
+    top units.
+    :param names: Optional map from unit uuid to the name of the unit.
+    :param generation: Generation of the data the tree is built from.
+    """
+
+    def __init__(self, parents, names=None, generation=None):
+        self.generation = generation
+        self._parent = {}
+        self._name = {}
+        # Pre-order number of each unit, the subtree of a unit is numbered
+        # from its own number up to, but not including, its end
+        self._number = {}
+        self._end = {}
+        self._depth = {}
+        self._order = []
+        if parents:
+            self._build(dict(parents), dict(names or {}))
+
+    def _build(self, parents, names):
+        children = defaultdict(list)
+        roots = []
+        for uuid, parent in parents.items():
+            if parent is None or parent not in parents:
+                roots.append(uuid)
+            else:
+                children[parent].append(uuid)
+
+        def sort_key(uuid):
+            return names.get(uuid) or '', uuid
+
+        # Iterative depth first search, the tree can be deeper than the
+        # recursion limit allows
+        stack = [(uuid, 0, False) for uuid in sorted(roots, key=sort_key,
+                                                      reverse=True)]
+        while stack:
+            uuid, depth, done = stack.pop()
+            if done:
+                self._end[uuid] = len(self._order)
+                continue
+            self._number[uuid] = len(self._order)
+            self._depth[uuid] = depth
+            self._order.append(uuid)
+            stack.append((uuid, depth, True))
+            for child in sorted(children[uuid], key=sort_key, reverse=True):
+                stack.append((child, depth + 1, False))
+
+        for uuid in self._order:
+            self._parent[uuid] = parents[uuid] if parents[uuid] in parents else None
+            self._name[uuid] = names.get(uuid)
+        if len(self._order) < len(parents):
+            # Units in a cycle are never reached from a root
+            logger.warning('Units not connected to a root: {}'.format(
+                sorted(set(parents) - set(self._order))))
+
+    @classmethod
+    def from_units(cls, units, generation=None):
+        """
+        Build the tree from units as cached by LoraCache.
+        :param units: Map from unit uuid to the validities of the unit, the
+        validity of today gives the parent and name.
+        :param generation: Generation of the units.
+        """
+        parents = {}
+        names = {}
+        for uuid, validities in units.items():
+            if validities:
+                validity = _current_validity(validities)
+                parents[uuid] = validity['parent']
+                names[uuid] = validity['name']
+        return cls(parents, names, generation)
+
+    @classmethod
+    def from_lora_cache(cls, lc):
+        """
+        Return the tree of the units of a populated LoraCache.
+
+        The tree persisted for the snapshot of the cache is used if present,
+        otherwise the tree is built in memory. The snapshot is only written by
+        LoraCache.populate_cache.
+        :param lc: The LoraCache.
+        """
+        if lc.generation is not None:
+            try:
+                return cls.load(lc._cache_file('unit_tree'), lc.generation)
+            except SnapshotError as e:
+                logger.info('{}, building unit tree'.format(e))
+        return cls.from_units(lc.units, lc.generation)
+
+    def save(self, path):
+        """
+        Persist the tree, stamped with its generation.
+        :param path: Path of the file.
+        """
+        write_section(path, 'unit_tree', self.generation, {
+            uuid: (self._parent[uuid], self._name[uuid], self._end[uuid],
+                   self._depth[uuid])
+            for uuid in self._order
+        })
+
+    @classmethod
+    def load(cls, path, generation):
+        """
+        Read a persisted tree.
+        :param path: Path of the file.
+        :param generation: The generation the tree must be built from.
+        :raises SnapshotError: If the file is missing, or from another
+        generation.
+        """
+        section = SnapshotSection(path, 'unit_tree', generation)
+        tree = cls(None, generation=generation)
+        # The units are persisted in pre-order
+        for number, (uuid, (parent, name, end, depth)) in enumerate(
+                section.items()):
+            tree._order.append(uuid)
+            tree._number[uuid] = number
+            tree._parent[uuid] = parent
+            tree._name[uuid] = name
+            tree._end[uuid] = end
+            tree._depth[uuid] = depth
+        return tree
+
+    def __contains__(self, uuid):
+        return uuid in self._number
+
+    def __len__(self):
+        return len(self._order)
+
+    def __iter__(self):
+        """Iterate over the units in pre-order."""
+        return iter(self._order)
+
+    @property
+    def roots(self):
+        return [uuid for uuid in self._order if self._parent[uuid] is None]
+
+    def parent(self, uuid):
+        return self._parent[uuid]
+
+    def name(self, uuid):
+        return self._name[uuid]
+
+    def depth(self, uuid):
+        """Return the depth of a unit, roots have depth 0."""
+        return self._depth[uuid]
+
+    def children(self, uuid):
+        """Return the children of a unit, in order."""
+        children = []
+        number = self._number[uuid] + 1
+        while number < self._end[uuid]:
+            child = self._order[number]
+            children.append(child)
+            number = self._end[child]
+        return children
+
+    def ancestors(self, uuid):
+        """Return the ancestors of a unit, from the parent up to the root."""
+        ancestors = []
+        parent = self._parent[uuid]
+        while parent is not None:
+            ancestors.append(parent)
+            parent = self._parent[parent]
+        return ancestors
+
+    def subtree(self, uuid):
+        """Return the unit and all units below it, in pre-order."""
+        return self._order[self._number[uuid]:self._end[uuid]]
+
+    def descendants(self, uuid):
+        """Return the units below a unit, in pre-order."""
+        return self._order[self._number[uuid] + 1:self._end[uuid]]
+
+    def in_subtree(self, uuid, root):
+        """
+        Check whether a unit is in the subtree of another.
+        :param uuid: The unit.
+        :param root: The top of the subtree.
+        :return: True if uuid is root or below root, False otherwise, also if
+        either unit is not in the tree.
+        """
+        if uuid not in self._number or root not in self._number:
+            return False
+        return self._number[root] <= self._number[uuid] < self._end[root]
+
+    def anytree_nodes(self, root):
+        """
+        Return the subtree of a unit as anytree nodes, like
+        MoraHelper.read_ou_tree does.
+        :param root: The top unit.
+        :return: A dict with the nodes of the units below root, and root itself
+        named 'root'.
+        """
+        nodes = {'root': Node(root)}
+        for uuid in self.descendants(root):
+            parent = self._parent[uuid]
+            nodes[uuid] = Node(uuid, parent=nodes['root' if parent == root
+                                                  else parent])
+        return nodes
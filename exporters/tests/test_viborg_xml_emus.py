@@ -72,6 +72,9 @@ class Tests(util.LoRATestCase):
         super().setUp()
         util.amqp.publish_message = lambda a, b, c, d, e: None
         self.mh = MoraHelper()
+        self.mh.session.request = (
+            lambda method, url, **kwargs: self.get(url, **kwargs)
+        )
         if not getattr(requests, "_orgget", False):
             requests._orgget = requests.get
             requests.get = self.get
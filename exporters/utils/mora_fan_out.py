@@ -0,0 +1,46 @@
+"""Fan out reads of MoraHelper over many units or persons.
+
+Tree-walking exports read one unit or person at a time with the blocking
+MoraHelper. ``mora_fan_out`` fires the same reads concurrently with an
+AsyncMoraHelper sharing the cache of the MoraHelper, so the reads of the export
+are served from the cache afterwards.
+"""
+
+import asyncio
+from typing import Any, Iterable, List, Sequence
+
+from os2mo_helpers.async_mora_helpers import DEFAULT_CONCURRENCY, AsyncMoraHelper
+from os2mo_helpers.mora_helpers import MoraHelper
+
+from exporters.utils.async_to_sync import async_to_sync
+
+
+@async_to_sync
+async def mora_fan_out(
+    helper: MoraHelper,
+    method: str,
+    arguments: Iterable[Sequence[Any]],
+    concurrency: int = DEFAULT_CONCURRENCY,
+    **kwargs: Any
+) -> List[Any]:
+    """Call a read of AsyncMoraHelper concurrently, once per argument tuple.
+
+    Example:
+
+        units = mora_fan_out(mh, "read_ou", [(uuid,) for uuid in uuids])
+        # Served from the cache
+        unit = mh.read_ou(uuids[0])
+
+    Args:
+        helper: The MoraHelper, whose host and cache are used.
+        method: Name of the read, eg. 'read_ou' or 'read_user_address'.
+        arguments: The positional arguments of each call.
+        concurrency: Maximal number of requests in flight.
+        **kwargs: Keyword arguments passed to every call.
+
+    Returns:
+        The results of the calls, in the order of arguments.
+    """
+    async with AsyncMoraHelper.from_mora_helper(helper, concurrency) as async_helper:
+        read = getattr(async_helper, method)
+        return await asyncio.gather(*[read(*args, **kwargs) for args in arguments])
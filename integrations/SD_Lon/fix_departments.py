@@ -10,9 +10,11 @@ from integrations.SD_Lon import sd_payloads
 from integrations.SD_Lon.exceptions import NoCurrentValdityException
 from integrations.SD_Lon.sd_common import load_settings, mora_assert
 from integrations.SD_Lon.sd_common import sd_lookup as _sd_lookup
+from integrations.SD_Lon.sd_common import sd_lookup_many as _sd_lookup_many
 from os2mo_helpers.mora_helpers import MoraHelper
 
 sd_lookup = partial(_sd_lookup, use_cache=False)
+sd_lookup_many = partial(_sd_lookup_many, use_cache=False)
 
 LOG_LEVEL = logging.DEBUG
 LOG_FILE = "fix_sd_departments.log"
@@ -291,11 +293,14 @@ class FixDepartments(object):
 
         all_people = {}
         logger.debug("Perform GetEmployments, time_delas: {}".format(time_deltas))
+        params_list = []
         for time_delta in time_deltas:
             effective_date = validity_date + datetime.timedelta(days=time_delta)
-            params["EffectiveDate"] = (effective_date.strftime("%d.%m.%Y"),)
+            params_list.append(
+                dict(params, EffectiveDate=(effective_date.strftime("%d.%m.%Y"),))
+            )
 
-            employments = sd_lookup("GetEmployment20111201", params)
+        for employments in sd_lookup_many("GetEmployment20111201", params_list):
             people = employments.get("Person", [])
             if not isinstance(people, list):
                 people = [people]
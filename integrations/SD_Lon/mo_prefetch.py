@@ -0,0 +1,121 @@
+import datetime
+import logging
+from collections import defaultdict
+from operator import itemgetter
+
+from exporters.sql_export.lora_cache import LoraCache
+
+logger = logging.getLogger("sdChangedAt")
+
+
+def _mo_user(user):
+    """Convert a LoraCache user validity to the shape MO returns for e/{uuid}."""
+    return {
+        'uuid': user['uuid'],
+        'name': user['navn'],
+        'givenname': user['fornavn'],
+        'surname': user['efternavn'],
+        'nickname': user['kaldenavn'],
+        'nickname_givenname': user['kaldenavn_fornavn'],
+        'nickname_surname': user['kaldenavn_efternavn'],
+        'cpr_no': user['cpr'],
+        'user_key': user['user_key'],
+    }
+
+
+def _mo_engagement(engagement):
+    """Convert a LoraCache engagement validity to the shape MO returns for
+    e/{uuid}/details/engagement with only_primary.
+    """
+    primary = None
+    if engagement['primary_type']:
+        primary = {'uuid': engagement['primary_type']}
+    mo_engagement = {
+        'uuid': engagement['uuid'],
+        'user_key': engagement['user_key'],
+        'person': {'uuid': engagement['user']},
+        'org_unit': {'uuid': engagement['unit']},
+        'job_function': {'uuid': engagement['job_function']},
+        'engagement_type': {'uuid': engagement['engagement_type']},
+        'primary': primary,
+        'fraction': engagement['fraction'],
+        'validity': {
+            'from': engagement['from_date'],
+            'to': engagement['to_date'],
+        },
+    }
+    for number in range(1, 11):
+        mo_engagement['extension_{}'.format(number)] = (
+            engagement['extensions']['udvidelse_{}'.format(number)]
+        )
+    return mo_engagement
+
+
+def _current_validity(validities):
+    """Return the validity which is valid today, otherwise the latest one."""
+    today = datetime.date.today().isoformat()
+    validities = sorted(validities, key=itemgetter('from_date'))
+    for validity in validities:
+        if validity['from_date'] <= today and (
+            validity['to_date'] is None or today <= validity['to_date']
+        ):
+            return validity
+    return validities[-1]
+
+
+class MOPrefetch:
+    """The MO users and engagements of a set of persons, read from LoRa in bulk.
+
+    Reading a person and the engagements of the person from MO takes five
+    requests, which dominates the runtime of a run with many changed persons.
+    Instead all users and engagements are read from LoRa in a few paged
+    requests, and indexed for the persons of the run.
+
+    The state is only valid until the run writes to MO, so each person can be
+    popped once, and must be read from MO afterwards.
+
+    :param cprs: The cpr numbers of the persons to prefetch.
+    :param lora_cache: LoraCache to read from, by default a full history cache.
+    """
+
+    def __init__(self, cprs, lora_cache=None):
+        cprs = set(cprs)
+        if lora_cache is None:
+            lora_cache = LoraCache(resolve_dar=False, full_history=True)
+
+        logger.info('Prefetch MO users')
+        users_by_cpr = defaultdict(list)
+        for validities in lora_cache._cache_lora_users().values():
+            if validities and validities[0]['cpr'] in cprs:
+                users_by_cpr[validities[0]['cpr']].extend(validities)
+
+        # Persons which are not in MO are prefetched as None
+        self.users = dict.fromkeys(cprs)
+        for cpr, validities in users_by_cpr.items():
+            self.users[cpr] = _mo_user(_current_validity(validities))
+        user_uuids = {user['uuid'] for user in self.users.values() if user}
+
+        logger.info('Prefetch MO engagements')
+        self.engagements = defaultdict(list)
+        for validities in lora_cache._cache_lora_engagements().values():
+            for validity in validities:
+                if validity['user'] in user_uuids:
+                    self.engagements[validity['user']].append(
+                        _mo_engagement(validity)
+                    )
+        for engagements in self.engagements.values():
+            engagements.sort(key=lambda eng: eng['validity']['from'])
+        logger.info('Prefetched {} persons'.format(len(user_uuids)))
+
+    def pop(self, cpr):
+        """Return the prefetched state of a person, and forget it.
+
+        :param cpr: The cpr number of the person.
+        :return: The MO user, or None if the person is not in MO, and the
+        engagements of the user.
+        :raises KeyError: If the person was not prefetched, or already popped.
+        """
+        user = self.users.pop(cpr)
+        if user is None:
+            return None, []
+        return user, self.engagements.pop(user['uuid'], [])
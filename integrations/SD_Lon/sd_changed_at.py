@@ -6,7 +6,6 @@ import pathlib
 import sqlite3
 import requests
 import datetime
-from functools import lru_cache
 from operator import itemgetter
 from integrations.SD_Lon import sd_payloads
 
@@ -17,7 +16,7 @@ from tqdm import tqdm
 from integrations import cpr_mapper
 from os2mo_helpers.mora_helpers import MoraHelper
 from integrations.ad_integration import ad_reader
-from integrations.SD_Lon.sd_common import sd_lookup
+from integrations.SD_Lon.sd_common import sd_lookup, sd_lookup_stream
 # from integrations.SD_Lon.sd_common import generate_uuid
 from integrations.SD_Lon import exceptions
 from integrations.SD_Lon.sd_common import mora_assert
@@ -31,6 +30,7 @@ from integrations.SD_Lon.sync_job_id import JobIdSync
 from integrations.SD_Lon.db_overview import DBOverview
 from integrations.SD_Lon.fix_departments import FixDepartments
 from integrations.SD_Lon.calculate_primary import MOPrimaryEngagementUpdater
+from integrations.SD_Lon.mo_prefetch import MOPrefetch
 
 
 LOG_LEVEL = logging.DEBUG
@@ -107,6 +107,12 @@ class ChangeAtSD:
         self.mo_person = None      # Updated continously with the person currently
         self.mo_engagement = None  # being processed.
 
+        # Read the persons of update_all_employments from LoRa in bulk
+        self.prefetch_mo_state = self.settings.get(
+            'integrations.SD_Lon.prefetch_mo_state', False
+        )
+        self.prefetch = None
+
         self.primary_types = primary_types(self.helper)
 
         logger.info('Read it systems')
@@ -155,7 +161,6 @@ class ChangeAtSD:
         employee_forced_uuids = cpr_mapper.employee_mapper(str(cpr_map))
         return employee_forced_uuids
 
-    @lru_cache(maxsize=None)
     def read_employment_changed(self, from_date=None, to_date=None, employment_identifier=None):
         from_date = from_date or self.from_date
         to_date = to_date or self.to_date
@@ -188,11 +193,9 @@ class ChangeAtSD:
             params.update({
                 'DeactivationDate': '31.12.9999',
             })
-        response = sd_lookup(url, params)
-
-        employment_response = ensure_list(response.get('Person', []))
-
-        return employment_response
+        # The response holds every changed employment, it is parsed a person at
+        # a time as the persons are consumed
+        return sd_lookup_stream(url, params, tag='Person')
 
     def read_person_changed(self):
         deactivate_date = '31.12.9999'
@@ -354,6 +357,22 @@ class ChangeAtSD:
 
         return validity
 
+    def _read_mo_state(self, cpr):
+        """
+        Read a person and the engagements of the person, from the prefetched
+        state if the person is in it, otherwise from MO.
+        :param cpr: The cpr number of the person.
+        :return: The MO person, or None if the person is not in MO, and the
+        engagements of the person, or None if they were not prefetched.
+        """
+        if self.prefetch is not None:
+            try:
+                return self.prefetch.pop(cpr)
+            except KeyError:
+                pass
+        mo_person = self.helper.read_user(user_cpr=cpr, org_uuid=self.org_uuid)
+        return mo_person, None
+
     def _find_engagement(self, job_id):
         try:
             user_key = str(int(job_id)).zfill(5)
@@ -1001,11 +1020,6 @@ class ChangeAtSD:
     def update_all_employments(self):
         logger.info('Update all employments:')
         employments_changed = self.read_employment_changed()
-        logger.info(
-            'Update a total of {} employments'.format(
-                len(employments_changed)
-            )
-        )
 
         def skip_fictional_users(employment):
             cpr = employment['PersonCivilRegistrationIdentifier']
@@ -1030,8 +1044,15 @@ class ChangeAtSD:
                 return False
             return True
 
-        employments_changed = tqdm(employments_changed, desc="update employments")
         employments_changed = filter(skip_fictional_users, employments_changed)
+        if self.prefetch_mo_state:
+            # The prefetch needs every person of the run up front
+            employments_changed = list(employments_changed)
+            self.prefetch = MOPrefetch(
+                employment['PersonCivilRegistrationIdentifier']
+                for employment in employments_changed
+            )
+        employments_changed = tqdm(employments_changed, desc="update employments")
 
         for employment in employments_changed:
             cpr = employment['PersonCivilRegistrationIdentifier']
@@ -1043,9 +1064,7 @@ class ChangeAtSD:
             logger.debug('To date: {}'.format(self.to_date))
             logger.debug('Employment: {}'.format(employment))
 
-            self.mo_person = self.helper.read_user(
-                user_cpr=cpr, org_uuid=self.org_uuid
-            )
+            self.mo_person, mo_engagement = self._read_mo_state(cpr)
             logger.debug(str(self.mo_person))
             self.updater.set_current_person(mo_person=self.mo_person)
 
@@ -1064,17 +1083,22 @@ class ChangeAtSD:
                             "Unable to find person in MO, SD error: " + str(exp)
                         )
             else:  # if self.mo_person:
-                self.mo_engagement = self.helper.read_user_engagement(
-                    self.mo_person['uuid'],
-                    read_all=True,
-                    only_primary=True,
-                    use_cache=False
-                )
+                if mo_engagement is None:
+                    mo_engagement = self.helper.read_user_engagement(
+                        self.mo_person['uuid'],
+                        read_all=True,
+                        only_primary=True,
+                        use_cache=False
+                    )
+                self.mo_engagement = mo_engagement
                 self._update_user_employments(cpr, sd_engagement)
-                self.updater.set_current_person(uuid=self.mo_person['uuid'])
 
                 # Re-calculate primary after all updates for user has been performed.
                 self.updater.recalculate_primary()
+        self.prefetch = None
+        logger.info(
+            'Updated a total of {} employments'.format(employments_changed.n)
+        )
 
 
 def _local_db_insert(insert_tuple):
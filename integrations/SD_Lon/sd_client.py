@@ -0,0 +1,360 @@
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from xml.etree import ElementTree
+
+import requests
+import xmltodict
+from aiohttp import BasicAuth, ClientSession, TCPConnector
+from yarl import URL
+
+logger = logging.getLogger("sdCommon")
+
+BASE_URL = "https://service.sd.dk/sdws/"
+
+DEFAULT_CACHE_FILE = "tmp/sd_cache.db"
+# SD is queried by date, but responses about the past still change when SD is
+# corrected, so responses are only trusted for a day.
+DEFAULT_TTL = 24 * 3600
+DEFAULT_MAX_SIZE = 512 * 2 ** 20
+# SD throttles clients which fire too many requests
+DEFAULT_REQUESTS_PER_SECOND = 10
+DEFAULT_CONCURRENT_REQUESTS = 4
+# Size of the chunks a streamed response is read and parsed in
+STREAM_CHUNK_SIZE = 2 ** 16
+
+# A response read from the cache, it has the same text as the SD response
+CachedResponse = namedtuple("CachedResponse", ["text"])
+
+
+def parse_response(url, text):
+    """Parse the XML response of an SD service.
+
+    Args:
+        url: Name of the SD service, eg. 'GetEmployment20111201'.
+        text: Text of the response.
+
+    Returns:
+        dict: The contents of the response.
+    """
+    dict_response = xmltodict.parse(text)
+    if url in dict_response:
+        return dict_response[url]
+    msg = "SD api error, envelope: {}"
+    logger.error(msg.format(dict_response["Envelope"]))
+    raise Exception(msg.format(dict_response["Envelope"]))
+
+
+def iter_records(url, chunks, tag):
+    """Parse the XML response of an SD service incrementally.
+
+    The elements below the root of the response are parsed one at a time and
+    discarded again, so the whole response is never held in memory.
+
+    Args:
+        url: Name of the SD service, eg. 'GetEmployment20111201'.
+        chunks: Iterable of the text of the response, in chunks.
+        tag: Tag of the elements to yield, eg. 'Person'.
+
+    Yields:
+        dict: The contents of each tag element, as parse_response returns them.
+    """
+    parser = ElementTree.XMLPullParser(events=("start", "end"))
+    root = None
+    depth = 0
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event, element in parser.read_events():
+            if event == "start":
+                depth += 1
+                if root is None:
+                    root = element
+                continue
+
+            depth -= 1
+            # An error response is kept, to be reported in full below
+            if depth != 1 or root.tag != url:
+                continue
+            if element.tag == tag:
+                record = ElementTree.tostring(element, encoding="unicode")
+                yield xmltodict.parse(record)[tag]
+            root.remove(element)
+    parser.close()
+
+    if root.tag != url:
+        # Raises the SD error
+        parse_response(url, ElementTree.tostring(root, encoding="unicode"))
+
+
+class SDCache:
+    """Persistent cache of SD responses, stored in SQLite keyed by request.
+
+    The key is a digest of the url and parameters, which include the dates the
+    request is about. Responses expire after ttl seconds, and the oldest are
+    evicted once the total size of the responses exceeds max_size bytes.
+    The SQLite file is opened on the first lookup, so programs not using the
+    cache do not touch it.
+
+    Args:
+        path: Path of the SQLite file, ':memory:' for a cache which is not
+            persisted.
+        ttl: Seconds a response is cached.
+        max_size: Maximal total size of the cached responses, in bytes.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_FILE, ttl=DEFAULT_TTL,
+                 max_size=DEFAULT_MAX_SIZE):
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+
+        self._connection = None
+        self._connect_lock = threading.Lock()
+        self._lock = threading.Lock()
+
+    @property
+    def connection(self):
+        """The SQLite connection, opened on first use."""
+        with self._connect_lock:
+            if self._connection is None:
+                self._connection = self._connect()
+            return self._connection
+
+    def _connect(self):
+        # The file is shared by several programs, wait for their writes
+        connection = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        with connection:
+            # The response is the last column, so the size can be read without
+            # reading the response
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, url TEXT NOT NULL, size INTEGER NOT NULL, "
+                "fetched REAL NOT NULL, response TEXT NOT NULL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS responses_fetched ON responses (fetched)"
+            )
+        self._size = connection.execute(
+            "SELECT coalesce(sum(size), 0) FROM responses"
+        ).fetchone()[0]
+        return connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        with self._connect_lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    @staticmethod
+    def key(full_url, payload):
+        """Create a reproducible key from url and payload."""
+        hasher = hashlib.sha256()
+        for key, value in sorted(payload.items()):
+            hasher.update((str(key) + str(value)).encode())
+        hasher.update(full_url.encode())
+        return hasher.hexdigest()
+
+    def get(self, key):
+        """Return the cached response text, or None if not cached or expired."""
+        connection = self.connection
+        with self._lock:
+            row = connection.execute(
+                "SELECT response FROM responses WHERE key = ? AND fetched > ?",
+                (key, time.time() - self.ttl),
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def put(self, key, full_url, text):
+        """Cache a response text, evicting old responses if the cache is full."""
+        size = len(text.encode())
+        connection = self.connection
+        with self._lock, connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(key, url, size, fetched, response) VALUES (?, ?, ?, ?, ?)",
+                (key, full_url, size, time.time(), text),
+            )
+            self._size += size
+            if self._size > self.max_size:
+                self._evict()
+
+    def _total_size(self):
+        row = self.connection.execute(
+            "SELECT coalesce(sum(size), 0) FROM responses"
+        ).fetchone()
+        return row[0]
+
+    def _evict(self):
+        self.connection.execute(
+            "DELETE FROM responses WHERE fetched <= ?", (time.time() - self.ttl,)
+        )
+        # Other programs may have written to the cache, so recount
+        excess = self._total_size() - self.max_size
+        if excess > 0:
+            # Delete the oldest responses, until the cache is below max_size
+            rows = self.connection.execute(
+                "SELECT key, size FROM responses ORDER BY fetched"
+            )
+            keys = []
+            for key, size in rows:
+                if excess <= 0:
+                    break
+                keys.append((key,))
+                excess -= size
+            self.connection.executemany("DELETE FROM responses WHERE key = ?", keys)
+            logger.info("Evicted {} SD responses from cache".format(len(keys)))
+        self._size = self._total_size()
+
+
+class RateLimiter:
+    """Space out requests to at most rate requests per second.
+
+    The limit is shared by all threads and coroutines using the limiter.
+
+    Args:
+        rate: Requests per second, None or 0 for no limit.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """Reserve the next slot, and return the seconds until it starts."""
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+            return start - now
+
+    def wait(self):
+        time.sleep(self._reserve())
+
+    async def async_wait(self):
+        await asyncio.sleep(self._reserve())
+
+
+class SDClient:
+    """Client for the SD webservices, with caching and a cap on the request rate.
+
+    Single requests reuse the connections of a requests session, several
+    requests can be fired concurrently with request_many.
+
+    Args:
+        cache: SDCache to use, None to disable caching.
+        requests_per_second: Cap on the rate of requests to SD.
+        concurrent_requests: Number of requests in flight in request_many.
+    """
+
+    def __init__(self, cache=None, requests_per_second=DEFAULT_REQUESTS_PER_SECOND,
+                 concurrent_requests=DEFAULT_CONCURRENT_REQUESTS):
+        self.cache = cache
+        self.rate_limiter = RateLimiter(requests_per_second)
+        self.concurrent_requests = concurrent_requests
+        self.session = requests.Session()
+
+    def _cached(self, full_url, payload, use_cache):
+        if not (use_cache and self.cache):
+            return None, None
+        key = self.cache.key(full_url, payload)
+        text = self.cache.get(key)
+        if text is not None:
+            logger.info("This SD lookup was found in cache: {}".format(key))
+            return key, CachedResponse(text)
+        return key, None
+
+    def _store(self, key, full_url, status, text):
+        if key is not None and status == 200:
+            self.cache.put(key, full_url, text)
+
+    def request(self, full_url, payload, auth, use_cache=True):
+        """Fire a request against SD, unless the response is cached.
+
+        Args:
+            full_url: Url of the SD service.
+            payload: Parameters of the request.
+            auth: Tuple of SD user and password.
+            use_cache: Whether to read and write the cache.
+
+        Returns:
+            The response, which has the response text in text.
+        """
+        key, response = self._cached(full_url, payload, use_cache)
+        if response is not None:
+            return response
+
+        self.rate_limiter.wait()
+        response = self.session.get(full_url, params=payload, auth=auth)
+        logger.info("{} requested from SD".format(full_url))
+        self._store(key, full_url, response.status_code, response.text)
+        return response
+
+    def request_stream(self, full_url, payload, auth):
+        """Fire a request against SD, and yield the response in chunks.
+
+        The response is read from SD in chunks as they are consumed. Streamed
+        responses are neither read from nor written to the cache, as caching
+        would hold the whole response in memory, which streaming avoids.
+
+        Args:
+            full_url: Url of the SD service.
+            payload: Parameters of the request.
+            auth: Tuple of SD user and password.
+
+        Yields:
+            bytes: The response, in chunks.
+        """
+        self.rate_limiter.wait()
+        with self.session.get(
+            full_url, params=payload, auth=auth, stream=True
+        ) as response:
+            logger.info("{} requested from SD".format(full_url))
+            yield from response.iter_content(STREAM_CHUNK_SIZE)
+
+    async def _async_request(self, session, full_url, payload, use_cache):
+        key, response = self._cached(full_url, payload, use_cache)
+        if response is not None:
+            return response
+
+        # Encode the parameters as requests does, as SD has been called with
+        # those (eg. True as 'True')
+        url = requests.Request("GET", full_url, params=payload).prepare().url
+        await self.rate_limiter.async_wait()
+        async with session.get(URL(url, encoded=True)) as response:
+            text = await response.text()
+            logger.info("{} requested from SD".format(full_url))
+            self._store(key, full_url, response.status, text)
+        return CachedResponse(text)
+
+    async def request_many(self, full_url, payloads, auth, use_cache=True):
+        """Fire concurrent requests against SD, one for each payload.
+
+        Args:
+            full_url: Url of the SD service.
+            payloads: List of the parameters of the requests.
+            auth: Tuple of SD user and password.
+            use_cache: Whether to read and write the cache.
+
+        Returns:
+            List of the responses, in the order of payloads.
+        """
+        connector = TCPConnector(limit=self.concurrent_requests)
+        auth = BasicAuth(*auth)
+        async with ClientSession(connector=connector, auth=auth) as session:
+            return await asyncio.gather(*[
+                self._async_request(session, full_url, payload, use_cache)
+                for payload in payloads
+            ])
@@ -2,14 +2,23 @@ import hashlib
 import json
 import logging
 import pathlib
-import pickle
 import uuid
 from enum import Enum
-from functools import lru_cache, wraps
-from pathlib import Path
-
-import requests
-import xmltodict
+from functools import lru_cache
+
+from integrations.dar_helper.utils import async_to_sync
+from integrations.SD_Lon.sd_client import (
+    BASE_URL,
+    DEFAULT_CACHE_FILE,
+    DEFAULT_CONCURRENT_REQUESTS,
+    DEFAULT_MAX_SIZE,
+    DEFAULT_REQUESTS_PER_SECOND,
+    DEFAULT_TTL,
+    SDCache,
+    SDClient,
+    iter_records,
+    parse_response,
+)
 
 logger = logging.getLogger("sdCommon")
 
@@ -41,101 +50,113 @@ def sd_lookup_settings():
     return institution_identifier, sd_user, sd_password
 
 
-def _sd_lookup_cache(func):
-    def create_hex_digest(full_url, payload):
-        """Create a reproducible hex digest from url and payloads."""
-        hasher = hashlib.sha256()
-
-        for key, value in sorted(payload.items()):
-            hasher.update((str(key) + str(value)).encode())
-        hasher.update(full_url.encode())
-
-        return hasher.hexdigest()
-
-    def write_response(cache_file, response):
-        """Write response to disk."""
-        with open(str(cache_file), "wb") as f:
-            pickle.dump(response, f, pickle.HIGHEST_PROTOCOL)
+@lru_cache(maxsize=None)
+def get_sd_client():
+    """The SDClient shared by all SD lookups of the program."""
+    settings = load_settings()
+    cache = SDCache(
+        settings.get("integrations.SD_Lon.cache_file", DEFAULT_CACHE_FILE),
+        ttl=settings.get("integrations.SD_Lon.cache_ttl", DEFAULT_TTL),
+        max_size=settings.get("integrations.SD_Lon.cache_max_size", DEFAULT_MAX_SIZE),
+    )
+    return SDClient(
+        cache,
+        requests_per_second=settings.get(
+            "integrations.SD_Lon.requests_per_second", DEFAULT_REQUESTS_PER_SECOND
+        ),
+        concurrent_requests=settings.get(
+            "integrations.SD_Lon.concurrent_requests", DEFAULT_CONCURRENT_REQUESTS
+        ),
+    )
 
-    def read_response(cache_file):
-        """Read response from disk."""
-        with open(str(cache_file), "rb") as f:
-            response = pickle.load(f)
-        return response
 
-    @wraps(func)
-    def wrapper(full_url, payload, auth, use_cache=True):
-        # Short-circuit as noop, if no caching is requested
-        if use_cache == False:
-            return func(full_url, payload, auth)
+def _sd_request(full_url, payload, auth, use_cache=True):
+    """Fire the actual request against SD, unless it is cached."""
+    return get_sd_client().request(full_url, payload, auth, use_cache=use_cache)
 
-        # We need a cache dir to exist before we can proceed
-        cache_dir = Path("tmp/")
-        if not cache_dir.is_dir():
-            raise Exception("Folder for temporary files does not exist")
 
-        # Create digest and find filename
-        lookup_id = create_hex_digest(full_url, payload)
-        cache_file = Path("tmp/sd_" + lookup_id + ".p")
+def _sd_request_many(full_url, payloads, auth, use_cache=True):
+    """Fire concurrent requests against SD, for the payloads not cached."""
+    request_many = async_to_sync(get_sd_client().request_many)
+    return request_many(full_url, payloads, auth, use_cache=use_cache)
 
-        # If cache file was found, use it
-        if cache_file.is_file():
-            response = read_response(cache_file)
-            logger.info("This SD lookup was found in cache: {}".format(lookup_id))
-            print(full_url, "read from cache")
-        else:  # No cache
-            response = func(full_url, payload, auth)
-            write_response(cache_file, response)
-            print(full_url, "requested from SD")
-        return response
 
-    return wrapper
+def _sd_request_stream(full_url, payload, auth):
+    """Fire the actual request against SD, and yield the response in chunks."""
+    return get_sd_client().request_stream(full_url, payload, auth)
 
 
-@_sd_lookup_cache
-def _sd_request(full_url, payload, auth):
-    """Fire the actual request against SD.
+def _sd_payload(params):
+    institution_identifier, sd_user, sd_password = sd_lookup_settings()
 
-    Annotation only calls this if we did not hit the cache.
-    """
-    return requests.get(
-        full_url,
-        params=payload,
-        auth=auth,
-    )
+    payload = {
+        "InstitutionIdentifier": institution_identifier,
+    }
+    payload.update(params)
+    auth = (sd_user, sd_password)
+    return payload, auth
 
 
 def sd_lookup(url, params={}, use_cache=True):
     """Fire a requests against SD.
 
     Utilizes _sd_request to fire the actual request, which in turn utilize
-    _sd_lookup_cache for caching.
+    the shared SDClient for caching and rate limiting.
     """
     logger.info("Retrieve: {}".format(url))
     logger.debug("Params: {}".format(params))
 
-    BASE_URL = "https://service.sd.dk/sdws/"
     full_url = BASE_URL + url
+    payload, auth = _sd_payload(params)
+    response = _sd_request(full_url, payload, auth, use_cache=use_cache)
 
-    institution_identifier, sd_user, sd_password = sd_lookup_settings()
+    xml_response = parse_response(url, response.text)
+    logger.debug("Done with {}".format(url))
+    return xml_response
 
-    payload = {
-        "InstitutionIdentifier": institution_identifier,
-    }
-    payload.update(params)
-    auth = (sd_user, sd_password)
-    response = _sd_request(full_url, payload, auth, use_cache=use_cache)
 
-    dict_response = xmltodict.parse(response.text)
+def sd_lookup_stream(url, params={}, tag="Person"):
+    """Fire a request against SD, and yield the tag elements of the response.
 
-    if url in dict_response:
-        xml_response = dict_response[url]
-    else:
-        msg = "SD api error, envelope: {}"
-        logger.error(msg.format(dict_response["Envelope"]))
-        raise Exception(msg.format(dict_response["Envelope"]))
+    Unlike sd_lookup, the response is parsed incrementally, one element at a
+    time, so large responses (eg. the employments of a whole institution) are
+    never held in memory as a whole. For the same reason the response is not
+    cached.
+
+    Yields:
+        dict: The contents of each tag element, as sd_lookup returns them.
+    """
+    logger.info("Stream: {}".format(url))
+    logger.debug("Params: {}".format(params))
+
+    full_url = BASE_URL + url
+    payload, auth = _sd_payload(params)
+    chunks = _sd_request_stream(full_url, payload, auth)
+    yield from iter_records(url, chunks, tag)
     logger.debug("Done with {}".format(url))
-    return xml_response
+
+
+def sd_lookup_many(url, params_list, use_cache=True):
+    """Fire concurrent requests against SD, one for each element of params_list.
+
+    The requests share the rate limit and cache of sd_lookup.
+
+    Returns:
+        list: The responses, in the order of params_list.
+    """
+    logger.info("Retrieve {} times: {}".format(len(params_list), url))
+    logger.debug("Params: {}".format(params_list))
+
+    full_url = BASE_URL + url
+    payloads = []
+    for params in params_list:
+        payload, auth = _sd_payload(params)
+        payloads.append(payload)
+    responses = _sd_request_many(full_url, payloads, auth, use_cache=use_cache)
+
+    xml_responses = [parse_response(url, response.text) for response in responses]
+    logger.debug("Done with {}".format(url))
+    return xml_responses
 
 
 def calc_employment_id(employment):
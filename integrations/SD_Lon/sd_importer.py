@@ -13,7 +13,7 @@ from anytree import Node
 
 from integrations import dawa_helper
 from integrations.ad_integration import ad_reader
-from integrations.SD_Lon.sd_common import sd_lookup
+from integrations.SD_Lon.sd_common import sd_lookup, sd_lookup_many, sd_lookup_stream
 from integrations.SD_Lon.sd_common import generate_uuid
 from integrations.SD_Lon.sd_common import calc_employment_id
 from integrations.SD_Lon.sd_common import load_settings
@@ -378,24 +378,28 @@ class SdImport(object):
             'PostalAddressIndicator': 'false',
             'EffectiveDate': self.import_date
         }
-        active_people = sd_lookup('GetPerson20111201', params)
-        if not isinstance(active_people['Person'], list):
-            active_people['Person'] = [active_people['Person']]
-
-        params['StatusActiveIndicator'] = False
-        params['StatusPassiveIndicator'] = True
-        passive_people = sd_lookup('GetPerson20111201', params)
-        if not isinstance(passive_people['Person'], list):
-            passive_people['Person'] = [passive_people['Person']]
+        passive_params = dict(
+            params, StatusActiveIndicator=False, StatusPassiveIndicator=True
+        )
+        # The responses hold every person of the institution, parse them a
+        # person at a time. This fetches them one after the other, instead of
+        # concurrently with sd_lookup_many, trading one round trip to SD for
+        # not holding both responses in memory.
+        active_people = sd_lookup_stream('GetPerson20111201', params, tag='Person')
+        passive_people = sd_lookup_stream(
+            'GetPerson20111201', passive_params, tag='Person'
+        )
 
-        people = active_people['Person']
+        def unique_people():
+            cprs = set()
+            for person in active_people:
+                cprs.add(person['PersonCivilRegistrationIdentifier'])
+                yield person
+            for person in passive_people:
+                if not person['PersonCivilRegistrationIdentifier'] in cprs:
+                    yield person
 
-        cprs = []
-        for person in active_people['Person']:
-            cprs.append(person['PersonCivilRegistrationIdentifier'])
-        for person in passive_people['Person']:
-            if not person['PersonCivilRegistrationIdentifier'] in cprs:
-                people.append(person)
+        people = unique_people()
 
         for person in people:
             cpr = person['PersonCivilRegistrationIdentifier']
@@ -479,13 +483,14 @@ class SdImport(object):
             'EffectiveDate': self.import_date
         }
         logger.info('Create employees')
-        active_people = sd_lookup('GetEmployment20111201', params)
+        passive_params = dict(
+            params, StatusActiveIndicator=False, StatusPassiveIndicator=True
+        )
+        active_people, passive_people = sd_lookup_many(
+            'GetEmployment20111201', [params, passive_params]
+        )
         if not isinstance(active_people['Person'], list):
             active_people['Person'] = [active_people['Person']]
-
-        params['StatusActiveIndicator'] = False
-        params['StatusPassiveIndicator'] = True
-        passive_people = sd_lookup('GetEmployment20111201', params)
         if not isinstance(passive_people['Person'], list):
             passive_people['Person'] = [passive_people['Person']]
 
@@ -767,7 +772,11 @@ def full_import(org_only):
         mox_base=mox_base,
         mora_base=mora_base,
         store_integration_data=False,
-        seperate_names=True
+        seperate_names=True,
+        bulk=settings.get('integrations.SD_Lon.import.bulk', False),
+        concurrent_imports=settings.get(
+            'integrations.SD_Lon.import.concurrent_imports', 1
+        )
     )
 
     sd = SdImport(
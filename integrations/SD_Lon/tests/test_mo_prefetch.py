@@ -0,0 +1,80 @@
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from integrations.SD_Lon.mo_prefetch import MOPrefetch
+
+
+def user(uuid, cpr, name, from_date, to_date):
+    return {
+        "uuid": uuid,
+        "cpr": cpr,
+        "user_key": "",
+        "fornavn": name,
+        "efternavn": "Testesen",
+        "navn": name + " Testesen",
+        "kaldenavn_fornavn": "",
+        "kaldenavn_efternavn": "",
+        "kaldenavn": "",
+        "from_date": from_date,
+        "to_date": to_date,
+    }
+
+
+def engagement(uuid, user_uuid, user_key, from_date, to_date):
+    return {
+        "uuid": uuid,
+        "user": user_uuid,
+        "unit": "unit_uuid",
+        "fraction": None,
+        "user_key": user_key,
+        "engagement_type": "engagement_type_uuid",
+        "primary_type": "primary_uuid",
+        "job_function": "job_function_uuid",
+        "extensions": {"udvidelse_{}".format(n): None for n in range(1, 11)},
+        "from_date": from_date,
+        "to_date": to_date,
+    }
+
+
+class TestMOPrefetch(TestCase):
+    def setUp(self):
+        lora_cache = MagicMock()
+        lora_cache._cache_lora_users.return_value = {
+            "user1": [
+                user("user1", "0101709999", "Old", "2000-01-01", "2019-12-31"),
+                user("user1", "0101709999", "New", "2020-01-01", None),
+            ],
+            "user2": [user("user2", "0202709999", "Other", "2000-01-01", None)],
+        }
+        lora_cache._cache_lora_engagements.return_value = {
+            "eng1": [
+                engagement("eng1", "user1", "00002", "2021-01-01", None),
+                engagement("eng1", "user1", "00002", "2020-01-01", "2020-12-31"),
+            ],
+            "eng2": [engagement("eng2", "user2", "00003", "2020-01-01", None)],
+        }
+        self.prefetch = MOPrefetch(["0101709999", "0303709999"], lora_cache)
+
+    def test_pop(self):
+        mo_person, mo_engagement = self.prefetch.pop("0101709999")
+        self.assertEqual(mo_person["uuid"], "user1")
+        self.assertEqual(mo_person["name"], "New Testesen")
+        self.assertEqual(
+            [eng["validity"] for eng in mo_engagement],
+            [
+                {"from": "2020-01-01", "to": "2020-12-31"},
+                {"from": "2021-01-01", "to": None},
+            ],
+        )
+        self.assertEqual(mo_engagement[0]["org_unit"], {"uuid": "unit_uuid"})
+        self.assertEqual(mo_engagement[0]["primary"], {"uuid": "primary_uuid"})
+
+        # The state is forgotten once popped
+        with self.assertRaises(KeyError):
+            self.prefetch.pop("0101709999")
+
+    def test_pop_not_in_mo(self):
+        self.assertEqual(self.prefetch.pop("0303709999"), (None, []))
+        # Persons which were not prefetched are unknown
+        with self.assertRaises(KeyError):
+            self.prefetch.pop("0202709999")
@@ -370,7 +370,7 @@ class Test_sd_changed_at(DipexTestCase):
 
     @given(status=st.sampled_from(["1", "S"]))
     @patch("integrations.SD_Lon.sd_common.sd_lookup_settings")
-    @patch("integrations.SD_Lon.sd_common._sd_request")
+    @patch("integrations.SD_Lon.sd_common._sd_request_stream")
     def test_read_employment_changed(self, sd_request, sd_settings, status):
         sd_settings.return_value = ("", "", "")
 
@@ -382,10 +382,10 @@ class Test_sd_changed_at(DipexTestCase):
             status=status,
         )
 
-        sd_request.return_value = sd_reply
+        sd_request.return_value = [sd_reply.text]
         sd_updater = setup_sd_changed_at()
         result = sd_updater.read_employment_changed()
-        self.assertEqual(result, expected_read_employment_result)
+        self.assertEqual(list(result), expected_read_employment_result)
 
     @given(status=st.sampled_from(["1", "S"]))
     def test_update_all_employments(self, status):
@@ -429,6 +429,45 @@ class Test_sd_changed_at(DipexTestCase):
                 status["ActivationDate"], employment_id
             )
 
+    @patch("integrations.SD_Lon.sd_changed_at.MOPrefetch", autospec=True)
+    def test_update_all_employments_prefetch(self, prefetch_mock):
+
+        cpr = "0101709999"
+        employment_id = "01337"
+
+        _, read_employment_result = read_employment_fixture(
+            cpr=cpr,
+            employment_id=employment_id,
+            job_id="1234",
+            job_title="EDB-Mand",
+            status="S",
+        )
+
+        sd_updater = setup_sd_changed_at(
+            {"integrations.SD_Lon.prefetch_mo_state": True}
+        )
+        sd_updater.read_employment_changed = lambda: read_employment_result
+        sd_updater._terminate_engagement = MagicMock()
+
+        prefetch = prefetch_mock.return_value
+        prefetch.pop.return_value = (
+            {"uuid": "user_uuid"},
+            [{"user_key": employment_id, "uuid": "mo_engagement_uuid"}],
+        )
+
+        sd_updater.update_all_employments()
+        self.assertEqual(list(prefetch_mock.call_args[0][0]), [cpr])
+        prefetch.pop.assert_called_once_with(cpr)
+        # The person and engagements are not read from MO
+        morahelper = sd_updater.morahelper_mock
+        morahelper.read_user.assert_not_called()
+        morahelper.read_user_engagement.assert_not_called()
+
+        status = read_employment_result[0]["Employment"]["EmploymentStatus"]
+        sd_updater._terminate_engagement.assert_called_with(
+            status["ActivationDate"], employment_id
+        )
+
     @parameterized.expand(
         [
             ["07777", "monthly pay"],
@@ -0,0 +1,188 @@
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase
+from unittest.mock import patch
+
+from integrations.dar_helper.utils import async_to_sync
+from integrations.SD_Lon.sd_client import (
+    RateLimiter,
+    SDCache,
+    SDClient,
+    iter_records,
+    parse_response,
+)
+
+RESPONSE = """<?xml version="1.0" encoding="UTF-8" ?>
+<GetPerson20111201 creationDateTime="2020-12-03T17:40:10">
+  <RequestStructure><EffectiveDate>2020-12-03</EffectiveDate></RequestStructure>
+  <Person>
+    <PersonCivilRegistrationIdentifier>0101709999</PersonCivilRegistrationIdentifier>
+    <PersonGivenName>Søren</PersonGivenName>
+  </Person>
+  <Person>
+    <PersonCivilRegistrationIdentifier>0202709999</PersonCivilRegistrationIdentifier>
+    <Employment><EmploymentIdentifier>1</EmploymentIdentifier></Employment>
+    <Employment><EmploymentIdentifier>2</EmploymentIdentifier></Employment>
+  </Person>
+</GetPerson20111201>
+"""
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        body = "<GetPerson20111201>{}</GetPerson20111201>".format(self.path).encode()
+        if "person=1" in self.path:
+            body = RESPONSE.encode()
+        self.send_response(200)
+        # Without a charset, requests assumes ISO-8859-1
+        self.send_header("Content-Type", "text/xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def chunked_text(text, size):
+    return [text[start : start + size] for start in range(0, len(text), size)]
+
+
+class TestIterRecords(TestCase):
+    def test_records(self):
+        expected = parse_response("GetPerson20111201", RESPONSE)["Person"]
+        for size in [1, 7, len(RESPONSE)]:
+            records = iter_records(
+                "GetPerson20111201", chunked_text(RESPONSE, size), "Person"
+            )
+            self.assertEqual(list(records), expected)
+
+    def test_encoded(self):
+        records = iter_records(
+            "GetPerson20111201", chunked_text(RESPONSE.encode(), 5), "Person"
+        )
+        self.assertEqual(next(records)["PersonGivenName"], "Søren")
+
+    def test_error(self):
+        envelope = "<Envelope><Body><Fault>Error</Fault></Body></Envelope>"
+        with self.assertRaisesRegex(Exception, "Fault"):
+            list(iter_records("GetPerson20111201", [envelope], "Person"))
+
+
+class TestSDCache(TestCase):
+    def setUp(self):
+        self.cache = SDCache(":memory:", ttl=60, max_size=10)
+        self.addCleanup(self.cache.close)
+
+    def test_get_put(self):
+        key = SDCache.key("url", {"EffectiveDate": "01.01.2020"})
+        self.assertIsNone(self.cache.get(key))
+        self.cache.put(key, "url", "12345")
+        self.assertEqual(self.cache.get(key), "12345")
+        # The dates of the request are part of the key
+        self.assertNotEqual(key, SDCache.key("url", {"EffectiveDate": "02.01.2020"}))
+
+    def test_ttl(self):
+        self.cache.put("key", "url", "12345")
+        with patch("time.time", return_value=time.time() + 61):
+            self.assertIsNone(self.cache.get("key"))
+
+    def test_opened_on_first_lookup(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "missing", "sd_cache.db")
+            cache = SDCache(path)
+            cache.close()
+            self.assertFalse(os.path.exists(os.path.dirname(path)))
+
+            cache = SDCache(os.path.join(tmp_dir, "sd_cache.db"))
+            self.assertIsNone(cache.get("key"))
+            self.assertTrue(os.path.exists(cache.path))
+            cache.close()
+
+    def test_evict_oldest(self):
+        self.cache.put("key1", "url", "12345")
+        self.cache.put("key2", "url", "12345")
+        self.cache.put("key3", "url", "12345")
+        self.assertIsNone(self.cache.get("key1"))
+        self.assertEqual(self.cache.get("key2"), "12345")
+        self.assertEqual(self.cache.get("key3"), "12345")
+
+
+class TestRateLimiter(TestCase):
+    def test_spacing(self):
+        limiter = RateLimiter(100)
+        delays = [limiter._reserve() for _ in range(3)]
+        self.assertAlmostEqual(delays[0], 0, places=2)
+        self.assertAlmostEqual(delays[2], 0.02, places=2)
+        self.assertEqual(RateLimiter(None)._reserve(), 0)
+
+
+class TestSDClient(TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.paths = []
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = "http://{}:{}/GetPerson20111201".format(*self.server.server_address)
+
+        cache = SDCache(":memory:")
+        self.addCleanup(cache.close)
+        self.client = SDClient(cache, requests_per_second=None)
+        self.addCleanup(self.client.session.close)
+
+    def test_request_cached(self):
+        first = self.client.request(self.url, {"a": "1"}, ("user", "pass"))
+        second = self.client.request(self.url, {"a": "1"}, ("user", "pass"))
+        self.assertEqual(first.text, second.text)
+        self.assertEqual(self.server.paths, ["/GetPerson20111201?a=1"])
+
+        self.client.request(self.url, {"a": "1"}, ("user", "pass"), use_cache=False)
+        self.assertEqual(len(self.server.paths), 2)
+
+    def test_request_stream(self):
+        chunks = self.client.request_stream(self.url, {"a": "1"}, ("user", "pass"))
+        self.assertEqual(
+            b"".join(chunks).decode(),
+            "<GetPerson20111201>/GetPerson20111201?a=1</GetPerson20111201>",
+        )
+        # Streamed responses are not cached
+        self.client.request_stream(self.url, {"a": "1"}, ("user", "pass"))
+        self.assertEqual(len(self.server.paths), 1)
+        list(self.client.request_stream(self.url, {"a": "1"}, ("user", "pass")))
+        self.assertEqual(len(self.server.paths), 2)
+        self.client.request(self.url, {"a": "1"}, ("user", "pass"))
+        self.assertEqual(len(self.server.paths), 3)
+
+    def test_request_stream_records(self):
+        chunks = self.client.request_stream(self.url, {"person": "1"}, ("user", "pass"))
+        records = iter_records("GetPerson20111201", chunks, "Person")
+        self.assertEqual(
+            [record.get("PersonGivenName") for record in records], ["Søren", None]
+        )
+
+    def test_request_many(self):
+        self.client.request(self.url, {"a": "1"}, ("user", "pass"))
+        payloads = [{"a": "1"}, {"a": True}, {"a": ("3",)}]
+        request_many = async_to_sync(self.client.request_many)
+        responses = request_many(self.url, payloads, ("user", "pass"))
+        # Responses are in the order of the payloads, parameters are encoded
+        # as requests does
+        self.assertEqual(
+            [response.text for response in responses],
+            [
+                "<GetPerson20111201>/GetPerson20111201?a={}</GetPerson20111201>".format(
+                    value
+                )
+                for value in ["1", "True", "3"]
+            ],
+        )
+        # The first payload was read from the cache
+        self.assertEqual(len(self.server.paths), 3)
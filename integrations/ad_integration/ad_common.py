@@ -1,9 +1,11 @@
 import subprocess
 
+import os
 import time
 import json
 import random
 import logging
+import threading
 
 from winrm import Session
 from winrm.exceptions import WinRMTransportError
@@ -16,6 +18,12 @@ logger = logging.getLogger("AdCommon")
 # Is this universal?
 ENCODING = "cp850"
 
+# Retries of a script on WinRM transport errors, waiting
+# RETRY_BACKOFF_FACTOR * 2 ** retry seconds, at most RETRY_MAX_SLEEP
+MAX_RETRIES = 10
+RETRY_BACKOFF_FACTOR = 0.5
+RETRY_MAX_SLEEP = 30
+
 
 def ad_minify(text):
     text = text.replace("\n", "")
@@ -122,10 +130,14 @@ def generate_kerberos_session(hostname, username=None, password=None):
 
 class AD:
     def __init__(self, all_settings=None, index=0):
+        self.index = index
         self.all_settings = all_settings
         if self.all_settings is None:
             self.all_settings = read_ad_conf_settings.read_settings(index=index)
         self.session = self._create_session()
+        # Sessions of the threads reading AD concurrently, see
+        # ADParameterReader.cache_all
+        self._local = threading.local()
         self.retry_exceptions = self._get_retry_exceptions()
         self.results = {}
 
@@ -164,6 +176,42 @@ class AD:
             )
         return session
 
+    def _current_session(self):
+        """Return the session of the current thread, or the shared session."""
+        return getattr(self._local, "session", None) or self.session
+
+    def _replace_session(self):
+        """Replace the session of the current thread with a new one."""
+        if getattr(self._local, "session", None) is not None:
+            self._local.session = self._create_session()
+        else:
+            self.session = self._create_session()
+
+    def snapshot_file(self):
+        """Path of the snapshot of the AD users, see ADParameterReader."""
+        return os.path.join(
+            self.all_settings["global"]["ad_snapshot_dir"],
+            "ad_snapshot_{}.json".format(self.index),
+        )
+
+    def invalidate_snapshot(self):
+        """Remove the snapshot of the AD users, after AD has been changed."""
+        try:
+            os.remove(self.snapshot_file())
+        except FileNotFoundError:
+            pass
+
+    def _run_ps_write_script(self, ps_script):
+        """Run a script changing AD, and invalidate the snapshot of AD users.
+
+        The snapshot is invalidated even if the script fails, as AD may still
+        have been changed.
+        """
+        try:
+            return self._run_ps_script(ps_script)
+        finally:
+            self.invalidate_snapshot()
+
     def _run_ps_script(self, ps_script):
         """
         Run a power shell script and return the result. If it fails, the
@@ -178,19 +226,19 @@ class AD:
 
         retries = 0
         try_again = True
-        while try_again and retries < 10:
+        while try_again and retries < MAX_RETRIES:
             try:
-                r = self.session.run_ps(ps_script)
+                r = self._current_session().run_ps(ps_script)
                 try_again = False
             except self.retry_exceptions:
                 logger.error("AD read error: {}".format(retries))
-                time.sleep(5)
+                time.sleep(min(RETRY_BACKOFF_FACTOR * 2 ** retries, RETRY_MAX_SLEEP))
                 retries += 1
                 # The existing session is now dead, create a new.
-                self.session = self._create_session()
+                self._replace_session()
 
         # TODO: We will need better error handling than this.
-        assert retries < 10
+        assert retries < MAX_RETRIES
 
         if r.status_code == 0:
             if r.std_out:
@@ -0,0 +1,54 @@
+import logging
+from collections import defaultdict
+
+logger = logging.getLogger("AdWriter")
+
+
+class ADDumpIndex(object):
+    """Index of a dump of AD users, by cpr number and SamAccountName.
+
+    Looking up a user by scanning the dump is linear in the number of users,
+    which makes a sync of all users quadratic. The index is built once per
+    dump, and cpr numbers with more than one account are found up front.
+
+    :param ad_dump: List of AD users, as returned by ADParameterReader.read_it_all.
+    :param cpr_field: Name of the AD field holding the cpr number.
+    :param cpr_separator: Separator between date and serial number in the cpr
+    field, if any. Cpr numbers are looked up with or without it.
+    """
+
+    def __init__(self, ad_dump, cpr_field, cpr_separator=''):
+        self.ad_dump = ad_dump
+        self.cpr_field = cpr_field
+        self.cpr_separator = cpr_separator
+        self._by_cpr = defaultdict(list)
+        self._by_sam = {}
+        for user in ad_dump:
+            self._by_cpr[self._cpr_key(user.get(cpr_field))].append(user)
+            sam = user.get('SamAccountName')
+            if sam is not None:
+                # SamAccountName is case insensitive in AD
+                self._by_sam[sam.lower()] = user
+
+        self.duplicate_cprs = {
+            cpr for cpr, users in self._by_cpr.items() if len(users) > 1
+        }
+        if self.duplicate_cprs:
+            logger.warning('{} cpr numbers have more than one AD account'.format(
+                len(self.duplicate_cprs)))
+
+    def __len__(self):
+        return len(self.ad_dump)
+
+    def _cpr_key(self, cpr):
+        if cpr and self.cpr_separator:
+            return cpr.replace(self.cpr_separator, '')
+        return cpr
+
+    def find_cpr(self, cpr):
+        """Return the list of the AD users with a cpr number."""
+        return list(self._by_cpr.get(self._cpr_key(cpr), []))
+
+    def find_sam(self, sam):
+        """Return the AD user with a SamAccountName, or None if not found."""
+        return self._by_sam.get(sam.lower())
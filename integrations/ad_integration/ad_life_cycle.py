@@ -7,6 +7,7 @@ import click
 from os2mo_helpers.mora_helpers import MoraHelper
 
 from exporters.sql_export.lora_cache import LoraCache
+from exporters.sql_export.unit_tree import UnitTree
 from integrations.ad_integration import ad_logger, ad_reader, ad_writer
 from integrations.ad_integration.ad_exceptions import NoPrimaryEngagementException
 from integrations.ad_integration.utils import progress_iterator
@@ -28,7 +29,7 @@ class AdLifeCycle:
         # This is a slow step (since ADReader reads all users)
         logger.info("Retrieve AD dump")
         self.ad_reader = ad_reader.ADParameterReader()
-        self.ad_reader.cache_all()
+        self.ad_dump = self.ad_reader.cache_all()
         logger.info("Done with AD caching")
 
         # This is a potentially slow step (since it may read LoraCache)
@@ -56,6 +57,7 @@ class AdLifeCycle:
         self.lc.populate_cache(dry_run=dry_run, skip_associations=True)
         self.lc.calculate_derived_unit_data()
         self.lc.calculate_primary_engagements()
+        self.unit_tree = UnitTree.from_lora_cache(self.lc)
         self.lc_historic = LoraCache(
             resolve_dar=False, full_history=True, skip_past=True
         )
@@ -91,13 +93,9 @@ class AdLifeCycle:
             return False
 
         logger.debug("Primary found, now find org unit location")
-        unit = self.lc.units[eng_org_unit_uuid][0]
-        while True:
-            if unit["uuid"] in self.roots:
-                return True
-            if unit["parent"] is None:
-                return False
-            unit = self.lc.units[unit["parent"]][0]
+        return any(
+            self.unit_tree.in_subtree(eng_org_unit_uuid, root) for root in self.roots
+        )
 
     def _gen_filtered_employees(self, filters):
         employees = self.lc.users.values()
@@ -196,7 +194,7 @@ class AdLifeCycle:
                 message = "dry-run"
                 if not dry_run:
                     status, message = self.ad_writer.create_user(
-                        employee["uuid"], create_manager=False
+                        employee["uuid"], create_manager=False, ad_dump=self.ad_dump
                     )
                 if status:
                     logger.debug("New username: {}".format(message))
@@ -1,6 +1,11 @@
+import os
+import json
 import time
 import random
+import hashlib
 import logging
+import datetime
+from concurrent.futures import ThreadPoolExecutor
 from winrm import Session
 
 from tqdm import tqdm
@@ -10,6 +15,9 @@ from integrations.ad_integration import read_ad_conf_settings
 
 logger = logging.getLogger("AdReader")
 
+# AD is read in partitions by the first two digits of the cpr number
+CPR_PARTITIONS = ['{}*'.format(str(day).zfill(2)) for day in range(1, 32)]
+
 
 # SKIP_BRUGERTYPE
 
@@ -64,14 +72,25 @@ class ADParameterReader(AD):
         # with found users - this way the function replaces the old 
         # 'read it all' function, so there is now only one function
         # reading from AD.
-        settings = self._get_setting()
-
         logger.debug('Uncached AD read, user {}, cpr {}'.format(user, cpr))
 
+        response = self._read_from_ad(user=user, cpr=cpr)
+        self._add_users(response, ria)
+
+    def _read_from_ad(self, user=None, cpr=None):
         server = None
         if self.all_settings['primary']['servers']:
             server = random.choice(self.all_settings['primary']['servers'])
-        response = self.get_from_ad(user=user, cpr=cpr, server=server)
+        return self.get_from_ad(user=user, cpr=cpr, server=server)
+
+    def _add_users(self, response, ria=None):
+        """
+        Add the users read from AD to the cache, picking the included user
+        when a cpr number has more than one account.
+        :param response: The users, as returned by get_from_ad.
+        :param ria: Optional list, extended with the included users.
+        """
+        settings = self._get_setting()
 
         users_by_cpr = {}
         for user in response:
@@ -103,19 +122,104 @@ class ADParameterReader(AD):
             logger.error('Response from uncached_read_user: {}'.format(response))
             raise
 
+    def _open_partition_session(self):
+        """Give the thread reading a partition a WinRM session of its own."""
+        self._local.session = self._create_session()
+
+    def _read_partition(self, partition):
+        t = time.time()
+        response = self._read_from_ad(cpr=partition)
+        self.partition_times[partition] = time.time() - t
+        logger.info('Read {} users in {:.1f}s from partition {}'.format(
+            len(response), self.partition_times[partition], partition))
+        return response
+
+    def _read_partitions(self, print_progress=False):
+        """
+        Read the partitions concurrently, over a pool of WinRM sessions.
+        :return: The users read from each partition, in the order of
+        CPR_PARTITIONS.
+        """
+        self.partition_times = {}
+        sessions = self.all_settings['global']['ad_sessions']
+        executor = ThreadPoolExecutor(max_workers=sessions,
+                                      initializer=self._open_partition_session)
+        with executor:
+            responses = executor.map(self._read_partition, CPR_PARTITIONS)
+            return list(tqdm(responses, total=len(CPR_PARTITIONS),
+                             disable=not print_progress))
+
+    def _snapshot_key(self):
+        """Digest of the settings which decide the users read from AD."""
+        settings = {
+            key: value for key, value in self._get_setting().items()
+            if key != 'password'
+        }
+        return hashlib.sha256(
+            json.dumps(settings, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def _read_snapshot(self):
+        """
+        Read the users from the snapshot written by a previous read, if it is
+        recent enough.
+        :return: The users of each partition, or None if there is no usable
+        snapshot.
+        """
+        max_age = self.all_settings['global']['ad_snapshot_max_age']
+        if not max_age:
+            return None
+        try:
+            with open(self.snapshot_file()) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        timestamp = datetime.datetime.fromisoformat(snapshot['timestamp'])
+        age = (datetime.datetime.now() - timestamp).total_seconds()
+        if snapshot['key'] != self._snapshot_key() or age > max_age:
+            return None
+        logger.info('Using AD snapshot from {}'.format(timestamp))
+        return snapshot['partitions']
+
+    def _write_snapshot(self, partitions):
+        path = self.snapshot_file()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = '{}.tmp'.format(path)
+        # The snapshot holds the cpr numbers of the users, so it is only
+        # readable by its owner, also if a previous temporary file is reused
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        os.fchmod(fd, 0o600)
+        with open(fd, 'w') as f:
+            json.dump({
+                'timestamp': datetime.datetime.now().isoformat(),
+                'key': self._snapshot_key(),
+                'partitions': partitions,
+            }, f)
+        os.replace(tmp_path, path)
 
     def cache_all(self, print_progress=False):
+        """
+        Read all users from AD, and cache them.
+
+        The users are read in partitions by cpr number, concurrently. If the
+        snapshot of a previous read is younger than
+        integrations.ad.cache_all.snapshot_max_age, it is used instead.
+        :return: The included users.
+        """
         logger.info('Caching all users')
         t = time.time()
+        partitions = self._read_snapshot()
+        if partitions is None:
+            partitions = self._read_partitions(print_progress)
+            if self.all_settings['global']['ad_snapshot_max_age']:
+                self._write_snapshot(partitions)
+
         return_value = []
-        date_range = range(1, 32)
-        if print_progress:
-            date_range = tqdm(date_range)
-        for i in date_range:
-            day = str(i).zfill(2)
-            self.uncached_read_user(cpr='{}*'.format(day), ria=return_value)
-            logger.debug(len(self.results))
-            logger.debug('Read time: {}'.format(time.time() - t))
+        for response in partitions:
+            self._add_users(response, ria=return_value)
+        logger.debug(len(self.results))
+        logger.info('Read time: {}'.format(time.time() - t))
         return return_value
 
     def read_user(self, user=None, cpr=None, cache_only=False):
@@ -31,6 +31,7 @@ from integrations.ad_integration.ad_exceptions import (
 )
 
 from ad_common import AD
+from ad_dump import ADDumpIndex
 from user_names import CreateUserNames
 from os2mo_helpers.mora_helpers import MoraHelper
 
@@ -280,6 +281,8 @@ class ADWriter(AD):
         self.lc_historic = lc_historic
         self.helper = MoraHelper(hostname=self.settings['global']['mora.base'],
                                  use_cache=False)
+        # Index of the AD dump last passed to sync_user, see _ad_dump_index
+        self._dump_index = None
 
         self._init_name_creator()
 
@@ -326,12 +329,23 @@ class ADWriter(AD):
     def _read_user(self, uuid):
         return self.datasource.read_user(uuid)
 
+    def _ad_dump_index(self, ad_dump):
+        """
+        Return the index of an AD dump.
+        The index is built once per dump, and reused as long as the same dump
+        is passed in.
+        :param ad_dump: List of AD users.
+        """
+        if self._dump_index is None or self._dump_index.ad_dump is not ad_dump:
+            settings = self.all_settings['primary']
+            self._dump_index = ADDumpIndex(
+                ad_dump, settings['cpr_field'], settings.get('cpr_separator', '')
+            )
+        return self._dump_index
+
     def _find_ad_user(self, cpr, ad_dump):
-        ad_info = []
         if ad_dump is not None:
-            for user in ad_dump:
-                if user.get(self.all_settings['primary']['cpr_field']) == cpr:
-                    ad_info.append(user)
+            ad_info = self._ad_dump_index(ad_dump).find_cpr(cpr)
         else:
             ad_info = self.get_from_ad(cpr=cpr)
 
@@ -596,7 +610,7 @@ class ADWriter(AD):
         format_rules = {'user_sam': user_sam, 'manager_sam': manager_sam}
         ps_script = self._build_ps(ad_templates.add_manager_template, format_rules)
 
-        response = self._run_ps_script(ps_script)
+        response = self._run_ps_write_script(ps_script)
         return response is {}
 
     def _cf(self, ad_field, value, ad):
@@ -710,7 +724,7 @@ class ADWriter(AD):
                 server_string
             )
             logger.debug('Rename user, ps_script: {}'.format(ps_script))
-            response = self._run_ps_script(ps_script)
+            response = self._run_ps_write_script(ps_script)
             logger.debug('Response from sync: {}'.format(response))
             logger.debug('Wait for replication')
             # Todo: In principle we should ask all DCs, bu this will happen
@@ -747,7 +761,7 @@ class ADWriter(AD):
         )
         logger.debug('Sync user, ps_script: {}'.format(ps_script))
 
-        response = self._run_ps_script(ps_script)
+        response = self._run_ps_write_script(ps_script)
         logger.debug('Response from sync: {}'.format(response))
 
         if sync_manager and 'manager' in mismatch:
@@ -757,7 +771,7 @@ class ADWriter(AD):
 
         return (True, 'Sync completed', mo_values['read_manager'])
 
-    def create_user(self, mo_uuid, create_manager, dry_run=False):
+    def create_user(self, mo_uuid, create_manager, dry_run=False, ad_dump=None):
         """
         Create an AD user
         :param mo_uuid: uuid for the MO user we want to add to AD.
@@ -765,12 +779,16 @@ class ADWriter(AD):
         object and the AD object of the users manager.
         :param dry_run: Not yet implemented. Should return whether the user is
         expected to be able to be created in AD and the expected SamAccountName.
+        :param ad_dump: Optional dump of AD users, used to check for existing
+        accounts instead of asking AD.
         :return: The generated SamAccountName for the new user
         """
         # TODO: Implement dry_run
 
         bp = self._ps_boiler_plate()
-        mo_values = self.read_ad_information_from_mo(mo_uuid, create_manager)
+        mo_values = self.read_ad_information_from_mo(
+            mo_uuid, create_manager, ad_dump=ad_dump
+        )
         if mo_values is None:
             logger.error('Trying to create user with no engagements')
             raise NoPrimaryEngagementException
@@ -779,8 +797,13 @@ class ADWriter(AD):
         sam_account_name = self.name_creator.create_username(all_names,
                                                              dry_run=dry_run)[0]
 
-        existing_sam = self.get_from_ad(user=sam_account_name)
-        existing_cpr = self.get_from_ad(cpr=mo_values['cpr'])
+        if ad_dump is not None:
+            index = self._ad_dump_index(ad_dump)
+            existing_sam = index.find_sam(sam_account_name)
+            existing_cpr = index.find_cpr(mo_values['cpr'])
+        else:
+            existing_sam = self.get_from_ad(user=sam_account_name)
+            existing_cpr = self.get_from_ad(cpr=mo_values['cpr'])
         if existing_sam:
             logger.error('SamAccount already in use: {}'.format(sam_account_name))
             raise SamAccountNameNotUnique(sam_account_name)
@@ -811,7 +834,7 @@ class ADWriter(AD):
             bp['path']
         )
 
-        response = self._run_ps_script(ps_script)
+        response = self._run_ps_write_script(ps_script)
         if not response == {}:
             msg = 'Create user failed, message: {}'.format(response)
             logger.error(msg)
@@ -844,7 +867,7 @@ class ADWriter(AD):
 
         format_rules = {'username': username, 'password': password}
         ps_script = self._build_ps(ad_templates.set_password_template, format_rules)
-        response = self._run_ps_script(ps_script)
+        response = self._run_ps_write_script(ps_script)
         if not response:
             return (True, 'Password updated')
         else:
@@ -868,7 +891,7 @@ class ADWriter(AD):
             ps_script = self._build_ps(ad_templates.disable_user_template,
                                        format_rules)
 
-        response = self._run_ps_script(ps_script)
+        response = self._run_ps_write_script(ps_script)
         if not response:
             return (True, 'Account enabled or disabled')
         else:
@@ -887,7 +910,7 @@ class ADWriter(AD):
         ps_script = self._build_ps(ad_templates.delete_user_template,
                                    format_rules=format_rules)
 
-        response = self._run_ps_script(ps_script)
+        response = self._run_ps_write_script(ps_script)
         # TODO: Should we make a read to confirm the user is gone?
         if not response:
             return (True, 'User deleted')
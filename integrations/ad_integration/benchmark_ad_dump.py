@@ -0,0 +1,79 @@
+"""Compare looking up AD users by scanning the AD dump and by ADDumpIndex.
+
+Generates a synthetic AD dump, and times the lookups a sync of every user
+makes: the user is looked up twice (in sync_user and _sync_compare) and the
+manager once. The scan is quadratic, so it is timed for a sample of the users
+and extrapolated. Run from this directory with:
+
+    python benchmark_ad_dump.py --users 20000
+"""
+import random
+import time
+
+import click
+
+from ad_dump import ADDumpIndex
+
+CPR_FIELD = 'xAttrCPR'
+LOOKUPS_PER_USER = 3
+
+
+def generate_dump(num_users, seed=0):
+    """Generate AD users with unique SamAccountNames and cpr numbers."""
+    rnd = random.Random(seed)
+    cprs = rnd.sample(range(10 ** 10), num_users)
+    return [
+        {
+            'SamAccountName': 'user{}'.format(number),
+            'Name': 'Fornavn Efternavn',
+            'DistinguishedName': 'CN=user{},OU=Brugere,DC=andeby,DC=dk'.format(
+                number),
+            CPR_FIELD: '{:010d}'.format(cpr),
+        }
+        for number, cpr in enumerate(cprs)
+    ]
+
+
+def scan(ad_dump, cpr):
+    """The lookup ADWriter._find_ad_user did before the index."""
+    return [user for user in ad_dump if user.get(CPR_FIELD) == cpr]
+
+
+def sync_lookups(ad_dump, users, find):
+    rnd = random.Random(1)
+    for user in users:
+        manager = rnd.choice(ad_dump)
+        find(user[CPR_FIELD])
+        find(user[CPR_FIELD])
+        find(manager[CPR_FIELD])
+
+
+@click.command()
+@click.option('--users', default=20000, help='Number of users in the dump.')
+@click.option('--sample', default=200,
+              help='Number of users the scan is timed for.')
+def main(users, sample):
+    ad_dump = generate_dump(users)
+    sample = min(sample, users)
+
+    t = time.perf_counter()
+    sync_lookups(ad_dump, ad_dump[:sample], lambda cpr: scan(ad_dump, cpr))
+    scan_seconds = (time.perf_counter() - t) * users / sample
+
+    t = time.perf_counter()
+    index = ADDumpIndex(ad_dump, CPR_FIELD)
+    build_seconds = time.perf_counter() - t
+    t = time.perf_counter()
+    sync_lookups(ad_dump, ad_dump, index.find_cpr)
+    index_seconds = time.perf_counter() - t
+
+    lookups = users * LOOKUPS_PER_USER
+    click.echo('{} users, {} lookups'.format(users, lookups))
+    click.echo('Scan:  {:8.2f}s (extrapolated from {} users)'.format(
+        scan_seconds, sample))
+    click.echo('Index: {:8.2f}s ({:.2f}s to build)'.format(
+        build_seconds + index_seconds, build_seconds))
+
+
+if __name__ == '__main__':
+    main()
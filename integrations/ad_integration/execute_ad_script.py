@@ -140,7 +140,7 @@ class ADExecute(ADWriter):
             logger.error(msg)
             raise Exception(msg)
 
-        response = self._run_ps_script(exe.script)
+        response = self._run_ps_write_script(exe.script)
         if not response == {}:
             msg = 'Failed to execute this: {}'.format(self.script)
             logger.error(msg)
@@ -17,6 +17,13 @@ def _read_global_settings(top_settings):
     global_settings['winrm_host'] = top_settings.get('integrations.ad.winrm_host')
     global_settings['system_user'] = top_settings['integrations.ad'][0]['system_user']
     global_settings['password'] = top_settings['integrations.ad'][0]['password']
+    # Reading all users from AD, see ADParameterReader.cache_all
+    global_settings['ad_sessions'] = top_settings.get(
+        'integrations.ad.cache_all.sessions', 4)
+    global_settings['ad_snapshot_dir'] = top_settings.get(
+        'integrations.ad.cache_all.snapshot_dir', 'tmp')
+    global_settings['ad_snapshot_max_age'] = top_settings.get(
+        'integrations.ad.cache_all.snapshot_max_age', 0)
     if not global_settings['winrm_host']:
         msg = 'Missing hostname for remote management server'
         logger.error(msg)
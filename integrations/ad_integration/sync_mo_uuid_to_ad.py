@@ -98,7 +98,7 @@ class SyncMoUuidToAd(AD):
                 "\"=\"" + mo_uuid + "\"} " + server_string
             )
             logger.debug('PS-script: {}'.format(ps_script))
-            response = self._run_ps_script(ps_script)
+            response = self._run_ps_write_script(ps_script)
             logger.debug('Response: {}'.format(response))
             if response: 
                 msg= 'Unexpected response: {}'.format(response)
@@ -0,0 +1,37 @@
+# TODO: Fix imports in module
+import sys
+from os.path import dirname
+
+sys.path.append(dirname(__file__) + "/..")
+
+from unittest import TestCase
+
+from ad_dump import ADDumpIndex
+
+
+class TestADDumpIndex(TestCase):
+    def setUp(self):
+        self.ad_dump = [
+            {"SamAccountName": "MGORE", "cpr": "112233-4455"},
+            {"SamAccountName": "DMILL", "cpr": "010101-1234"},
+            {"SamAccountName": "DMILL2", "cpr": "010101-1234"},
+            {"SamAccountName": "NOCPR"},
+        ]
+
+    def test_find_cpr(self):
+        index = ADDumpIndex(self.ad_dump, "cpr", "-")
+        self.assertEqual(index.find_cpr("1122334455"), [self.ad_dump[0]])
+        self.assertEqual(index.find_cpr("112233-4455"), [self.ad_dump[0]])
+        self.assertEqual(index.find_cpr("0101011234"), self.ad_dump[1:3])
+        self.assertEqual(index.find_cpr("9999999999"), [])
+        self.assertEqual(index.duplicate_cprs, {"0101011234"})
+
+    def test_find_cpr_without_separator(self):
+        index = ADDumpIndex(self.ad_dump, "cpr")
+        self.assertEqual(index.find_cpr("1122334455"), [])
+        self.assertEqual(index.find_cpr("112233-4455"), [self.ad_dump[0]])
+
+    def test_find_sam(self):
+        index = ADDumpIndex(self.ad_dump, "cpr")
+        self.assertEqual(index.find_sam("mgore"), self.ad_dump[0])
+        self.assertIsNone(index.find_sam("unknown"))
@@ -0,0 +1,156 @@
+# TODO: Fix imports in module
+import sys
+from os.path import dirname
+
+sys.path.append(dirname(__file__) + "/..")
+
+import os
+import tempfile
+import threading
+from unittest import TestCase
+from unittest.mock import patch
+
+from integrations.ad_integration.read_ad_conf_settings import read_settings
+from winrm.exceptions import WinRMTransportError
+
+from ad_reader import CPR_PARTITIONS, ADParameterReader
+from tests.test_utils import FakePowerShellSession, TestADMixin
+
+
+def _ad_user(number, day):
+    return {
+        "SamAccountName": "user{}".format(number),
+        "cpr_field": "{:02d}0101-{:04d}".format(day, number),
+    }
+
+
+class ADParameterReaderTestSubclass(ADParameterReader):
+    """Testing subclass of ADParameterReader, reading from fake sessions."""
+
+    def __init__(self, ad_users, failures=0, *args, **kwargs):
+        self.ad_users = ad_users
+        # Number of sessions to be created which fail on their first script
+        self.failures = failures
+        # Every session created, the first one is the shared session
+        self.sessions = []
+        self._lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def _create_session(self):
+        with self._lock:
+            session = FakePowerShellSession(
+                self.ad_users,
+                "cpr_field",
+                failures=1 if self.failures else 0,
+                exception=WinRMTransportError,
+            )
+            self.failures = max(self.failures - 1, 0)
+            self.sessions.append(session)
+        return session
+
+    @property
+    def scripts(self):
+        return [script for session in self.sessions for script in session.scripts]
+
+
+class TestADParameterReader(TestCase, TestADMixin):
+    def setUp(self):
+        self.ad_users = [_ad_user(number, number % 31 + 1) for number in range(100)]
+        self.snapshot_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.snapshot_dir.cleanup)
+
+    def _settings(self, **settings):
+        def add_settings(default_settings):
+            default_settings["integrations.ad"][0]["cpr_separator"] = "-"
+            default_settings["integrations.ad.cache_all.snapshot_dir"] = (
+                self.snapshot_dir.name
+            )
+            default_settings.update(settings)
+            return default_settings
+
+        return read_settings(self._prepare_settings(add_settings))
+
+    def _reader(self, **settings):
+        return ADParameterReaderTestSubclass(
+            self.ad_users, all_settings=self._settings(**settings)
+        )
+
+    def test_cache_all_reads_partitions_concurrently(self):
+        reader = self._reader(**{"integrations.ad.cache_all.sessions": 3})
+        users = reader.cache_all()
+
+        self.assertCountEqual(users, self.ad_users)
+        self.assertEqual(len(reader.scripts), len(CPR_PARTITIONS))
+        self.assertEqual(set(reader.partition_times), set(CPR_PARTITIONS))
+        for user in self.ad_users:
+            self.assertEqual(reader.results[user["SamAccountName"]], user)
+            cpr = user["cpr_field"].replace("-", "")
+            self.assertEqual(reader.results[cpr], user)
+        # The shared session is unused, the partitions are read by the
+        # sessions of the pool
+        self.assertLessEqual(len(reader.sessions), 1 + 3)
+        self.assertEqual(reader.sessions[0].scripts, [])
+        self.assertNotIn(
+            threading.current_thread().name,
+            set.union(*(session.threads for session in reader.sessions)),
+        )
+
+    def test_cache_all_without_snapshot(self):
+        self._reader().cache_all()
+        self.assertFalse(os.path.exists(self._reader().snapshot_file()))
+
+        reader = self._reader()
+        reader.cache_all()
+        self.assertEqual(len(reader.scripts), len(CPR_PARTITIONS))
+
+    def test_cache_all_uses_snapshot(self):
+        settings = {"integrations.ad.cache_all.snapshot_max_age": 3600}
+        users = self._reader(**settings).cache_all()
+
+        reader = self._reader(**settings)
+        self.assertEqual(reader.cache_all(), users)
+        self.assertEqual(reader.scripts, [])
+        self.assertEqual(
+            reader.read_user(cpr="0201010001", cache_only=True), self.ad_users[1]
+        )
+
+    def test_snapshot_is_private(self):
+        settings = {"integrations.ad.cache_all.snapshot_max_age": 3600}
+        reader = self._reader(**settings)
+        # A temporary file left by an earlier run, readable by others
+        open(reader.snapshot_file() + ".tmp", "w").close()
+        os.chmod(reader.snapshot_file() + ".tmp", 0o644)
+        reader.cache_all()
+
+        self.assertEqual(os.stat(reader.snapshot_file()).st_mode & 0o777, 0o600)
+
+    def test_snapshot_of_other_settings_is_not_used(self):
+        settings = {"integrations.ad.cache_all.snapshot_max_age": 3600}
+        self._reader(**settings).cache_all()
+
+        reader = self._reader(**settings)
+        reader.all_settings["primary"]["search_base"] = "other_search_base"
+        reader.cache_all()
+        self.assertEqual(len(reader.scripts), len(CPR_PARTITIONS))
+
+    def test_invalidated_snapshot_is_not_used(self):
+        settings = {"integrations.ad.cache_all.snapshot_max_age": 3600}
+        self._reader(**settings).cache_all()
+
+        reader = self._reader(**settings)
+        reader.invalidate_snapshot()
+        reader.invalidate_snapshot()
+        reader.cache_all()
+        self.assertEqual(len(reader.scripts), len(CPR_PARTITIONS))
+
+    @patch("integrations.ad_integration.ad_common.time.sleep")
+    def test_retry_with_backoff(self, sleep):
+        # A single session in the pool, replaced after each error
+        reader = self._reader(**{"integrations.ad.cache_all.sessions": 1})
+        reader.failures = 3
+        reader.cache_all()
+
+        self.assertEqual(
+            [call.args for call in sleep.call_args_list], [(0.5,), (1.0,), (2.0,)]
+        )
+        self.assertEqual(len(reader.scripts), len(CPR_PARTITIONS) + 3)
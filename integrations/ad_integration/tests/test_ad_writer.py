@@ -5,8 +5,11 @@ from os.path import dirname
 sys.path.append(dirname(__file__))
 sys.path.append(dirname(__file__) + "/..")
 
+import os
+import tempfile
 from unittest import TestCase
 
+from integrations.ad_integration import ad_exceptions
 from parameterized import parameterized
 from test_utils import TestADWriterMixin, dict_modifier, mo_modifier
 
@@ -557,6 +560,49 @@ class TestADWriter(TestCase, TestADWriterMixin):
         mismatch = self.ad_writer._sync_compare(mo_values, None)
         self.assertEqual(mismatch, {})
 
+    def test_find_ad_user_in_dump(self):
+        ad_dump = [
+            {"SamAccountName": "MGORE", "cpr_field": "1122334455"},
+            {"SamAccountName": "DMILL", "cpr_field": "0101011234"},
+            {"SamAccountName": "DMILL2", "cpr_field": "0101011234"},
+        ]
+        self.assertEqual(
+            self.ad_writer._find_ad_user("1122334455", ad_dump), [ad_dump[0]]
+        )
+        with self.assertRaises(ad_exceptions.CprNotNotUnique):
+            self.ad_writer._find_ad_user("0101011234", ad_dump)
+        with self.assertRaises(ad_exceptions.CprNotFoundInADException):
+            self.ad_writer._find_ad_user("9999999999", ad_dump)
+        # The index is built once per dump
+        index = self.ad_writer._dump_index
+        self.ad_writer._find_ad_user("1122334455", ad_dump)
+        self.assertIs(self.ad_writer._dump_index, index)
+        self.assertEqual(self.ad_writer.scripts, [])
+
+    def test_create_user_with_ad_dump(self):
+        uuid = "invalid-provided-and-accepted-due-to-mocking"
+        mo_values = self.ad_writer.read_ad_information_from_mo(uuid)
+
+        # Existing accounts are found in the dump, rather than in AD
+        self.ad_writer.create_user(mo_uuid=uuid, create_manager=False, ad_dump=[])
+        self.assertEqual(len(self.ad_writer.scripts), 1)
+
+        ad_dump = [{"SamAccountName": "other", "cpr_field": mo_values["cpr"]}]
+        with self.assertRaises(ad_exceptions.CprNotNotUnique):
+            self.ad_writer.create_user(
+                mo_uuid=uuid, create_manager=False, ad_dump=ad_dump
+            )
+
+        sam = self.ad_writer.name_creator.create_username(
+            mo_values["name"][0].split(" ") + [mo_values["name"][1]], dry_run=True
+        )[0]
+        ad_dump = [{"SamAccountName": sam.lower(), "cpr_field": "0101011234"}]
+        with self.assertRaises(ad_exceptions.SamAccountNameNotUnique):
+            self.ad_writer.create_user(
+                mo_uuid=uuid, create_manager=False, ad_dump=ad_dump
+            )
+        self.assertEqual(len(self.ad_writer.scripts), 1)
+
     def test_add_manager(self):
         mo_values = self.ad_writer.read_ad_information_from_mo(
             uuid="0", read_manager=True
@@ -598,3 +644,22 @@ class TestADWriter(TestCase, TestADWriterMixin):
             + " -Credential $usercredential"
         ).format(password)
         self.assertEqual(set_password_ps, expected_line)
+
+    @parameterized.expand(
+        [
+            ("add_manager_to_user", ("MGORE", "MANAGER")),
+            ("set_user_password", ("MGORE", "password")),
+            ("enable_user", ("MGORE",)),
+            ("enable_user", ("MGORE", False)),
+            ("delete_user", ("MGORE",)),
+        ]
+    )
+    def test_write_invalidates_snapshot(self, method, args):
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            self.ad_writer.all_settings["global"]["ad_snapshot_dir"] = snapshot_dir
+            snapshot_file = self.ad_writer.snapshot_file()
+            open(snapshot_file, "w").close()
+
+            getattr(self.ad_writer, method)(*args)
+            self.assertEqual(len(self.ad_writer.scripts), 1)
+            self.assertFalse(os.path.exists(snapshot_file))
@@ -1,3 +1,6 @@
+import json
+import re
+import threading
 import time
 import uuid
 from datetime import datetime
@@ -8,6 +11,7 @@ from unittest import TestCase
 import requests
 from integrations.ad_integration.read_ad_conf_settings import read_settings
 
+from ad_common import ENCODING
 from ad_sync import AdMoSync
 from ad_writer import ADWriter
 from tests.name_simulator import create_name
@@ -192,6 +196,52 @@ class ADWriterTestSubclass(ADWriter):
         raise NotImplemented("Should be overridden in __init__")
 
 
+class FakePowerShellSession:
+    """Fake WinRM session, answering Get-ADUser scripts from a list of users.
+
+    Cpr searches (-like "<pattern>") are answered with the users whose
+    cpr_field matches the pattern, and SamAccountName searches with the user
+    of that name. The first `failures` scripts fail with a transport error.
+    """
+
+    def __init__(self, ad_users, cpr_field, failures=0, exception=Exception):
+        self.ad_users = ad_users
+        self.cpr_field = cpr_field
+        self.failures = failures
+        self.exception = exception
+        # Scripts run, and the names of the threads running them
+        self.scripts = []
+        self.threads = set()
+
+    def run_ps(self, ps_script):
+        self.scripts.append(ps_script)
+        self.threads.add(threading.current_thread().name)
+        if self.failures:
+            self.failures -= 1
+            raise self.exception("Fake transport error")
+
+        cpr = re.search(self.cpr_field + r' -like "([^"]*)"', ps_script)
+        sam = re.search(r'SamAccountName -eq "([^"]*)"', ps_script)
+        if cpr:
+            pattern = re.compile(re.escape(cpr.group(1)).replace(r"\*", ".*"))
+            users = [
+                user
+                for user in self.ad_users
+                if pattern.fullmatch(user.get(self.cpr_field, ""))
+            ]
+        elif sam:
+            users = [
+                user
+                for user in self.ad_users
+                if user["SamAccountName"] == sam.group(1)
+            ]
+        else:
+            users = []
+
+        std_out = json.dumps(users).encode(ENCODING) if users else b""
+        return AttrDict({"status_code": 0, "std_out": std_out, "std_err": b""})
+
+
 def _no_transformation(default, *args, **kwargs):
     return default
 
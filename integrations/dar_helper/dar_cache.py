@@ -0,0 +1,113 @@
+import json
+import sqlite3
+import time
+from collections import Counter
+
+from more_itertools import chunked
+
+# DAR addresses almost never change, and addresses which are not found are
+# retried sooner, in case they were just created.
+DEFAULT_TTL = 30 * 24 * 3600
+DEFAULT_NEGATIVE_TTL = 24 * 3600
+DEFAULT_CACHE_FILE = "tmp/dar_cache.db"
+
+# Stay below the SQLite limit on the number of query parameters
+QUERY_CHUNK_SIZE = 500
+
+
+class DARCache:
+    """Persistent cache of DAR lookups, stored in SQLite keyed by UUID.
+
+    Lookups which found nothing are cached too, with a shorter TTL.
+
+    Example:
+
+        with DARCache() as cache:
+            found, missing, unknown = cache.lookup(uuids)
+
+    Args:
+        path: Path of the SQLite file, ':memory:' for a cache which is not
+            persisted.
+        ttl: Seconds a found address is cached.
+        negative_ttl: Seconds an address which was not found is cached.
+    """
+
+    def __init__(
+        self,
+        path=DEFAULT_CACHE_FILE,
+        ttl=DEFAULT_TTL,
+        negative_ttl=DEFAULT_NEGATIVE_TTL,
+    ):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # Statistics on the lookups, see lookup
+        self.stats = Counter(hit=0, negative_hit=0, miss=0)
+
+        # The file is shared by several programs, wait for their writes
+        self.connection = sqlite3.connect(path, timeout=60)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS dar ("
+                "uuid TEXT PRIMARY KEY, address TEXT, fetched REAL NOT NULL)"
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def lookup(self, uuids):
+        """Lookup UUIDs in the cache.
+
+        Args:
+            uuids: Iterable of DAR UUIDs.
+
+        Returns:
+            (dict, set, set):
+                dict: Map from UUID to cached DAR reply.
+                set: UUIDs cached as not found in DAR.
+                set: UUIDs not in the cache, or expired.
+        """
+        uuids = set(uuids)
+        now = time.time()
+        found = {}
+        missing = set()
+        for chunk in chunked(uuids, QUERY_CHUNK_SIZE):
+            rows = self.connection.execute(
+                "SELECT uuid, address, fetched FROM dar WHERE uuid IN ({})".format(
+                    ", ".join("?" * len(chunk))
+                ),
+                chunk,
+            )
+            for uuid, address, fetched in rows:
+                if address is None:
+                    if fetched + self.negative_ttl > now:
+                        missing.add(uuid)
+                elif fetched + self.ttl > now:
+                    found[uuid] = json.loads(address)
+        unknown = uuids - found.keys() - missing
+
+        self.stats["hit"] += len(found)
+        self.stats["negative_hit"] += len(missing)
+        self.stats["miss"] += len(unknown)
+        return found, missing, unknown
+
+    def store(self, found, missing=()):
+        """Store the result of DAR lookups.
+
+        Args:
+            found: Map from UUID to DAR reply.
+            missing: UUIDs which were not found in DAR.
+        """
+        now = time.time()
+        rows = [(uuid, json.dumps(address), now) for uuid, address in found.items()]
+        rows.extend((uuid, None, now) for uuid in missing)
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO dar (uuid, address, fetched) VALUES (?, ?, ?)",
+                rows,
+            )
@@ -117,3 +117,50 @@ async def dar_fetch(uuids, addrtype="adresser", chunk_size=150, client=None):
 async def sync_dar_fetch(uuids, addrtype="adresser", chunk_size=150):
     """Syncronized version of dar_fetch."""
     return await dar_fetch(uuids, addrtype, chunk_size)
+
+
+@ensure_session
+async def dar_fetch_cached(
+    uuids,
+    cache,
+    addrtypes=("adresser", "adgangsadresser"),
+    chunk_size=150,
+    client=None,
+):
+    """Lookup uuids in DAR, through a persistent cache.
+
+    Only the UUIDs not in the cache are looked up in DAR, and the result of the
+    lookup is stored in the cache. UUIDs not found as the first address type are
+    looked up as the next.
+
+    Args:
+        uuids: List of DAR UUIDs.
+        cache: DARCache to use.
+        addrtypes: The address types to lookup, in order.
+        chunk_size: Number of UUIDs per block, sent to DAR.
+        client (optional): aiohttp.ClientSession to use for connecting.
+
+    Returns:
+        (dict, set):
+            dict: Map from UUID to DAR reply.
+            set: Set of UUIDs of entries which were not found.
+    """
+    result, missing, unknown = cache.lookup(uuids)
+    for addrtype in addrtypes:
+        if not unknown:
+            break
+        found, unknown = await dar_fetch(
+            list(unknown), addrtype, chunk_size, client=client
+        )
+        cache.store(found)
+        result.update(found)
+    cache.store({}, unknown)
+    return result, missing | unknown
+
+
+@async_to_sync
+async def sync_dar_fetch_cached(
+    uuids, cache, addrtypes=("adresser", "adgangsadresser"), chunk_size=150
+):
+    """Syncronized version of dar_fetch_cached."""
+    return await dar_fetch_cached(uuids, cache, addrtypes, chunk_size)
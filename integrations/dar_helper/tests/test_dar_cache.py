@@ -0,0 +1,66 @@
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+from integrations.dar_helper import dar_helper
+from integrations.dar_helper.dar_cache import DARCache
+
+
+class TestDARCache(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.path = "{}/dar_cache.db".format(tmp_dir.name)
+
+    def test_persisted(self):
+        with DARCache(self.path) as cache:
+            cache.store({"a": {"id": "a", "betegnelse": "Vej 1"}}, missing={"b"})
+
+        with DARCache(self.path) as cache:
+            found, missing, unknown = cache.lookup(["a", "b", "c"])
+            self.assertEqual(found, {"a": {"id": "a", "betegnelse": "Vej 1"}})
+            self.assertEqual(missing, {"b"})
+            self.assertEqual(unknown, {"c"})
+            self.assertEqual(cache.stats, {"hit": 1, "negative_hit": 1, "miss": 1})
+
+    def test_expired(self):
+        with DARCache(self.path, ttl=10, negative_ttl=5) as cache:
+            cache.store({"a": {"id": "a"}}, missing={"b"})
+            later = time.time() + 6
+            with patch(
+                "integrations.dar_helper.dar_cache.time.time", return_value=later
+            ):
+                self.assertEqual(
+                    cache.lookup(["a", "b"]), ({"a": {"id": "a"}}, set(), {"b"})
+                )
+
+    @patch("integrations.dar_helper.dar_helper.dar_fetch")
+    def test_dar_fetch_cached(self, dar_fetch):
+        replies = {
+            "adresser": {"a": {"id": "a"}},
+            "adgangsadresser": {"b": {"id": "b"}},
+        }
+
+        async def fake_dar_fetch(uuids, addrtype, chunk_size, client):
+            found = {
+                uuid: replies[addrtype][uuid]
+                for uuid in uuids
+                if uuid in replies[addrtype]
+            }
+            return found, set(uuids) - found.keys()
+
+        dar_fetch.side_effect = fake_dar_fetch
+
+        with DARCache(self.path) as cache:
+            result = dar_helper.sync_dar_fetch_cached(["a", "b", "c"], cache)
+        self.assertEqual(result, ({"a": {"id": "a"}, "b": {"id": "b"}}, {"c"}))
+        self.assertEqual(dar_fetch.call_count, 2)
+
+        # Only cache hits, including the negative result for c
+        dar_fetch.reset_mock()
+        with DARCache(self.path) as cache:
+            result = dar_helper.sync_dar_fetch_cached(["a", "b", "c"], cache)
+            self.assertEqual(cache.stats, {"hit": 2, "negative_hit": 1, "miss": 0})
+        self.assertEqual(result, ({"a": {"id": "a"}, "b": {"id": "b"}}, {"c"}))
+        dar_fetch.assert_not_called()
@@ -0,0 +1,21 @@
+import asyncio
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from integrations.dar_helper.utils import async_to_sync
+
+
+@async_to_sync
+async def running_loop():
+    await asyncio.sleep(0)
+    return asyncio.get_running_loop()
+
+
+class TestAsyncToSync(unittest.TestCase):
+    def test_loop_is_closed(self):
+        self.assertTrue(running_loop().is_closed())
+
+    def test_worker_thread(self):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            loops = list(executor.map(lambda _: running_loop(), range(4)))
+        self.assertTrue(all(loop.is_closed() for loop in loops))
@@ -22,8 +22,8 @@ def async_to_sync(f):
 
     @wraps(f)
     def wrapper(*args, **kwargs):
-        loop = asyncio.get_event_loop()
-        future = asyncio.ensure_future(f(*args, **kwargs))
-        return loop.run_until_complete(future)
+        # A fresh event loop, closed when done, so the function can also be
+        # run from worker threads, which have no event loop of their own
+        return asyncio.run(f(*args, **kwargs))
 
     return wrapper
@@ -0,0 +1,135 @@
+"""Compare the streaming Opus differ with reading and diffing whole dumps.
+
+Generates two Opus dumps where a fraction of the employees and units differ,
+and times opus_helpers.file_diff against the previous implementation, which
+parsed both dumps in full and ran DeepDiff on every record. Run with:
+
+    python -m integrations.opus.benchmark_opus_diff --employees 20000
+"""
+import random
+import tempfile
+import time
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+import click
+import xmltodict
+from deepdiff import DeepDiff
+
+from integrations.opus import opus_helpers
+
+
+def _element(tag, attributes, fields):
+    attrs = ''.join(' {}="{}"'.format(key, value) for key, value in attributes)
+    body = ''.join(
+        '<{0}>{1}</{0}>'.format(key, escape(value)) if value else '<{}/>'.format(key)
+        for key, value in fields
+    )
+    return ' <{0}{1}>{2}</{0}>\n'.format(tag, attrs, body)
+
+
+def generate_dump(path, num_units, num_employees, changed, seed):
+    """Write an Opus-like dump, where a fraction of the records depend on seed.
+
+    Dumps generated with different seeds share their unchanged records, apart
+    from lastChanged and the fractions, which the differ ignores.
+    """
+    rnd = random.Random(seed)
+    base = random.Random(0)
+
+    def variant(value):
+        return value + 'x' if rnd.random() < changed else value
+
+    with open(str(path), 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n<kmd>\n')
+        for unit in range(1, num_units + 1):
+            f.write(_element('orgUnit', [
+                ('id', unit), ('client', 813), ('lastChanged', seed),
+            ], [
+                ('startDate', '1900-01-01'), ('endDate', '9999-12-31'),
+                ('parentOrgUnit', str(base.randrange(1, unit)) if unit > 1 else ''),
+                ('shortName', 'E{}'.format(unit)),
+                ('longName', variant('Enhed {}'.format(unit))),
+                ('street', 'Vej {}'.format(unit)), ('zipCode', '8880'),
+                ('city', 'Andeby'), ('phoneNumber', '12345678'),
+                ('orgType', '00001'), ('orgTypeTxt', 'Afdeling'),
+            ]))
+        for employee in range(1000, 1000 + num_employees):
+            f.write(_element('employee', [
+                ('id', employee), ('client', 813), ('lastChanged', seed),
+            ], [
+                ('entryDate', '2010-01-01'), ('leaveDate', ''),
+                ('cpr', '{:010d}'.format(base.randrange(10 ** 10))),
+                ('firstName', 'Fornavn'), ('lastName', variant('Efternavn')),
+                ('address', 'Testvej {}'.format(employee)),
+                ('postalCode', '8880'), ('city', 'Andeby'), ('country', 'DK'),
+                ('workPhone', ''), ('workContract', '08'),
+                ('workContractText', 'Ansat'), ('positionId', '500'),
+                ('position', variant('Ansat')), ('positionShort', 'ANSAT'),
+                ('isManager', 'false'), ('superiorLevel', '0'),
+                ('subordinateLevel', '00'),
+                ('orgUnit', str(base.randrange(1, num_units + 1))),
+                ('payGradeText', 'LØN'),
+                ('numerator', str(rnd.randrange(1, 38))), ('denominator', '37'),
+            ]))
+        f.write('</kmd>\n')
+
+
+def legacy_file_diff(file1, file2):
+    """The differ before it was streaming and hash-indexed."""
+    def parse(target_file):
+        data = xmltodict.parse(target_file.read_text())['kmd']
+        return data['orgUnit'], data['employee']
+
+    def find_changes(before, after):
+        old_ids = [obj['@id'] for obj in before]
+        old_map = dict(zip(old_ids, before))
+
+        def find_changed(obj):
+            if obj['@id'] not in old_ids:
+                return True
+            diff = DeepDiff(obj, old_map[obj['@id']], exclude_paths={
+                "root['@lastChanged']", "root['numerator']", "root['denominator']"
+            })
+            return bool(diff)
+
+        return list(filter(find_changed, after))
+
+    units1, employees1 = parse(file1)
+    units2, employees2 = parse(file2)
+    return find_changes(units1, units2), find_changes(employees1, employees2)
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+@click.command()
+@click.option('--units', default=500, help='Number of units per dump.')
+@click.option('--employees', default=10000, help='Number of employees per dump.')
+@click.option('--changed', default=0.02, help='Fraction of changed records.')
+def cli(units, employees, changed):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file1 = Path(tmp_dir) / 'dump1.xml'
+        file2 = Path(tmp_dir) / 'dump2.xml'
+        generate_dump(file1, units, employees, changed, seed=1)
+        generate_dump(file2, units, employees, changed, seed=2)
+        size = file2.stat().st_size / 2 ** 20
+
+        streamed, streamed_time = timed(
+            lambda: opus_helpers.file_diff(file1, file2, [], disable_tqdm=True)
+        )
+        legacy, legacy_time = timed(lambda: legacy_file_diff(file1, file2))
+    assert streamed == legacy
+
+    click.echo('Dumps of {:.1f}M, {} changed units, {} changed employees'.format(
+        size, len(streamed[0]), len(streamed[1])))
+    click.echo('{:<12} {:>9.1f}s'.format('legacy', legacy_time))
+    click.echo('{:<12} {:>9.1f}s'.format('streaming', streamed_time))
+    click.echo('{:<12} {:>9.1f}x'.format('speedup', legacy_time / streamed_time))
+
+
+if __name__ == '__main__':
+    cli()
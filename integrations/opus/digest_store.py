@@ -0,0 +1,81 @@
+import datetime
+import sqlite3
+from collections import defaultdict
+from typing import Dict, Optional
+
+DEFAULT_DIGEST_DB = 'tmp/opus_digests.db'
+
+
+class DigestStore:
+    """Persistent store of the record digests of the latest imported Opus dump.
+
+    Holds the digest of every employee, and of every orgUnit passing the unit
+    filter, keyed by record type and '@id', with the date of the dump they were
+    last seen in. A diff of the next dump is made against the store, so the
+    previous dump need not be parsed.
+
+    Args:
+        path: Path of the SQLite file.
+    """
+
+    def __init__(self, path: str = DEFAULT_DIGEST_DB):
+        self.connection = sqlite3.connect(
+            path, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES
+        )
+        with self.connection:
+            self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS digests (
+            record_type TEXT NOT NULL, id TEXT NOT NULL, digest BLOB NOT NULL,
+            dump_date timestamp NOT NULL, PRIMARY KEY (record_type, id))
+            """)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def dump_date(self) -> Optional[datetime.datetime]:
+        """Date of the dump the store holds, None if the store is empty."""
+        row = self.connection.execute(
+            'SELECT max(dump_date) AS "dump_date [timestamp]" FROM digests'
+        ).fetchone()
+        return row[0]
+
+    def load(self) -> Dict[str, Dict[str, bytes]]:
+        """Map from record type to a map from '@id' to digest."""
+        digests = defaultdict(dict)
+        rows = self.connection.execute(
+            'SELECT record_type, id, digest FROM digests'
+        )
+        for record_type, record_id, digest in rows:
+            digests[record_type][record_id] = digest
+        return digests
+
+    def replace(self, dump_date: datetime.datetime,
+                digests: Dict[str, Dict[str, bytes]]) -> None:
+        """Replace the contents of the store with the digests of a dump.
+
+        Records which are not in the dump are removed, as a diff is always made
+        against the previous dump.
+
+        Args:
+            dump_date: Date of the dump.
+            digests: Map from record type to a map from '@id' to digest.
+        """
+        rows = (
+            (record_type, record_id, digest, dump_date)
+            for record_type, type_digests in digests.items()
+            for record_id, digest in type_digests.items()
+        )
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO digests (record_type, id, digest, dump_date) '
+                'VALUES (?, ?, ?, ?)', rows
+            )
+            self.connection.execute(
+                'DELETE FROM digests WHERE dump_date != ?', (dump_date,)
+            )
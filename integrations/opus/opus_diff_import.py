@@ -1,5 +1,8 @@
 import json
 import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 from operator import itemgetter
 from pathlib import Path
@@ -7,7 +10,7 @@ from pathlib import Path
 import click
 import requests
 import xmltodict
-from os2mo_helpers.mora_helpers import MoraHelper
+from os2mo_helpers.mora_helpers import DEFAULT_POOL_SIZE, MoraHelper
 from requests import Session
 from tqdm import tqdm
 
@@ -17,6 +20,7 @@ from integrations import dawa_helper
 from integrations.ad_integration import ad_reader
 from integrations.opus import opus_helpers, payloads
 from integrations.opus.calculate_primary import MOPrimaryEngagementUpdater
+from integrations.opus.digest_store import DEFAULT_DIGEST_DB, DigestStore
 from integrations.opus.opus_exceptions import (
     EmploymentIdentifierNotUnique,
     ImporterrunNotCompleted,
@@ -69,6 +73,10 @@ class OpusDiffImport(object):
         self.settings = load_settings()
         self.filter_ids = self.settings.get('integrations.opus.units.filter_ids', [])
 
+        # Number of employees imported concurrently, see start_import
+        self.workers = self.settings.get('integrations.opus.import.workers', 1)
+        self._local = threading.local()
+
         self.session = Session()
         self.employee_forced_uuids = employee_mapping
         self.ad_reader = ad_reader
@@ -124,7 +132,19 @@ class OpusDiffImport(object):
         return types_dict, facet
 
     def _get_mora_helper(self, hostname="localhost:5000", use_cache=False):
-        return MoraHelper(hostname=self.settings['mora.base'], use_cache=False)
+        return MoraHelper(hostname=self.settings['mora.base'], use_cache=False,
+                          pool_size=max(self.workers, DEFAULT_POOL_SIZE))
+
+    def _get_updater(self):
+        """The primary engagement updater of the current thread.
+
+        The updater holds the person it is updating, so each worker of a
+        concurrent import has its own.
+        """
+        return getattr(self._local, 'updater', self.updater)
+
+    def _init_worker(self):
+        self._local.updater = MOPrimaryEngagementUpdater()
 
     # This exact function also exists in sd_changed_at
     def _assert(self, response):
@@ -767,8 +787,9 @@ class OpusDiffImport(object):
             self.update_engagement(eng, employee)
 
         self.update_manager_status(employee_mo_uuid, employee)
-        self.updater.set_current_person(cpr=cpr)
-        self.updater.recalculate_primary()
+        updater = self._get_updater()
+        updater.set_current_person(cpr=cpr)
+        updater.recalculate_primary()
 
     def terminate_detail(self, uuid, detail_type='engagement', end_date=None):
         if end_date is None:
@@ -813,42 +834,105 @@ class OpusDiffImport(object):
                     self.terminate_detail(org_funk_info['manager'],
                                           detail_type='manager')
 
+    def _import_employee(self, employee, include_terminations):
+        last_changed_str = employee.get('@lastChanged')
+        if last_changed_str is not None:  # This is a true employee-object.
+            self.update_employee(employee)
+
+            if 'function' in employee:
+                self.update_roller(employee)
+        else:  # This is an implicit termination.
+            if not include_terminations:
+                return
+
+            # This is a terminated employee, check if engagement is active
+            # terminate if it is.
+            if not employee['@action'] == 'leave':
+                msg = 'Missing date on a non-leave object!'
+                logger.error(msg)
+                raise Exception(msg)
+
+            eng_info = self._find_engagement(employee['@id'], 'Engagement', present=True)
+            if eng_info:
+                logger.info('Terminating: {}'.format(eng_info))
+                self.terminate_detail(eng_info)
+                manager_info = self._find_engagement(employee['@id'], 'Leder', present=True)
+                if manager_info:
+                    self.terminate_detail(manager_info, detail_type='manager')
+
+    def _import_employee_batch(self, employees, include_terminations):
+        """
+        Import a batch of employees in order, stopping at the first failure.
+        :return: List of ids of the employees which were not imported.
+        """
+        for index, employee in enumerate(employees):
+            try:
+                self._import_employee(employee, include_terminations)
+            except Exception:
+                logger.exception('Import of employee {} failed'.format(
+                    employee['@id']))
+                # Later employments of the person may depend on this one
+                return [failed['@id'] for failed in employees[index:]]
+        return []
+
+    def _import_employees_concurrently(self, employees, include_terminations):
+        """
+        Import employees with a pool of workers.
+
+        The employments of a person are imported in order by the same worker.
+        Terminations do not tell which person they belong to, so they are
+        imported once all other employees are done.
+        :return: List of ids of the employees which were not imported.
+        """
+        persons = defaultdict(list)
+        terminations = []
+        for employee in employees:
+            if employee.get('@lastChanged') is not None:
+                persons[employee['cpr']['#text']].append(employee)
+            else:
+                terminations.append([employee])
+
+        failed = []
+        with ThreadPoolExecutor(max_workers=self.workers,
+                                initializer=self._init_worker) as executor:
+            for batches in (persons.values(), terminations):
+                futures = [
+                    executor.submit(self._import_employee_batch, batch,
+                                    include_terminations)
+                    for batch in batches
+                ]
+                for future in tqdm(as_completed(futures), total=len(futures),
+                                   desc="Update employees"):
+                    failed.extend(future.result())
+        return failed
+
     def start_import(self, units, employees, include_terminations=False):
         """
         Start an opus import, run the oldest available dump that
         has not already been imported.
+
+        Units are updated before the employees, which may reference them. If
+        integrations.opus.import.workers is above 1, employees are imported
+        concurrently, and an employee failing to import does not stop the
+        import of the others.
+        :return: List of ids of the employees which failed to import.
         """
 
         for unit in tqdm(units, desc="Update units"):
             self.update_unit(unit)
 
-        for employee in tqdm(employees, desc="Update employees"):
-            last_changed_str = employee.get('@lastChanged')
-            if last_changed_str is not None:  # This is a true employee-object.
-                self.update_employee(employee)
-
-                if 'function' in employee:
-                    self.update_roller(employee)
-            else:  # This is an implicit termination.
-                if not include_terminations:
-                    continue
-
-                # This is a terminated employee, check if engagement is active
-                # terminate if it is.
-                if not employee['@action'] == 'leave':
-                    msg = 'Missing date on a non-leave object!'
-                    logger.error(msg)
-                    raise Exception(msg)
-
-                eng_info = self._find_engagement(employee['@id'], 'Engagement', present=True)
-                if eng_info:
-                    logger.info('Terminating: {}'.format(eng_info))
-                    self.terminate_detail(eng_info)
-                    manager_info = self._find_engagement(employee['@id'], 'Leder', present=True)
-                    if manager_info:
-                        self.terminate_detail(manager_info, detail_type='manager')
+        failed = []
+        if self.workers > 1:
+            failed = self._import_employees_concurrently(employees,
+                                                         include_terminations)
+        else:
+            for employee in tqdm(employees, desc="Update employees"):
+                self._import_employee(employee, include_terminations)
 
+        if failed:
+            logger.error('Failed to import employees: {}'.format(failed))
         logger.info('Program ended correctly')
+        return failed
 
 
 def start_opus_diff(ad_reader=None):
@@ -869,16 +953,25 @@ def start_opus_diff(ad_reader=None):
     if not xml_date:
         return
     filter_ids = SETTINGS.get('integrations.opus.units.filter_ids', [])
-    print("Looking for changes...")
-    units, employees = opus_helpers.file_diff(dumps[latest_date], dumps[xml_date], filter_ids)
-    print("Found changes to {} units and {} employees ".format(len(units), len(employees)))
-    opus_helpers.local_db_insert((xml_date, 'Running diff update since {}'))
-    msg = 'Start update: File: {}, update since: {}'
-    logger.info(msg.format(xml_date, latest_date))
-    print(msg.format(xml_date, latest_date))
-    diff = OpusDiffImport(xml_date, ad_reader=ad_reader,
-                                           employee_mapping=employee_mapping)
-    diff.start_import(units, employees, include_terminations=True)
+    digest_db = SETTINGS.get('integrations.opus.import.digest_db', DEFAULT_DIGEST_DB)
+    with DigestStore(digest_db) as digest_store:
+        print("Looking for changes...")
+        units, employees, digests = opus_helpers.stored_diff(
+            digest_store, dumps, latest_date, xml_date, filter_ids
+        )
+        print("Found changes to {} units and {} employees ".format(len(units), len(employees)))
+        opus_helpers.local_db_insert((xml_date, 'Running diff update since {}'))
+        msg = 'Start update: File: {}, update since: {}'
+        logger.info(msg.format(xml_date, latest_date))
+        print(msg.format(xml_date, latest_date))
+        diff = OpusDiffImport(xml_date, ad_reader=ad_reader,
+                                               employee_mapping=employee_mapping)
+        failed = diff.start_import(units, employees, include_terminations=True)
+        # Only store the digests once the changes are imported, leaving out
+        # failed employees, so they are retried with the next dump
+        for employee_id in failed:
+            digests['employee'].pop(employee_id, None)
+        digest_store.replace(xml_date, digests)
     logger.info('Ended update')
     opus_helpers.local_db_insert((xml_date, 'Diff update ended: {}'))
 
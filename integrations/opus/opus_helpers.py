@@ -6,9 +6,10 @@ import pathlib
 import pickle
 import sqlite3
 import uuid
+from collections import defaultdict
 from operator import itemgetter
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Callable, Dict, List, Tuple
 from functools import lru_cache
 import xmltodict
 from deepdiff import DeepDiff
@@ -17,6 +18,7 @@ from tqdm import tqdm
 from exporters.utils.load_settings import load_settings
 from integrations import cpr_mapper
 from integrations.opus import opus_diff_import, opus_import
+from integrations.opus.digest_store import DigestStore
 
 # from integrations.opus.opus_exceptions import NoNewerDumpAvailable
 from integrations.opus.opus_exceptions import (
@@ -28,6 +30,8 @@ from integrations.opus.opus_exceptions import (
 SETTINGS = load_settings()
 DUMP_PATH = Path(SETTINGS['integrations.opus.import.xml_path'])
 START_DATE = datetime.datetime(2019, 1, 1, 0, 0)
+# Keys which are ignored when looking for changed records
+IGNORED_KEYS = frozenset({'@lastChanged', 'numerator', 'denominator'})
 
 logger = logging.getLogger("opusHelper")
 
@@ -132,14 +136,75 @@ def generate_uuid(value):
     value_uuid = uuid.UUID(value_digest)
     return value_uuid
 
-def parser(target_file: Path, filter_ids: List[str]) -> Tuple[Dict, Dict]:
-    data = xmltodict.parse(target_file.read_text())['kmd']
-    units = data['orgUnit']
-    units = filter_units(units, filter_ids)
-    employees = data['employee']
+def read_records(target_file: Path, callback: Callable[[str, Dict], None]) -> None:
+    """Stream the records of an Opus dump to callback.
+
+    The dump is parsed incrementally, so only one record is held in memory at a
+    time, unless callback keeps it.
+
+    Args:
+        target_file: The dump to read.
+        callback: Called with the tag ('orgUnit' or 'employee') and the
+            xmltodict representation of every record.
+    """
+    def item_callback(path, item):
+        tag, _ = path[-1]
+        callback(tag, item)
+        return True
+
+    with open(str(target_file), 'rb') as f:
+        xmltodict.parse(f, item_depth=2, item_callback=item_callback)
+
+
+def parser(target_file: Path, filter_ids: List[str]) -> Tuple[List, List]:
+    records = defaultdict(list)
+    read_records(target_file, lambda tag, record: records[tag].append(record))
+    units = filter_units(records['orgUnit'], filter_ids)
+    employees = records['employee']
     return units, employees
 
 
+def record_digest(record: Dict) -> bytes:
+    """Digest of a record, ignoring the keys in IGNORED_KEYS.
+
+    Two records have the same digest exactly when they are equal apart from the
+    ignored keys, regardless of the order of the keys.
+    """
+    canonical = {
+        key: value for key, value in record.items() if key not in IGNORED_KEYS
+    }
+    return hashlib.blake2b(
+        json.dumps(canonical, sort_keys=True).encode(), digest_size=16
+    ).digest()
+
+
+def _is_changed(obj: Dict, digest: bytes, old_digests: Dict,
+                old_records: Dict) -> bool:
+    """Check whether obj, with the given digest, is new or changed.
+
+    old_digests maps '@id' to the digest of the previous version of a record,
+    old_records to the previous version itself, if it was kept.
+    """
+    # New object
+    if obj['@id'] not in old_digests:
+        return True
+
+    # Unchanged object
+    if digest == old_digests[obj['@id']]:
+        return False
+
+    # Changed object, the digests tell whether objects differ, the structural
+    # diff is only needed to tell how
+    old_obj = old_records.get(obj['@id'])
+    if old_obj is not None and logger.isEnabledFor(logging.DEBUG):
+        diff = DeepDiff(
+            old_obj, obj,
+            exclude_paths={"root['{}']".format(key) for key in IGNORED_KEYS}
+        )
+        logger.debug('Changed {}: {}'.format(obj['@id'], diff))
+    return True
+
+
 def find_changes(before: List[Dict], after: List[Dict], disable_tqdm: bool = False) -> List[Dict]:
     """Filter a list of dictionaries based on differences to another list of dictionaries
     Used to find changes to org_units and employees in opus files.
@@ -159,43 +224,154 @@ def find_changes(before: List[Dict], after: List[Dict], disable_tqdm: bool = Fal
     >>> find_changes(a, c, disable_tqdm=True)
     []
     """
-    old_ids = list(map(itemgetter('@id'), before))
-    old_map = dict(zip(old_ids, before))
-    changed_obj = []
+    old_digests = {obj['@id']: record_digest(obj) for obj in before}
+    old_records = {obj['@id']: obj for obj in before}
+
     def find_changed(obj: Dict) -> bool:
-       # New object
-       if obj['@id'] not in old_ids:
-           return True
-
-       old_obj = old_map[obj['@id']]
-       diff = DeepDiff(
-           obj, old_obj, exclude_paths={
-               "root['@lastChanged']", "root['numerator']", "root['denominator']"
-           }
-       )
-       # Changed object
-       if diff:
-           return True
-
-       # Unchanged object
-       return False
+        return _is_changed(obj, record_digest(obj), old_digests, old_records)
 
     after = tqdm(after, desc="Finding changes", disable=disable_tqdm)
     changed_obj = list(filter(find_changed, after))
 
     return changed_obj
 
+
+def index_dump(target_file: Path, keep_records: bool = False,
+               filter_ids: List[str] = ()) -> Tuple[Dict, Dict]:
+    """Stream a dump into digests of its records.
+
+    Like dump_diff, only the units passing filter_units on filter_ids are
+    indexed, so a unit excluded from the dump is seen as new once it is
+    included.
+
+    Returns: tuple of maps from tag to a map from '@id' to the digest, and to
+        the record if keep_records is set
+    """
+    digests = defaultdict(dict)
+    records = defaultdict(dict)
+    units = []
+
+    def index_record(tag, record):
+        if tag == 'orgUnit':
+            # All units are needed to filter units on their parents
+            units.append(record)
+            return
+        digests[tag][record['@id']] = record_digest(record)
+        if keep_records:
+            records[tag][record['@id']] = record
+
+    read_records(target_file, index_record)
+    for unit in filter_units(units, filter_ids):
+        digests['orgUnit'][unit['@id']] = record_digest(unit)
+        if keep_records:
+            records['orgUnit'][unit['@id']] = unit
+    return digests, records
+
+
+def dump_diff(old_digests: Dict, target_file: Path, filter_ids: List[str],
+              old_records: Dict = None,
+              disable_tqdm: bool = False) -> Tuple[List, List, Dict]:
+    """Find the units and employees in a dump changed since old_digests.
+
+    The dump is streamed, and only its units and changed employees are kept.
+
+    Args:
+        old_digests: Digests of the previous dump, as returned by index_dump
+            with the same filter_ids.
+        target_file: The dump to diff.
+        filter_ids: List of unit IDs to filter parents on.
+        old_records: Records of the previous dump, as returned by index_dump,
+            used to log how records changed.
+        disable_tqdm: Disable the progress bar.
+
+    Returns: tuple of changed units, changed employees and the digests of the
+        dump, in the form returned by index_dump, so only of the units passing
+        the filter
+    """
+    old_records = old_records or defaultdict(dict)
+    digests = defaultdict(dict)
+    units = []
+    employees = []
+    progress = tqdm(desc="Finding changes", unit=" records", disable=disable_tqdm)
+
+    def collect_record(tag, record):
+        progress.update()
+        if tag == 'orgUnit':
+            # All units are needed to filter units on their parents
+            units.append(record)
+            return
+        digest = record_digest(record)
+        digests[tag][record['@id']] = digest
+        if tag == 'employee' and _is_changed(
+            record, digest, old_digests[tag], old_records[tag]
+        ):
+            employees.append(record)
+
+    with progress:
+        read_records(target_file, collect_record)
+
+    units = filter_units(units, filter_ids)
+    digests['orgUnit'] = {unit['@id']: record_digest(unit) for unit in units}
+    units = [
+        unit for unit in units
+        if _is_changed(
+            unit, digests['orgUnit'][unit['@id']], old_digests['orgUnit'],
+            old_records['orgUnit']
+        )
+    ]
+    return units, employees, digests
+
+
 def file_diff(date1, date2, filter_ids, disable_tqdm=False):
-    units1 = employees1 = {}
-    if date1:
-        units1, employees1 = parser(date1, filter_ids)
-    units2, employees2 = parser(date2, filter_ids)
+    """Find the units and employees in dump date2 changed since dump date1.
 
-    units = find_changes(units1, units2, disable_tqdm=disable_tqdm)
-    employees = find_changes(employees1, employees2, disable_tqdm=disable_tqdm)
+    Both dumps are streamed. Of date1 only the digests of the records are kept,
+    and of date2 the units and the changed employees.
 
+    Returns: tuple of lists of changed units and changed employees
+    """
+    old_digests, old_records = defaultdict(dict), defaultdict(dict)
+    if date1:
+        # Keep the old records for logging how records changed
+        old_digests, old_records = index_dump(
+            date1, keep_records=logger.isEnabledFor(logging.DEBUG),
+            filter_ids=filter_ids
+        )
+
+    units, employees, _ = dump_diff(
+        old_digests, date2, filter_ids, old_records, disable_tqdm=disable_tqdm
+    )
     return units, employees
 
+
+def stored_diff(digest_store: DigestStore, dumps: Dict, latest_date, xml_date,
+                filter_ids: List[str]) -> Tuple[List, List, Dict]:
+    """Find the units and employees in dump xml_date changed since latest_date.
+
+    The diff is made against the digests in digest_store, so only the dump of
+    xml_date is parsed. If the store does not hold the dump of latest_date,
+    e.g. on the first run, the digests are read from that dump instead. If
+    that dump is not available either, every record of xml_date counts as
+    changed, like file_diff without a previous dump.
+    The store is not updated, as that must wait until the changes have been
+    imported, see DigestStore.replace. The returned digests hold only the units
+    passing the filter, so the store never holds digests of excluded units.
+
+    Returns: tuple of changed units, changed employees and the digests of the
+        dump of xml_date
+    """
+    if digest_store.dump_date() == latest_date:
+        old_digests = digest_store.load()
+    elif latest_date in dumps:
+        logger.info('Digest store not at {}, reading dump'.format(latest_date))
+        old_digests, _ = index_dump(dumps[latest_date], filter_ids=filter_ids)
+    else:
+        msg = 'Digest store not at {} and the dump is missing, diffing all records'
+        logger.warning(msg.format(latest_date))
+        old_digests = defaultdict(dict)
+    return dump_diff(old_digests, dumps[xml_date], filter_ids)
+
+
 def read_dump_data(dump_file):
     cache_file = pathlib.Path.cwd() / 'tmp' / (dump_file.stem + '.p')
     if not cache_file.is_file():
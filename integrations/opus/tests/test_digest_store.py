@@ -0,0 +1,72 @@
+from datetime import datetime
+from pathlib import Path
+from unittest import TestCase
+
+from integrations.opus import opus_helpers
+from integrations.opus.digest_store import DigestStore
+
+FILE1 = Path.cwd() / "integrations/opus/tests/ZLPETESTER_delta.xml"
+FILE2 = Path.cwd() / "integrations/opus/tests/ZLPETESTER2_delta.xml"
+DATE1 = datetime(2020, 10, 1, 22, 0)
+DATE2 = datetime(2020, 10, 2, 22, 0)
+
+
+class TestDigestStore(TestCase):
+    def setUp(self):
+        self.store = DigestStore(":memory:")
+        self.addCleanup(self.store.close)
+
+    def test_replace(self):
+        self.assertIsNone(self.store.dump_date())
+        self.assertEqual(self.store.load(), {})
+
+        self.store.replace(DATE1, {"employee": {"1": b"a", "2": b"b"}})
+        self.assertEqual(self.store.dump_date(), DATE1)
+        self.store.replace(DATE2, {"employee": {"1": b"c"}, "orgUnit": {"1": b"d"}})
+        self.assertEqual(self.store.dump_date(), DATE2)
+        # Records not in the latest dump are removed
+        self.assertEqual(
+            self.store.load(), {"employee": {"1": b"c"}, "orgUnit": {"1": b"d"}}
+        )
+
+    def test_stored_diff(self):
+        dumps = {DATE1: FILE1, DATE2: FILE2}
+        expected = opus_helpers.file_diff(FILE1, FILE2, [])
+
+        # The store is empty, so the previous dump is read
+        units, employees, _ = opus_helpers.stored_diff(
+            self.store, dumps, DATE1, DATE2, []
+        )
+        self.assertEqual((units, employees), expected)
+
+        # Once in sync, the previous dump is not needed
+        digests, _ = opus_helpers.index_dump(FILE1)
+        self.store.replace(DATE1, digests)
+        del dumps[DATE1]
+        units, employees, _ = opus_helpers.stored_diff(
+            self.store, dumps, DATE1, DATE2, []
+        )
+        self.assertEqual((units, employees), expected)
+
+    def test_stored_diff_without_previous_dump(self):
+        # Neither the store nor the previous dump is available, so every
+        # record counts as changed
+        units, employees, _ = opus_helpers.stored_diff(
+            self.store, {DATE2: FILE2}, DATE1, DATE2, []
+        )
+        self.assertEqual((units, employees), opus_helpers.file_diff(None, FILE2, []))
+
+    def test_stored_diff_includes_units_no_longer_filtered(self):
+        units, _ = opus_helpers.parser(FILE1, [])
+        dumps = {DATE1: FILE1}
+
+        # Unit 2 and its child were left out of the previous import
+        _, _, digests = opus_helpers.stored_diff(self.store, dumps, None, DATE1, ["2"])
+        self.store.replace(DATE1, digests)
+        self.assertEqual(list(self.store.load()["orgUnit"]), ["1"])
+
+        changed, employees, _ = opus_helpers.stored_diff(
+            self.store, dumps, DATE1, DATE1, []
+        )
+        self.assertEqual(changed, units[1:])
+        self.assertEqual(employees, [])
@@ -144,6 +144,44 @@ class Opus_diff_import_tester(unittest.TestCase):
         diff.start_import(self.units, self.employees, include_terminations=True)
         self.assertEqual(diff.terminate_detail.call_count, self.expected_terminations*2)
 
+    def concurrent_diff(self):
+        diff = OpusDiffImportTest_counts(datetime(2020, 10, 3), ad_reader=None)
+        diff.workers = 4
+        # Workers share the mocked updater
+        diff._init_worker = lambda: None
+        return diff
+
+    def test_concurrent_import(self):
+        diff = self.concurrent_diff()
+        failed = diff.start_import(
+            self.units, self.employees, include_terminations=True
+        )
+        self.assertEqual(failed, [])
+        self.assertEqual(diff.update_unit.call_count, self.expected_unit_count)
+        # Employments of the same person are imported in order
+        self.assertEqual(
+            [args[0]["@id"] for args, _ in diff.update_employee.call_args_list],
+            ["1000", "1001"],
+        )
+        self.assertEqual(
+            diff.terminate_detail.call_count, self.expected_terminations * 2
+        )
+
+    def test_concurrent_import_isolates_failures(self):
+        diff = self.concurrent_diff()
+        diff.update_employee.side_effect = ValueError
+        with self.assertLogs("opusImport", level="ERROR"):
+            failed = diff.start_import(
+                self.units, self.employees, include_terminations=True
+            )
+        # The second employment of the person is skipped, the termination of
+        # another employee is not
+        self.assertEqual(failed, ["1000", "1001"])
+        self.assertEqual(diff.update_employee.call_count, 1)
+        self.assertEqual(
+            diff.terminate_detail.call_count, self.expected_terminations * 2
+        )
+
     @patch("integrations.dawa_helper.dawa_lookup")
     @given(datetimes())
     def test_update_unit(self, dawa_helper_mock, xml_date):
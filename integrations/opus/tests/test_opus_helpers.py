@@ -45,6 +45,45 @@ class test_opus_helpers(TestCase):
         self.assertIsInstance(self.units[0], OrderedDict)
         self.assertIsInstance(self.employees[0], OrderedDict)
 
+    def test_record_digest_ignores_keys(self):
+        record = {"@id": "1", "@lastChanged": "2020-01-01", "numerator": "1", "a": "b"}
+        same = {"a": "b", "numerator": "2", "@id": "1"}
+        self.assertEqual(
+            opus_helpers.record_digest(record), opus_helpers.record_digest(same)
+        )
+        changed = dict(record, a="c")
+        self.assertNotEqual(
+            opus_helpers.record_digest(record), opus_helpers.record_digest(changed)
+        )
+
+    def test_file_diff_streams_changes(self):
+        file1 = Path.cwd() / "integrations/opus/tests/ZLPETESTER_delta.xml"
+        file2 = Path.cwd() / "integrations/opus/tests/ZLPETESTER2_delta.xml"
+        units1, employees1 = opus_helpers.parser(file1, [])
+        units2, employees2 = opus_helpers.parser(file2, [])
+
+        units, employees = opus_helpers.file_diff(file1, file2, [])
+        self.assertEqual(units, opus_helpers.find_changes(units1, units2))
+        self.assertEqual(employees, opus_helpers.find_changes(employees1, employees2))
+
+        # Without a previous dump, everything is new
+        units, employees = opus_helpers.file_diff(None, file2, [])
+        self.assertEqual(units, units2)
+        self.assertEqual(employees, employees2)
+
+    def test_dump_diff_includes_units_no_longer_filtered(self):
+        file = Path.cwd() / "integrations/opus/tests/ZLPETESTER_delta.xml"
+        units, _ = opus_helpers.parser(file, [])
+
+        # Unit 2 and its child were left out of the previous import
+        old_digests, _ = opus_helpers.index_dump(file, filter_ids=["2"])
+        self.assertEqual(list(old_digests["orgUnit"]), ["1"])
+
+        changed, employees, digests = opus_helpers.dump_diff(old_digests, file, [])
+        self.assertEqual(changed, units[1:])
+        self.assertEqual(employees, [])
+        self.assertEqual(list(digests["orgUnit"]), ["1", "2", "3"])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,10 +1,16 @@
 import json
+import threading
+from collections import defaultdict
+
 from requests import Session
 
+# Number of objects read per request, when the index of a resource is loaded
+INDEX_PAGE_SIZE = 1000
+
 
 class IntegrationAbstraction(object):
 
-    def __init__(self, mox_base, system_name, end_marker='STOP'):
+    def __init__(self, mox_base, system_name, end_marker='STOP', index=False):
         if not mox_base[-1] == '/':
             mox_base = mox_base + '/'
         self.mox_base = mox_base
@@ -12,6 +18,19 @@ class IntegrationAbstraction(object):
         self.end_marker = end_marker
         self.session = Session()
 
+        # In index mode the integration data of a resource is read in a single
+        # sweep the first time the resource is searched, and find_object is
+        # answered from memory. Objects written by other programs after the
+        # sweep are not seen, so the index must only be used while the caller
+        # is the only writer.
+        self.index = index
+        # resource -> {(system_name, value): set of uuids}
+        self._references = {}
+        # resource -> {uuid: raw integration data string}
+        self._integration_data = {}
+        # The index may be shared by several threads of an import
+        self._index_lock = threading.RLock()
+
     def _get_complete_object(self, resource, uuid):
         """ Return a complete LoRa object """
         response = self.session.get(url=self.mox_base + resource + '/' + uuid)
@@ -25,6 +44,15 @@ class IntegrationAbstraction(object):
         attributes = mox_object[uuid][0]['registreringer'][0]['attributter']
         return attributes
 
+    @staticmethod
+    def _integration_data_of(attributes):
+        """ Return the raw integration data string of LoRa attributes """
+        data = None
+        for key in attributes.keys():
+            if key.find('egenskaber') > 0:
+                data = attributes[key][0].get('integrationsdata', None)
+        return data
+
     def _get_integration_data(self, resource, uuid):
         """
         Return the the raw integration data string, no interpretation
@@ -35,10 +63,11 @@ class IntegrationAbstraction(object):
         uuid of the object to be returned.
         :return: Raw integration data string.
         """
+        with self._index_lock:
+            if self.index and uuid in self._integration_data.get(resource, {}):
+                return self._integration_data[resource][uuid]
         attributes = self._get_attributes(resource, uuid)
-        for key in attributes.keys():
-            if key.find('egenskaber') > 0:
-                data = attributes[key][0].get('integrationsdata', None)
+        data = self._integration_data_of(attributes)
         if data is not None:
             try:
                 json.loads(data)
@@ -72,6 +101,7 @@ class IntegrationAbstraction(object):
         response = self.session.patch(url=self.mox_base + resource +
                                       '/' + uuid, json=properties)
         response.raise_for_status()
+        self.index_object(resource, uuid, data)
         return response.json()
 
     def read_integration_data(self, resource, uuid):
@@ -139,11 +169,92 @@ class IntegrationAbstraction(object):
         self._set_integration_data(resource, uuid, integration_data_string)
         return True
 
+    @staticmethod
+    def _index_keys(integration_data):
+        """ Return the (system_name, value) pairs of raw integration data """
+        if not integration_data:
+            return []
+        structured_data = json.loads(integration_data)
+        return [(system_name, value)
+                for system_name, value in structured_data.items()
+                if isinstance(value, str)]
+
+    def index_object(self, resource, uuid, integration_data):
+        """
+        Update the index of a resource with the integration data of an object.
+        Does nothing unless the index of the resource is loaded.
+        :param  resource:
+        Path of the service endpoint (str) e.g. /organisation/organisation
+        :param uuid: uuid of the object.
+        :param integration_data: The integration data of the object, either as
+        the raw string or as a dict.
+        """
+        if integration_data is not None and not isinstance(integration_data, str):
+            integration_data = json.dumps(integration_data)
+
+        with self._index_lock:
+            if resource not in self._references:
+                return
+            references = self._references[resource]
+            previous = self._integration_data[resource].get(uuid)
+            for key in self._index_keys(previous):
+                references[key].discard(uuid)
+            self._integration_data[resource][uuid] = integration_data
+            for key in self._index_keys(integration_data):
+                references[key].add(uuid)
+
+    def load_index(self, resource):
+        """
+        Read the integration data of all objects of a resource, which has
+        integration data for the current system, into the index.
+        :param  resource:
+        Path of the service endpoint (str) e.g. /organisation/organisation
+        """
+        with self._index_lock:
+            self._references[resource] = defaultdict(set)
+            self._integration_data[resource] = {}
+
+            system_string = json.dumps(self.system_name).replace('\\', '\\\\')
+            params = {
+                'integrationsdata': '%{}%'.format(system_string),
+                'list': 1,
+                'maximalantalresultater': INDEX_PAGE_SIZE,
+                'foersteresultat': 0
+            }
+            url = self.mox_base + resource
+            while True:
+                response = self.session.get(url=url, params=params)
+                response.raise_for_status()
+                results = response.json()['results']
+                objects = results[0] if results else []
+                for mox_object in objects:
+                    # How to handle multiple 'registreringer'?
+                    attributes = mox_object['registreringer'][0]['attributter']
+                    self.index_object(resource, mox_object['id'],
+                                      self._integration_data_of(attributes))
+                if len(objects) < INDEX_PAGE_SIZE:
+                    break
+                params['foersteresultat'] += INDEX_PAGE_SIZE
+
+    def _find_indexed_object(self, resource, key_string):
+        with self._index_lock:
+            if resource not in self._references:
+                self.load_index(resource)
+            return list(self._references[resource].get(
+                (self.system_name, key_string), ()
+            ))
+
     def find_object(self, resource, key):
         url = self.mox_base + resource + '?integrationsdata=%25{}%25'
 
         # key_string = repr(key[1:-1]) + self.end_marker
         key_string = json.dumps(key) + self.end_marker
+        if self.index:
+            results = self._find_indexed_object(resource, key_string)
+            if len(results) > 1:
+                raise Exception('Inconsistent integration data!')
+            return results[0] if results else None
+
         search_val = json.dumps({self.system_name: key_string})
         search_val = search_val[1:-1]  # Remove { and }
         search_string = search_val.replace('\\', '\\\\')
@@ -39,6 +39,8 @@ class CachingImportUtility(ImportUtility):
         demand_consistent_uuids,
         store_integration_data=False,
         dry_run=False,
+        bulk=False,
+        index_integration_data=False,
     ):
         # Global validity
         self.date_from = "1930-01-01"
@@ -52,6 +54,8 @@ class CachingImportUtility(ImportUtility):
             demand_consistent_uuids,
             store_integration_data,
             dry_run,
+            bulk,
+            index_integration_data,
         )
 
     def _get_from_mox(self, resource, params):
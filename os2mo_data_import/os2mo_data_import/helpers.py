@@ -5,11 +5,19 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 #
+import json
 import logging
+import math
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from os2mo_helpers.mora_helpers import MoraHelper
-from integration_abstraction.integration_abstraction import IntegrationAbstraction
 
+from integration_abstraction import integration_abstraction
+from os2mo_data_import import utilities
 from os2mo_data_import.utilities import ImportUtility
+from os2mo_data_import.lora_details import DETAIL_TYPES
+from os2mo_data_import.request_stats import mean_latencies, resource_key
 from os2mo_data_import.defaults import facet_defaults
 from os2mo_data_import.mora_data_types import (
     mora_type_config,
@@ -97,6 +105,22 @@ class ImportHelper(object):
 
         :py:data:`os2mo_data_import.defaults`
 
+    :param bool bulk: Read existing employee details from LoRa, and create
+        details in batches (see ImportUtility)
+
+    :param bool index_integration_data: Find existing objects from an index of
+        the integration data, read once for each resource, rather than with a
+        search for each object. Only relevant with store_integration_data, and
+        only safe when no other program writes to LoRa during the import.
+
+    :param int concurrent_imports: Number of organisation units, and later
+        employees, to import concurrently. The units are imported level by
+        level, so a unit is only imported after its parent.
+
+    :param str request_stats_file: Path of a json file, the summary of the
+        requests made by import_all is written to. A summary written by a
+        previous run is used to project the runtime of a dry run.
+
     :param class ImportUtility: Default import class
 
     .. note::
@@ -109,12 +133,12 @@ class ImportHelper(object):
                  mox_base="http://localhost:8080", mora_base="http://localhost:5000",
                  store_integration_data=False, create_defaults=True,
                  seperate_names=False, demand_consistent_uuids=True,
-                 ImportUtility=ImportUtility):
+                 bulk=False, index_integration_data=True, concurrent_imports=1,
+                 request_stats_file=None, ImportUtility=ImportUtility):
 
         self.seperate_names = seperate_names
-        mora_type_config(mox_base=mox_base,
-                         system_name=system_name,
-                         end_marker=end_marker)
+        self.concurrent_imports = concurrent_imports
+        self.request_stats_file = request_stats_file
         self.mox_base = mox_base
         # Import Utility
         self.store = ImportUtility(
@@ -123,13 +147,18 @@ class ImportHelper(object):
             system_name=system_name,
             end_marker=end_marker,
             demand_consistent_uuids=demand_consistent_uuids,
-            store_integration_data=store_integration_data
+            store_integration_data=store_integration_data,
+            bulk=bulk,
+            index_integration_data=index_integration_data
         )
-        # TODO: store_integration_data could be passed to ImportUtility by passing
-        # the actual self.ia object
         if store_integration_data:
             self.morah = MoraHelper(use_cache=False)
-            self.ia = IntegrationAbstraction(mox_base, system_name, end_marker)
+            # Share the index of the integration data with the import utility
+            self.ia = self.store.ia
+        mora_type_config(mox_base=mox_base,
+                         system_name=system_name,
+                         end_marker=end_marker,
+                         integration_abstraction=getattr(self, 'ia', None))
 
         self.organisation = None
         self.klassifikation = None
@@ -663,19 +692,196 @@ class ImportHelper(object):
                 if self.test_org_unit_refs(identifier, org_unit):
                     re_run = True
 
-        for identifier, org_unit in self.organisation_units.items():
-            self.import_organisation_units_recursively(identifier, org_unit)
+        for level in self._org_unit_levels():
+            self._run_concurrently(self._import_org_unit, level)
+
+    def _org_unit_levels(self):
+        """
+        Group the organisation units by their depth in the tree.
+        All units of a level can be imported, once the levels above it are.
+        :return: List of the levels, from the root, each a list of references.
+        """
+        depths = {}
+        for reference in self.organisation_units:
+            # Walk up to the first unit with a known depth
+            path = []
+            unit_ref = reference
+            while unit_ref not in depths:
+                parent_ref = self.organisation_units[unit_ref].parent_ref
+                if parent_ref not in self.organisation_units:
+                    # A root, or a unit below an already imported unit
+                    depths[unit_ref] = 0
+                    break
+                path.append(unit_ref)
+                unit_ref = parent_ref
+            depth = depths[unit_ref]
+            for unit_ref in reversed(path):
+                depth += 1
+                depths[unit_ref] = depth
+
+        levels = [[] for _ in range(max(depths.values(), default=-1) + 1)]
+        for reference, depth in depths.items():
+            levels[depth].append(reference)
+        return levels
+
+    def _run_concurrently(self, function, arguments):
+        """
+        Call function with each of the arguments, up to concurrent_imports at a
+        time, and wait for all of the calls to finish.
+        """
+        if self.concurrent_imports <= 1:
+            for argument in arguments:
+                function(argument)
+            return
+        with ThreadPoolExecutor(max_workers=self.concurrent_imports) as executor:
+            # Reading the results raises the exception of a failed call
+            list(executor.map(function, arguments))
+
+    def _import_org_unit(self, reference):
+        self.store.import_org_unit(
+            reference=reference,
+            organisation_unit=self.organisation_units[reference],
+            details=self.organisation_unit_details.get(reference)
+        )
+
+    def _import_employee(self, reference):
+        self.store.import_employee(
+            reference=reference,
+            employee=self.employees[reference],
+            details=self.employee_details.get(reference)
+        )
 
     def _import_employees(self):
+        self._run_concurrently(self._import_employee, list(self.employees))
+        self.store.flush_details()
+
+    def _integration_data_searches(self, requests, resource, count):
+        """ Add the searches of integration data made for count objects """
+        if not self.store.store_integration_data or not count:
+            return
+        key = resource_key('GET', self.mox_base, resource)
+        if self.store.ia.index:
+            # The index is read in pages, once for each resource
+            page_size = integration_abstraction.INDEX_PAGE_SIZE
+            requests[key] += math.ceil((count + 1) / page_size)
+        else:
+            requests[key] += count
+
+    def estimate_requests(self, latencies=None):
+        """
+        Project the requests import_all will make for the objects currently
+        held in the helper, assuming none of the objects exist in MO. Requests
+        which depend on the existing data, such as the terminations of changed
+        details on re-import, are not included.
+
+        :param dict latencies: Mean seconds for each request key, see
+            :func:`os2mo_data_import.request_stats.mean_latencies`.
+        :return: dict with the projected number of requests for each request
+            key, their total, and the projected runtime in seconds, which is
+            None without latencies.
+        """
+        store = self.store
+        mox_base = self.mox_base
+        mora_base = store.mora_base
+        # Units and employees are imported concurrently, see _run_concurrently
+        sequential = Counter()
+        concurrent = Counter()
+
+        def mora_key(method, resource):
+            return resource_key(method, mora_base, resource)
+
+        mox_objects = [
+            ('organisation/organisation', [self.organisation]),
+            ('klassifikation/klassifikation', [self.klassifikation]),
+            ('klassifikation/facet', self.facet_objects.items()),
+            ('klassifikation/klasse', self.klasse_objects.items()),
+            ('organisation/itsystem', self.itsystems.items()),
+        ]
+        for resource, objects in mox_objects:
+            objects = [mox_object for mox_object in objects if mox_object]
+            self._integration_data_searches(sequential, resource, len(objects))
+            for _, mox_object in objects:
+                method = 'PUT' if getattr(mox_object, 'uuid', None) else 'POST'
+                sequential[resource_key(method, mox_base, resource)] += 1
+
+        units = len(self.organisation_units)
+        self._integration_data_searches(
+            concurrent, 'organisation/organisationenhed', units
+        )
+        for _ in self.organisation_units:
+            concurrent[mora_key('POST', 'service/ou/create')] += 1
+            concurrent[mora_key('GET', 'service/ou/{uuid}/details/address')] += 3
+            concurrent[mora_key('POST', 'service/details/create')] += 1
+
+        self._integration_data_searches(
+            concurrent, 'organisation/bruger', len(self.employees)
+        )
+        bulk_details = 0
         for identifier, employee in self.employees.items():
-            details = self.employee_details.get(identifier)
-            self.store.import_employee(
-                reference=identifier,
-                employee=employee,
-                details=details
-            )
+            concurrent[mora_key('POST', 'service/e/create')] += 1
+            details = self.employee_details.get(identifier) or []
+
+            terminations = [
+                detail for detail in details
+                if isinstance(detail, (TerminationType, EngagementTerminationType))
+            ]
+            if terminations:
+                # The employee is terminated, and no details are created
+                if isinstance(terminations[0], TerminationType):
+                    resource = 'service/e/{uuid}/terminate'
+                else:
+                    resource = 'service/details/terminate'
+                concurrent[mora_key('POST', resource)] += 1
+            elif store.bulk:
+                bulk_details += len(details)
+            elif details:
+                concurrent[mora_key('POST', 'service/details/create')] += 1
+
+            if not store.bulk:
+                for detail_type in DETAIL_TYPES.values():
+                    resource = 'service/e/{{uuid}}/details/{}'.format(detail_type)
+                    concurrent[mora_key('GET', resource)] += 3
+            elif employee.uuid:
+                resource = 'organisation/organisationfunktion'
+                concurrent[resource_key('GET', mox_base, resource)] += 1
+        if bulk_details:
+            batches = math.ceil(bulk_details / utilities.DETAIL_BATCH_SIZE)
+            sequential[mora_key('POST', 'service/details/create')] += batches
+
+        seconds = None
+        if latencies:
+            default = sum(latencies.values()) / len(latencies)
+
+            def runtime(counts):
+                return sum(count * latencies.get(key, default)
+                           for key, count in counts.items())
+
+            seconds = (runtime(sequential) +
+                       runtime(concurrent) / max(1, self.concurrent_imports))
+
+        requests = sequential + concurrent
+        return {
+            'requests': sum(requests.values()),
+            'seconds': seconds,
+            'resources': dict(requests),
+        }
+
+    def _previous_latencies(self):
+        """ Mean latencies of the run which wrote request_stats_file """
+        if not (self.request_stats_file and
+                os.path.isfile(self.request_stats_file)):
+            return None
+        with open(self.request_stats_file) as f:
+            return mean_latencies(json.load(f))
+
+    def _write_request_stats(self):
+        summary = self.store.request_stats.to_json()
+        logger.info('Requests made by the import: {}'.format(summary))
+        if self.request_stats_file:
+            with open(self.request_stats_file, 'w') as f:
+                f.write(summary)
 
-    def import_all(self):
+    def import_all(self, dry_run=False):
         """
         The import method begins importing all objects
         obtained from the maps in the following order:
@@ -687,7 +893,19 @@ class ImportHelper(object):
 
             #. OrganisationUnit objects
             #. Employees objects
+
+        The requests made are summarised as json in the log, and in
+        request_stats_file if given.
+
+        :param bool dry_run: Do not import anything, but return the requests
+            projected by estimate_requests.
         """
+        if dry_run:
+            estimate = self.estimate_requests(self._previous_latencies())
+            logger.info('Projected requests: {}'.format(
+                json.dumps(estimate, indent=2, sort_keys=True)
+            ))
+            return estimate
 
         # Insert Organisation
         logger.info('Will now import organisation')
@@ -716,3 +934,5 @@ class ImportHelper(object):
         # Insert Employees
         logger.info('Will now import employees')
         self._import_employees()
+
+        self._write_request_stats()
@@ -0,0 +1,177 @@
+#
+# Copyright (c) Magenta ApS
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+"""
+Read the details of an employee from the organisationfunktion objects in LoRa.
+
+MO reads each detail type of an employee with a separate request per validity,
+the functions of an employee can instead be read from LoRa in a single search.
+The functions are converted to the subset of the MO detail format which is used
+by ImportUtility._payload_compare.
+"""
+from datetime import datetime, timedelta, timezone
+from urllib.parse import unquote
+
+from dateutil import tz
+from dateutil.parser import isoparse
+
+DEFAULT_TIMEZONE = tz.gettz('Europe/Copenhagen')
+
+# The detail types of an employee, and the LoRa function names they are
+# stored with
+DETAIL_TYPES = {
+    'IT-system': 'it',
+    'Rolle': 'role',
+    'Orlov': 'leave',
+    'Adresse': 'address',
+    'Leder': 'manager',
+    'Engagement': 'engagement',
+    'Tilknytning': 'association',
+}
+
+# Prefixes of the address urns, DAR addresses are stored as the uuid
+ADDRESS_PREFIXES = {
+    'EMAIL': 'urn:mailto:',
+    'WWW': 'urn:magenta.dk:www:',
+    'PHONE': 'urn:magenta.dk:telefon:',
+    'PNUMBER': 'urn:dk:cvr:produktionsenhed:',
+    'EAN': 'urn:magenta.dk:ean:',
+    'TEXT': 'urn:text:',
+    'DAR': 'urn:dar:',
+}
+
+# The parts of a registration which makes up the validities of a detail
+RELEVANT = {
+    'attributter': ('organisationfunktionegenskaber',
+                    'organisationfunktionudvidelser'),
+    'relationer': ('tilknyttedeenheder', 'organisatoriskfunktionstype',
+                   'opgaver', 'tilknyttedeitsystemer', 'adresser'),
+    'tilstande': ('organisationfunktiongyldighed',),
+}
+
+
+def _parse_timestamp(timestamp):
+    if timestamp == 'infinity':
+        return datetime.max.replace(tzinfo=timezone.utc)
+    if timestamp == '-infinity':
+        return datetime.min.replace(tzinfo=timezone.utc)
+    return isoparse(timestamp)
+
+
+def _effects(registration):
+    """
+    Split a registration into the periods in which none of the relevant values
+    change.
+    :param registration: A LoRa registration.
+    :return: Iterator of (from, to, values) where values maps the relevant keys
+    to the entries in effect in the period.
+    """
+    entries = [
+        (key, entry)
+        for group, keys in RELEVANT.items()
+        for key in keys
+        for entry in registration.get(group, {}).get(key, [])
+    ]
+    entries = [
+        (key, entry, _parse_timestamp(entry['virkning']['from']),
+         _parse_timestamp(entry['virkning']['to']))
+        for key, entry in entries
+    ]
+    timestamps = sorted({ts for _, _, start, end in entries for ts in (start, end)})
+
+    for start, end in zip(timestamps, timestamps[1:]):
+        values = {}
+        for key, entry, entry_start, entry_end in entries:
+            if entry_start < end and entry_end > start:
+                values.setdefault(key, []).append(entry)
+        if values:
+            yield start, end, values
+
+
+def _validity(start, end):
+    """Convert a LoRa period to a MO validity, where 'to' is inclusive."""
+    validity = {'from': None, 'to': None}
+    if start.year > datetime.min.year:
+        validity['from'] = start.astimezone(DEFAULT_TIMEZONE).date().isoformat()
+    if end.year < datetime.max.year:
+        to_date = end.astimezone(DEFAULT_TIMEZONE).date() - timedelta(days=1)
+        validity['to'] = to_date.isoformat()
+    return validity
+
+
+def _uuid(values, key, objekttype=None):
+    for entry in values.get(key, []):
+        if objekttype is None or entry.get('objekttype') == objekttype:
+            return {'uuid': entry['uuid']}
+    return None
+
+
+def _address_value(values):
+    address = values['adresser'][0]
+    if 'uuid' in address:
+        return address['uuid']
+    address_type = address.get('objekttype')
+    value = address['urn'][len(ADDRESS_PREFIXES.get(address_type, '')):]
+    if address_type == 'TEXT':
+        value = unquote(value)
+    return value
+
+
+def _detail(detail_type, values, validity):
+    detail = {'validity': validity}
+    if 'tilknyttedeenheder' in values:
+        detail['org_unit'] = _uuid(values, 'tilknyttedeenheder')
+
+    if detail_type == 'engagement':
+        properties = values['organisationfunktionegenskaber'][0]
+        extensions = values.get('organisationfunktionudvidelser', [{}])[0]
+        detail['user_key'] = properties.get('brugervendtnoegle')
+        detail['fraction'] = extensions.get('fraktion')
+        detail['job_function'] = _uuid(values, 'opgaver')
+    elif detail_type == 'role':
+        detail['role_type'] = _uuid(values, 'organisatoriskfunktionstype')
+    elif detail_type == 'association':
+        detail['association_type'] = _uuid(values, 'organisatoriskfunktionstype')
+    elif detail_type == 'it':
+        detail['itsystem'] = _uuid(values, 'tilknyttedeitsystemer')
+    elif detail_type == 'address':
+        detail['value'] = _address_value(values)
+    elif detail_type == 'manager':
+        detail['manager_level'] = _uuid(values, 'opgaver', 'lederniveau')
+        detail['responsibility'] = [
+            {'uuid': entry['uuid']}
+            for entry in values.get('opgaver', [])
+            if entry.get('objekttype') == 'lederansvar'
+        ]
+    return detail
+
+
+def employee_details(functions):
+    """
+    Convert the organisationfunktion objects of an employee to MO details.
+    :param functions: The functions of the employee, as returned by a LoRa
+    search with list=1.
+    :return: Dict from detail type to a list of details, one for each validity,
+    like the details read from MO with validity past, present and future.
+    """
+    details = {detail_type: [] for detail_type in DETAIL_TYPES.values()}
+    for function in functions:
+        for registration in function['registreringer']:
+            for start, end, values in _effects(registration):
+                validities = values.get('organisationfunktiongyldighed', [])
+                if not any(v['gyldighed'] == 'Aktiv' for v in validities):
+                    continue
+                properties = values.get('organisationfunktionegenskaber')
+                if not properties:
+                    continue
+                detail_type = DETAIL_TYPES.get(properties[0]['funktionsnavn'])
+                if detail_type is None:
+                    continue
+                details[detail_type].append(
+                    _detail(detail_type, values, _validity(start, end))
+                )
+    return details
@@ -13,10 +13,13 @@ logger = logging.getLogger("moImporterMoraTypes")
 
 
 # TODO: This should be in some sort of global config
-def mora_type_config(mox_base, system_name, end_marker):
+def mora_type_config(mox_base, system_name, end_marker,
+                     integration_abstraction=None):
     MoType.mox_base = mox_base
     MoType.system_name = system_name
     MoType.end_marker = end_marker
+    # Share the IntegrationAbstraction, and thereby its index, with the importer
+    MoType.integration_abstraction = integration_abstraction
 
 
 class MoType():
@@ -49,10 +52,14 @@ class MoType():
     :param str date_to: End date e.g. "1982-01-01"
     """
 
+    integration_abstraction = None
+
     def __init__(self):
-        self.ia = IntegrationAbstraction(self.mox_base,
-                                         self.system_name,
-                                         self.end_marker)
+        self.ia = self.integration_abstraction
+        if self.ia is None:
+            self.ia = IntegrationAbstraction(self.mox_base,
+                                             self.system_name,
+                                             self.end_marker)
 
         self.type_id = None
 
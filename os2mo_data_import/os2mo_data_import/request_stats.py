@@ -0,0 +1,135 @@
+#
+# Copyright (c) Magenta ApS
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+"""
+Accounting of the requests made to MO and LoRa during an import.
+
+Requests are grouped by method and path, with uuids in the path replaced by
+{uuid}, eg. 'GET /service/e/{uuid}/details/engagement'. The summary is plain
+json, so summaries of different runs can be compared, and the mean latencies
+of a run can be used to project the runtime of the next.
+"""
+import json
+import re
+import threading
+from urllib.parse import urljoin, urlsplit
+
+# Upper bounds, in seconds, of the buckets of the latency histograms
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+UUID_PATTERN = re.compile(
+    '[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}', re.IGNORECASE
+)
+
+
+def request_key(method, url):
+    """
+    Return the key a request is accounted under.
+    :param method: HTTP method of the request.
+    :param url: Url of the request, the query is ignored.
+    :return: Method and path of the request, with uuids replaced by {uuid}.
+    """
+    path = UUID_PATTERN.sub('{uuid}', urlsplit(url).path)
+    return '{} {}'.format(method, path)
+
+
+def resource_key(method, base, resource):
+    """
+    Return the key of a request to a resource below a base url.
+    :param method: HTTP method of the request.
+    :param base: Base url, eg. mora_base.
+    :param resource: The resource, eg. 'service/e/create'.
+    """
+    return request_key(method, urljoin(base, resource))
+
+
+def _bucket_labels():
+    labels = ['<={}'.format(bucket) for bucket in LATENCY_BUCKETS]
+    labels.append('>{}'.format(LATENCY_BUCKETS[-1]))
+    return labels
+
+
+class RequestStats(object):
+    """
+    Count the requests made by one or more requests sessions, and record the
+    latency of the requests. Safe to use from several threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key -> [count, total seconds, max seconds, histogram]
+        self._stats = {}
+
+    def instrument(self, session):
+        """
+        Record every request made by a requests session.
+        :param session: The session to instrument.
+        """
+        session.hooks['response'].append(self._record_response)
+
+    def _record_response(self, response, *args, **kwargs):
+        self.record(response.request.method, response.url,
+                    response.elapsed.total_seconds())
+
+    def record(self, method, url, seconds):
+        """
+        Record a single request.
+        :param method: HTTP method of the request.
+        :param url: Url of the request.
+        :param seconds: Latency of the request.
+        """
+        key = request_key(method, url)
+        bucket = len(LATENCY_BUCKETS)
+        for number, upper_bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= upper_bound:
+                bucket = number
+                break
+
+        with self._lock:
+            if key not in self._stats:
+                self._stats[key] = [0, 0.0, 0.0, [0] * (len(LATENCY_BUCKETS) + 1)]
+            stats = self._stats[key]
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+            stats[3][bucket] += 1
+
+    def summary(self):
+        """
+        Summarise the recorded requests.
+        :return: dict with the total number of requests and seconds, and for
+        each key the count, total, mean and max seconds and latency histogram.
+        """
+        labels = _bucket_labels()
+        requests = {}
+        with self._lock:
+            for key, (count, seconds, max_seconds, histogram) in self._stats.items():
+                requests[key] = {
+                    'count': count,
+                    'seconds': seconds,
+                    'mean': seconds / count,
+                    'max': max_seconds,
+                    'histogram': dict(zip(labels, histogram)),
+                }
+        return {
+            'requests': sum(stats['count'] for stats in requests.values()),
+            'seconds': sum(stats['seconds'] for stats in requests.values()),
+            'resources': requests,
+        }
+
+    def to_json(self):
+        """ Return the summary as json """
+        return json.dumps(self.summary(), indent=2, sort_keys=True)
+
+
+def mean_latencies(summary):
+    """
+    Read the mean latencies from a summary, eg. of a previous run.
+    :param summary: dict as returned by RequestStats.summary.
+    :return: dict from request key to mean seconds.
+    """
+    return {key: stats['mean'] for key, stats in summary['resources'].items()}
@@ -7,6 +7,7 @@
 #
 
 import logging
+import threading
 from uuid import uuid4, UUID
 from urllib.parse import urljoin
 from requests import Session, HTTPError
@@ -14,6 +15,9 @@ from datetime import datetime, timedelta
 
 from integration_abstraction.integration_abstraction import IntegrationAbstraction
 
+from os2mo_data_import.lora_details import DETAIL_TYPES, employee_details
+from os2mo_data_import.request_stats import RequestStats
+
 from os2mo_data_import.mora_data_types import (
     OrganisationUnitType,
     TerminationType,
@@ -34,6 +38,9 @@ SAML_TOKEN = os.environ.get('SAML_TOKEN', None)
 
 logger = logging.getLogger("moImporterUtilities")
 
+# Number of detail payloads in each details/create request in bulk mode
+DETAIL_BATCH_SIZE = 100
+
 
 class ImportUtility(object):
     """
@@ -45,13 +52,16 @@ class ImportUtility(object):
 
     def __init__(self, system_name, end_marker, mox_base, mora_base,
                  demand_consistent_uuids, store_integration_data=False,
-                 dry_run=False):
+                 dry_run=False, bulk=False, index_integration_data=False):
 
         # Import Params
         self.demand_consistent_uuids = demand_consistent_uuids
         self.store_integration_data = store_integration_data
         if store_integration_data:
-            self.ia = IntegrationAbstraction(mox_base, system_name, end_marker)
+            # With index_integration_data, objects are found from an index of
+            # the integration data, which is read once for each resource
+            self.ia = IntegrationAbstraction(mox_base, system_name, end_marker,
+                                             index=index_integration_data)
 
         # Service endpoint base
         self.mox_base = mox_base
@@ -60,6 +70,12 @@ class ImportUtility(object):
         # Session
         self.session = Session()
 
+        # Accounting of the requests to MO and LoRa
+        self.request_stats = RequestStats()
+        self.request_stats.instrument(self.session)
+        if store_integration_data:
+            self.request_stats.instrument(self.ia.session)
+
         # Placeholder for UUID import
         self.organisation_uuid = None
 
@@ -78,6 +94,13 @@ class ImportUtility(object):
         # Deprecated
         self.dry_run = dry_run
 
+        # In bulk mode the existing details of an employee are read from LoRa
+        # in a single search, and the new details are created in batches.
+        # flush_details must be called after the last employee is imported.
+        self.bulk = bulk
+        self.pending_details = []
+        self._details_lock = threading.Lock()
+
     def import_organisation(self, reference, organisation):
         """
         Convert organisation to OIO formatted post data
@@ -115,6 +138,7 @@ class ImportUtility(object):
             data=payload,
             uuid=organisation_uuid
         )
+        self._index_object(resource, self.organisation_uuid, integration_data)
 
         # Global validity
         self.date_from = organisation.date_from
@@ -155,6 +179,7 @@ class ImportUtility(object):
             data=payload,
             uuid=klassifikation_uuid
         )
+        self._index_object(resource, self.klassifikation_uuid, integration_data)
 
         return self.klassifikation_uuid
 
@@ -197,6 +222,8 @@ class ImportUtility(object):
             data=payload,
             uuid=facet_uuid
         )
+        self._index_object(resource, self.inserted_facet_map[reference],
+                           integration_data)
 
         return self.inserted_facet_map[reference]
 
@@ -260,6 +287,7 @@ class ImportUtility(object):
         )
         assert(uuid is None or import_uuid == str(klasse_uuid))
         self.inserted_klasse_map[reference] = import_uuid
+        self._index_object(resource, import_uuid, integration_data)
 
         return self.inserted_klasse_map[reference]
 
@@ -302,6 +330,8 @@ class ImportUtility(object):
             data=payload,
             uuid=itsystem_uuid
         )
+        self._index_object(resource, self.inserted_itsystem_map[reference],
+                           integration_data)
 
         return self.inserted_itsystem_map[reference]
 
@@ -360,6 +390,9 @@ class ImportUtility(object):
             payload=payload,
             encode_integration=False
         )
+        integration_data = {
+            'integration_data': payload.get('integration_data')
+        }
 
         if 'uuid' in payload:
             if payload['uuid'] in self.existing_uuids:
@@ -395,6 +428,7 @@ class ImportUtility(object):
 
         # Add to the inserted map
         self.inserted_org_unit_map[reference] = uuid
+        self._index_object('organisation/organisationenhed', uuid, integration_data)
 
         data = {}
         data['address'] = self._get_detail(uuid, 'address', object_type='ou')
@@ -485,15 +519,22 @@ class ImportUtility(object):
 
         # Add uuid to the inserted employee map
         self.inserted_employee_map[reference] = uuid
-
-        data = {}
-        data['it'] = self._get_detail(uuid, 'it')
-        data['role'] = self._get_detail(uuid, 'role')
-        data['leave'] = self._get_detail(uuid, 'leave')
-        data['address'] = self._get_detail(uuid, 'address')
-        data['manager'] = self._get_detail(uuid, 'manager')
-        data['engagement'] = self._get_detail(uuid, 'engagement')
-        data['association'] = self._get_detail(uuid, 'association')
+        self._index_object(mox_resource, uuid, integration_data)
+
+        if not self.bulk:
+            data = {}
+            data['it'] = self._get_detail(uuid, 'it')
+            data['role'] = self._get_detail(uuid, 'role')
+            data['leave'] = self._get_detail(uuid, 'leave')
+            data['address'] = self._get_detail(uuid, 'address')
+            data['manager'] = self._get_detail(uuid, 'manager')
+            data['engagement'] = self._get_detail(uuid, 'engagement')
+            data['association'] = self._get_detail(uuid, 'association')
+        elif 'uuid' in integration_data:
+            data = self._get_lora_details(uuid)
+        else:
+            # MO created the employee with a new uuid, so it has no details
+            data = {detail_type: [] for detail_type in DETAIL_TYPES.values()}
 
         # In case of en explicit termination, we terminate the employee or
         # employment and return imidiately.
@@ -565,13 +606,44 @@ class ImportUtility(object):
                 self._terminate_employee(uuid)
 
             if re_import in ('YES', 'NEW', 'UPDATE'):
-                self.insert_mora_data(
-                    resource="service/details/create",
-                    data=additional_payload
-                )
+                if self.bulk:
+                    self._create_details(additional_payload)
+                else:
+                    self.insert_mora_data(
+                        resource="service/details/create",
+                        data=additional_payload
+                    )
 
         return uuid
 
+    def _create_details(self, detail_payloads):
+        """
+        Queue detail payloads to be created in MO, and create the queued details
+        once a batch is full.
+        :param detail_payloads: List of detail payloads.
+        """
+        with self._details_lock:
+            self.pending_details.extend(detail_payloads)
+            batch_full = len(self.pending_details) >= DETAIL_BATCH_SIZE
+        if batch_full:
+            self.flush_details()
+
+    def flush_details(self):
+        """
+        Create the details queued by import_employee in bulk mode.
+        """
+        # Employees may be imported concurrently, see ImportHelper
+        with self._details_lock:
+            pending_details = self.pending_details
+            self.pending_details = []
+        if not pending_details:
+            return
+        logger.info('Create {} details'.format(len(pending_details)))
+        self.insert_mora_data(
+            resource="service/details/create",
+            data=pending_details
+        )
+
     def build_detail(self, detail, employee_uuid=None):
         """
         Build detail payload
@@ -707,6 +779,18 @@ class ImportUtility(object):
             )
         return payload
 
+    def _index_object(self, resource, uuid, integration_data):
+        """
+        Add an inserted object to the integration data index, so it can be
+        found by later imports in the same run.
+        :param resource: LoRa resource URL.
+        :param uuid: uuid of the inserted object.
+        :param integration_data: The payload returned by _integration_data.
+        """
+        if self.store_integration_data and 'integration_data' in integration_data:
+            self.ia.index_object(resource, uuid,
+                                 integration_data['integration_data'])
+
     def insert_mox_data(self, resource, data, uuid=None):
 
         service_url = urljoin(
@@ -810,6 +894,24 @@ class ImportUtility(object):
             all_data += data
         return all_data
 
+    def _get_lora_details(self, uuid):
+        """ Get all details of an employee with a single search in LoRa
+        :param uuid: uuid of the employee
+        :return: dict from detail field type to the details of that type
+        """
+        service = urljoin(self.mox_base, 'organisation/organisationfunktion')
+        params = {
+            'tilknyttedebrugere': uuid,
+            'list': 1,
+            'virkningfra': '-infinity',
+            'virkningtil': 'infinity',
+        }
+        response = self.session.get(service, params=params)
+        response.raise_for_status()
+        results = response.json()['results']
+        functions = results[0] if results else []
+        return employee_details(functions)
+
     def _terminate_employee(self, uuid, date_from=None):
         endpoint = 'service/e/{}/terminate'
         yesterday = datetime.now() - timedelta(days=1)
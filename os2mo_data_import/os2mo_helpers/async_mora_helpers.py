@@ -0,0 +1,247 @@
+#
+# Copyright (c) Magenta ApS
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+"""
+Asynchronous variant of the MoraHelper reads, for readers which fan out over
+many units or persons.
+
+The lookups are fired concurrently on a single aiohttp session, with at most
+`concurrency` requests in flight. The responses are cached in a MoCache, which
+can be shared with a MoraHelper, so the blocking reads of an export can be
+served from lookups fired in bulk beforehand.
+"""
+
+import asyncio
+import json
+import logging
+
+import requests
+from aiohttp import ClientError, ClientSession, TCPConnector
+
+from os2mo_helpers import mora_helpers
+from os2mo_helpers.mo_cache import MoCache
+from os2mo_helpers.mora_helpers import (
+    DEFAULT_BACKOFF_FACTOR,
+    DEFAULT_RETRIES,
+    RETRY_STATUSES,
+    lookup_params,
+    parse_organisation_people,
+    parse_ou_manager,
+    parse_user_address,
+)
+
+# Requests in flight at a time
+DEFAULT_CONCURRENCY = 10
+
+logger = logging.getLogger("mora-helper")
+
+
+class AsyncMoraHelper:
+    """Read units and persons from MO concurrently.
+
+    The methods mirror those of MoraHelper and return the same values, but
+    are coroutines. The helper must be used as an async context manager:
+
+        async with AsyncMoraHelper(hostname) as helper:
+            units = await asyncio.gather(*map(helper.read_ou, uuids))
+
+    :param hostname: Base url of MO, as for MoraHelper.
+    :param concurrency: Maximal number of requests in flight.
+    :param use_cache: Whether lookups are cached by default.
+    :param cache: MoCache to use, eg. the cache of a MoraHelper.
+    :param retries: Number of retries on connection errors and 5xx replies.
+    :param backoff_factor: Base of the exponential backoff in seconds.
+    """
+
+    def __init__(self, hostname='http://localhost', concurrency=DEFAULT_CONCURRENCY,
+                 use_cache=True, cache=None, retries=DEFAULT_RETRIES,
+                 backoff_factor=DEFAULT_BACKOFF_FACTOR):
+        self.host = hostname + '/service/'
+        self.concurrency = concurrency
+        self.default_cache = use_cache
+        self.cache = cache if cache is not None else MoCache()
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.session = None
+        self._semaphore = None
+
+    @classmethod
+    def from_mora_helper(cls, helper, concurrency=DEFAULT_CONCURRENCY):
+        """Create a helper reading the same MO, sharing the cache of helper.
+
+        :param helper: The MoraHelper.
+        :param concurrency: Maximal number of requests in flight.
+        """
+        return cls(helper.host[:-len('/service/')], concurrency=concurrency,
+                   use_cache=helper.default_cache, cache=helper.cache)
+
+    async def __aenter__(self):
+        connector = TCPConnector(limit=self.concurrency)
+        self.session = ClientSession(connector=connector)
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+        self.session = None
+
+    async def _get(self, full_url, params):
+        """GET a url, retrying on connection errors and 5xx replies.
+
+        :return: The status and the body of the response.
+        """
+        headers = {}
+        if mora_helpers.SAML_TOKEN is not None:
+            headers['SESSION'] = mora_helpers.SAML_TOKEN
+        for retry in range(self.retries + 1):
+            if retry:
+                await asyncio.sleep(self.backoff_factor * 2 ** (retry - 1))
+            try:
+                async with self._semaphore:
+                    async with self.session.get(full_url, params=params,
+                                                headers=headers) as response:
+                        body = await response.read()
+                        status = response.status
+            except ClientError:
+                if retry == self.retries:
+                    raise
+                continue
+            if status not in RETRY_STATUSES:
+                break
+        if status == 401:
+            if mora_helpers.SAML_TOKEN is None:
+                msg = 'Missing SAML token'
+            else:
+                msg = 'SAML token not accepted'
+            logger.error(msg)
+            raise requests.exceptions.RequestException(msg)
+        return status, body
+
+    async def _mo_lookup(self, uuid, url, at=None, validity=None,
+                         only_primary=False, use_cache=None,
+                         calculate_primary=False):
+        if use_cache is None:
+            use_cache = self.default_cache
+
+        params = lookup_params(at, validity, only_primary, calculate_primary)
+        full_url = self.host + url.format(uuid)
+        cache_id = self.cache.key(full_url, params)
+        if use_cache:
+            return_dict = self.cache.get(cache_id)
+            if return_dict is not None:
+                logger.debug("cache hit: %s", cache_id)
+                return return_dict
+
+        status, body = await self._get(full_url, params)
+        return_dict = json.loads(body)
+        # Failed lookups, eg. after the retries are spent, are not cached
+        if status < 400:
+            self.cache.put(cache_id, return_dict, len(body))
+        return return_dict
+
+    async def read_organisation(self):
+        """Read the main Organisation, see MoraHelper.read_organisation."""
+        org_id = await self._mo_lookup(uuid=None, url='o/')
+        return org_id[0]['uuid']
+
+    async def read_ou(self, uuid, at=None, use_cache=None):
+        """Return a dict with the data available about an OU.
+
+        :param uuid: The UUID of the OU
+        :return: Dict with the information about the OU
+        """
+        return await self._mo_lookup(uuid, 'ou/{}', at, use_cache=use_cache)
+
+    async def read_user(self, user_uuid=None, user_cpr=None, at=None,
+                        use_cache=None, org_uuid=None):
+        """Read basic info for a user, see MoraHelper.read_user."""
+        user_info = None
+        if user_uuid:
+            user_info = await self._mo_lookup(user_uuid, 'e/{}', at,
+                                              use_cache=use_cache)
+        if user_cpr:
+            if not org_uuid:
+                org_uuid = await self.read_organisation()
+            user = await self._mo_lookup(user_cpr, 'o/' + org_uuid + '/e?query={}',
+                                         at, use_cache=use_cache)
+            assert user['total'] < 2  # Only a single person can be found from cpr
+
+            if user['total'] == 1:
+                user_info = await self._mo_lookup(user['items'][0]['uuid'], 'e/{}',
+                                                  at, use_cache=use_cache)
+        return user_info
+
+    async def read_user_engagement(self, user, at=None, read_all=False,
+                                   skip_past=False, only_primary=False,
+                                   use_cache=None, calculate_primary=False):
+        """Read engagements for a user, see MoraHelper.read_user_engagement.
+
+        With read_all, the validities are read concurrently.
+        """
+        if not read_all:
+            return await self._mo_lookup(user, 'e/{}/details/engagement',
+                                         at, only_primary=only_primary,
+                                         use_cache=use_cache,
+                                         calculate_primary=calculate_primary)
+        if skip_past:
+            validity_times = ['present', 'future']
+        else:
+            validity_times = ['past', 'present', 'future']
+
+        engagements = await asyncio.gather(*[
+            self._mo_lookup(user, 'e/{}/details/engagement', validity=validity,
+                            only_primary=only_primary, use_cache=False,
+                            calculate_primary=calculate_primary)
+            for validity in validity_times
+        ])
+        return sum(engagements, [])
+
+    async def read_user_address(self, user, username=False, cpr=False, at=None,
+                                use_cache=None, phone_type=None, email_type=None):
+        """Read phone number and email from user, see
+        MoraHelper.read_user_address.
+        """
+        lookups = [self._mo_lookup(user, 'e/{}/details/address', at,
+                                   use_cache=use_cache)]
+        if username or cpr:
+            lookups.append(self._mo_lookup(user, 'e/{}'))
+        addresses, *personal_info = await asyncio.gather(*lookups)
+        return parse_user_address(addresses, next(iter(personal_info), None),
+                                  username, cpr, phone_type, email_type)
+
+    async def read_ou_manager(self, unit_uuid, inherit=False):
+        """Read the manager of an OU, see MoraHelper.read_ou_manager."""
+        if inherit:
+            managers = await self._mo_lookup(
+                unit_uuid, 'ou/{}/details/manager?inherit_manager=1'
+            )
+        else:
+            managers = await self._mo_lookup(unit_uuid, 'ou/{}/details/manager')
+        return parse_ou_manager(unit_uuid, managers)
+
+    async def read_organisation_people(self, org_uuid, person_type='engagement',
+                                       split_name=True, read_all=False,
+                                       skip_past=False):
+        """Read all employees in an OU, see
+        MoraHelper.read_organisation_people.
+        """
+        url = 'ou/{}/details/' + person_type
+        if not read_all:
+            all_persons = await self._mo_lookup(org_uuid, url)
+        else:
+            if skip_past:
+                validity_times = ['present', 'future']
+            else:
+                validity_times = ['past', 'present', 'future']
+
+            persons = await asyncio.gather(*[
+                self._mo_lookup(org_uuid, url, validity=validity)
+                for validity in validity_times
+            ])
+            all_persons = sum(persons, [])
+        return parse_organisation_people(all_persons, split_name)
@@ -0,0 +1,169 @@
+#
+# Copyright (c) Magenta ApS
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+"""
+Bounded cache of MO responses, used by MoraHelper
+"""
+
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+# Total size of the cached responses, in bytes
+DEFAULT_CACHE_SIZE = 256 * 2 ** 20
+# Seconds a response is cached, None to cache until evicted
+DEFAULT_CACHE_TTL = None
+
+UUID_PATTERN = re.compile(
+    '[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}', re.IGNORECASE
+)
+
+logger = logging.getLogger("mora-helper")
+
+
+def find_uuids(value):
+    """Find the uuids in a url or a json payload.
+
+    :param value: A string, or a structure of dicts and lists.
+    :return: Set of the uuids, in lower case.
+    """
+    if isinstance(value, str):
+        return {uuid.lower() for uuid in UUID_PATTERN.findall(value)}
+    if isinstance(value, dict):
+        value = value.values()
+    elif not isinstance(value, (list, tuple)):
+        return set()
+    uuids = set()
+    for item in value:
+        uuids |= find_uuids(item)
+    return uuids
+
+
+class MoCache:
+    """LRU cache of MO responses, with a cap on the total size.
+
+    Responses are keyed by url and parameters, so lookups at different dates
+    or validities are cached separately. Responses can be invalidated by the
+    uuids in their url, which is done when MoraHelper writes to MO.
+
+    :param max_size: Maximal total size of the cached responses, in bytes.
+    :param ttl: Seconds a response is cached, None to cache until evicted.
+    """
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # key -> (value, size, expiry), least recently used first
+        self._entries = OrderedDict()
+        # uuid -> keys of the responses with the uuid in their url
+        self._keys_by_uuid = defaultdict(set)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(url, params):
+        """Create the key of a lookup.
+
+        :param url: The full url of the lookup.
+        :param params: The query parameters of the lookup.
+        """
+        return url, tuple(sorted((params or {}).items()))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key, count=False) is not None
+
+    def get(self, key, count=True):
+        """Return a cached response, or None if it is not cached or expired.
+
+        :param key: Key of the lookup.
+        :param count: Whether to count the lookup as a hit or miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is not None and entry[2] < time.time():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                if count:
+                    self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            if count:
+                self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        """Cache a response, evicting the least recently used if full.
+
+        :param key: Key of the lookup.
+        :param value: The decoded response.
+        :param size: Size of the response, in bytes.
+        """
+        if size > self.max_size:
+            return
+        expiry = None
+        if self.ttl is not None:
+            expiry = time.time() + self.ttl
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, expiry)
+            self.size += size
+            for uuid in find_uuids(key[0]):
+                self._keys_by_uuid[uuid].add(key)
+            while self.size > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.size -= size
+        for uuid in find_uuids(key[0]):
+            keys = self._keys_by_uuid[uuid]
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_uuid[uuid]
+
+    def invalidate(self, uuids):
+        """Remove the cached responses with any of the uuids in their url.
+
+        :param uuids: The uuids of the objects which are changed.
+        """
+        with self._lock:
+            keys = set()
+            for uuid in uuids:
+                keys |= self._keys_by_uuid.get(uuid.lower(), set())
+            for key in keys:
+                self._remove(key)
+        if keys:
+            logger.debug('Invalidated %d cached responses', len(keys))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_uuid.clear()
+            self.size = 0
+
+    def stats(self):
+        """Return the counters of the cache."""
+        return {
+            'entries': len(self._entries),
+            'size': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
@@ -15,35 +15,246 @@ import csv
 import datetime
 import logging
 import os
+import threading
+import time
+from collections import Counter
 
 import requests
 from anytree import Node
 from more_itertools import only
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from os2mo_helpers.mo_cache import (
+    DEFAULT_CACHE_SIZE,
+    DEFAULT_CACHE_TTL,
+    MoCache,
+    find_uuids,
+)
 
 SAML_TOKEN = os.environ.get('SAML_TOKEN', None)
 PRIMARY_RESPONSIBILITY = 'Personale: ansættelse/afskedigelse'
 
+# Connections kept open to MO, should be at least the number of threads
+# sharing a MoraHelper
+DEFAULT_POOL_SIZE = 10
+# Retries on connection errors and 5xx replies, waiting
+# backoff_factor * 2 ** (retry - 1) seconds between them
+DEFAULT_RETRIES = 5
+DEFAULT_BACKOFF_FACTOR = 0.5
+RETRY_STATUSES = (500, 502, 503, 504)
+
 logger = logging.getLogger("mora-helper")
 
 
+def split_full_name(name):
+    """ Split a name into first and last name.
+    Currently just splits at last space, but this might turn out to
+    be a too simple rule.
+    :param name: The name to split.
+    :return: Dict with first and last name separated.
+    """
+    splitted_name = {'Fornavn': name[:name.rfind(' ')],
+                     'Efternavn': name[name.rfind(' '):]}
+    return splitted_name
+
+
+def lookup_params(at=None, validity=None, only_primary=False,
+                  calculate_primary=False):
+    """ Return the query parameters of a MO lookup. """
+    params = {}
+    if calculate_primary:
+        params['calculate_primary'] = 1
+    if only_primary:
+        params['only_primary_uuid'] = 1
+    if at:
+        params['at'] = at
+    elif validity:
+        params['validity'] = validity
+    return params
+
+
+def parse_user_address(addresses, personal_info=None, username=False, cpr=False,
+                       phone_type=None, email_type=None):
+    """ Pick phone number and email from the addresses of a user, see
+    MoraHelper.read_user_address.
+    :param addresses: The addresses of the user.
+    :param personal_info: The user, if username or cpr is wanted.
+    :return: Dict witn phone number and email (if they exists in MO)
+    """
+    return_address = {}
+    for address in addresses:
+        if address['address_type']['scope'] == 'PHONE':
+            if phone_type is None:
+                return_address['Telefon'] = address['name']
+            else:
+                if address['address_type']['uuid'] == phone_type:
+                    return_address['Telefon'] = address['name']
+
+        if address['address_type']['scope'] == 'EMAIL':
+            if email_type is None:
+                return_address['E-mail'] = address['name']
+            else:
+                if address['address_type']['uuid'] == email_type:
+                    return_address['E-mail'] = address['name']
+    if username:
+        return_address['Brugernavn'] = personal_info['user_key']
+    if cpr:
+        return_address['CPR-Nummer'] = personal_info['cpr_no']
+    return return_address
+
+
+def parse_ou_manager(unit_uuid, managers):
+    """ Pick the manager of an OU, see MoraHelper.read_ou_manager.
+    :param unit_uuid: UUID of the OU.
+    :param managers: The managers of the OU.
+    :return: Returns 0 or 1 manager of the OU.
+    """
+    manager_list = {}
+    # Iterate over all managers, use uuid as key, if more than one
+    # distinct uuid shows up in list, rasie an error
+    for manager in managers:
+        responsibility = {'name': 'Intet ansvar'}
+        for responsibility in manager['responsibility']:
+            if responsibility['name'] == PRIMARY_RESPONSIBILITY:
+                break
+        # TODO: if primary reponsibility is found, this is now selected,
+        # otherwise we simply use the last element in the list
+
+        if manager['person'] is not None:
+            uuid = manager['person']['uuid']
+            data = {'Navn': manager['person']['name'],
+                    # 'Ansvar': manager['responsibility'][0]['name'],
+                    'Ansvar': responsibility['name'],
+                    'uuid': uuid
+                    }
+            manager_list[uuid] = data
+        else:
+            # TODO: This is a vacant manager position
+            pass
+    if len(manager_list) == 0:
+        manager = {}
+    elif len(manager_list) == 1:
+        manager = manager_list[uuid]
+    elif len(manager_list) > 1:
+        # Currently we do not support multiple managers
+        logger.warning("multiple managers not supported for %s", unit_uuid)
+        manager = manager_list[uuid]
+        # TODO: Fix this...
+        # raise Exception('Too many managers')
+    return manager
+
+
+def parse_organisation_people(all_persons, split_name=True):
+    """ Convert the employees or associations of an OU to rows, see
+    MoraHelper.read_organisation_people.
+    :param all_persons: The engagements or associations of the OU.
+    :param split_name: Split the name of the persons.
+    :return: The list of emplyoees
+    """
+    person_list = {}
+    for person in all_persons:
+        uuid = person['person']['uuid']
+        data = {
+            'Ansættelse gyldig fra': person['validity']['from'],
+            'Ansættelse gyldig til': person['validity']['to'],
+            'Person UUID': uuid,
+            'Org-enhed': person['org_unit']['name'],
+            'Org-enhed UUID': person['org_unit']['uuid'],
+            'Engagement UUID': person['uuid']
+        }
+        if 'job_function' in person:
+            data['Stillingsbetegnelse'] = person['job_function']['name']
+
+        if 'engagement_type' in person:
+            data['engagement_type_uuid'] = person['engagement_type']['uuid']
+            data['Engagementstype'] = person['engagement_type']['name']
+
+        if 'association_type' in person:
+            data['Post'] = person['association_type']['name']
+
+        # Finally, add name
+        if split_name:
+            # If a split name i wanted, we prefer to get i directly from MO
+            # rather than an algorithmic split.
+            if person['person'].get('givenname'):
+                data['Fornavn'] = person['person'].get('givenname')
+                data['Efternavn'] = person['person'].get('surname')
+            else:
+                data.update(split_full_name(person['person']['name']))
+        else:
+            data['Navn'] = person['person']['name']
+        person_list[uuid] = data
+    return person_list
+
+
 class MoraHelper:
     def __init__(self, hostname='http://localhost', export_ansi=True,
-                 use_cache=True):
+                 use_cache=True, pool_size=DEFAULT_POOL_SIZE,
+                 retries=DEFAULT_RETRIES,
+                 backoff_factor=DEFAULT_BACKOFF_FACTOR,
+                 cache_size=DEFAULT_CACHE_SIZE, cache_ttl=DEFAULT_CACHE_TTL):
         self.host = hostname + '/service/'
-        self.cache = {}
+        # Responses of lookups, invalidated when the objects are written to
+        self.cache = MoCache(max_size=cache_size, ttl=cache_ttl)
         self.default_cache = use_cache
         self.export_ansi = export_ansi
+        self.session = self._create_session(pool_size, retries, backoff_factor)
+
+        # Number of requests and seconds spent per endpoint, see
+        # log_request_stats
+        self.request_count = Counter()
+        self.request_time = Counter()
+        self._stats_lock = threading.Lock()
+
+    def _create_session(self, pool_size, retries, backoff_factor):
+        """Create a session keeping connections to MO alive between requests.
+
+        Requests failing with a connection error or a 5xx reply are retried
+        with exponential backoff, POST requests only on connection errors.
+        :param pool_size: Number of connections kept open per host.
+        :param retries: Number of retries before giving up.
+        :param backoff_factor: Base of the exponential backoff in seconds.
+        :return: The session.
+        """
+        retry = Retry(total=retries, backoff_factor=backoff_factor,
+                      status_forcelist=RETRY_STATUSES, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def _request(self, method, endpoint, url, **kwargs):
+        """Perform a request on the session, and time it.
+
+        :param method: The HTTP method.
+        :param endpoint: The endpoint the time is accounted to, typically the
+        url before the uuid is filled in.
+        :param url: The full url.
+        :return: The response.
+        """
+        start = time.monotonic()
+        try:
+            return self.session.request(method, url, **kwargs)
+        finally:
+            elapsed = time.monotonic() - start
+            with self._stats_lock:
+                self.request_count[endpoint] += 1
+                self.request_time[endpoint] += elapsed
+
+    def log_request_stats(self):
+        """Log the number of requests and the time spent per endpoint."""
+        for endpoint, seconds in self.request_time.most_common():
+            count = self.request_count[endpoint]
+            logger.info('%s: %d requests in %.1fs, %.1fms per request',
+                        endpoint, count, seconds, 1000 * seconds / count)
+        logger.info('Cache: %s', self.cache.stats())
 
     def _split_name(self, name):
-        """ Split a name into first and last name.
-        Currently just splits at last space, but this might turn out to
-        be a too simple rule.
-        :param name: The name to split.
-        :return: Dict with first and last name separated.
-        """
-        splitted_name = {'Fornavn': name[:name.rfind(' ')],
-                         'Efternavn': name[name.rfind(' '):]}
-        return splitted_name
+        """ Split a name into first and last name, see split_full_name. """
+        return split_full_name(name)
 
     def _read_node_path(self, node):
         """ Find the full path for a given node
@@ -116,28 +327,20 @@ class MoraHelper:
 
     def _mo_lookup(self, uuid, url, at=None, validity=None, only_primary=False,
                    use_cache=None, calculate_primary=False):
-        # TODO: at-value is currently not part of cache key
         if use_cache is None:
             use_cache = self.default_cache
 
-        params = {}
-        if calculate_primary:
-            params['calculate_primary'] = 1
-        if only_primary:
-            params['only_primary_uuid'] = 1
-        if at:
-            params['at'] = at
-        elif validity:
-            params['validity'] = validity
-
+        params = lookup_params(at, validity, only_primary, calculate_primary)
         full_url = self.host + url.format(uuid)
-        cache_id = full_url + str(validity)
-        if (cache_id in self.cache) and use_cache:
+        cache_id = self.cache.key(full_url, params)
+        return_dict = None
+        if use_cache:
+            return_dict = self.cache.get(cache_id)
+        if return_dict is not None:
             logger.debug("cache hit: %s", cache_id)
-            return_dict = self.cache[cache_id]
         else:
             if SAML_TOKEN is None:
-                response = requests.get(full_url, params=params)
+                response = self._request('GET', url, full_url, params=params)
                 if response.status_code == 401:
                     msg = 'Missing SAML token'
                     logger.error(msg)
@@ -145,7 +348,9 @@ class MoraHelper:
                 return_dict = response.json()
             else:
                 header = {"SESSION": SAML_TOKEN}
-                response = requests.get(
+                response = self._request(
+                    'GET',
+                    url,
                     full_url,
                     headers=header,
                     params=params
@@ -156,7 +361,9 @@ class MoraHelper:
                     raise requests.exceptions.RequestException(msg)
 
                 return_dict = response.json()
-            self.cache[cache_id] = return_dict
+            # Failed lookups, eg. after the retries are spent, are not cached
+            if response.ok:
+                self.cache.put(cache_id, return_dict, len(response.content))
         return return_dict
 
     def _mo_post(self, url, payload, force=True):
@@ -171,12 +378,16 @@ class MoraHelper:
             header = None
 
         full_url = self.host + url
-        response = requests.post(
+        response = self._request(
+            'POST',
+            url,
             full_url,
             headers=header,
             params=params,
             json=payload
         )
+        # Forget the cached lookups of the written objects
+        self.cache.invalidate(find_uuids(url) | find_uuids(payload))
         return response
 
     def check_connection(self):
@@ -225,7 +436,7 @@ class MoraHelper:
         :param uuid: The UUID of the OU
         :return: Dict with the information about the OU
         """
-        org_enhed = self._mo_lookup(uuid, 'ou/{}', at, use_cache)
+        org_enhed = self._mo_lookup(uuid, 'ou/{}', at, use_cache=use_cache)
         return org_enhed
 
     def read_ou_address(self, uuid, at=None, use_cache=None, scope="DAR",
@@ -238,7 +449,8 @@ class MoraHelper:
         :return: Dict (or list) with the information about the OU
         """
         return_list = []
-        addresses = self._mo_lookup(uuid, 'ou/{}/details/address', at, use_cache)
+        addresses = self._mo_lookup(uuid, 'ou/{}/details/address', at,
+                                    use_cache=use_cache)
 
         for address in addresses:
             return_address = {}
@@ -284,17 +496,17 @@ class MoraHelper:
         """
         user_info = None
         if user_uuid:
-            user_info = self._mo_lookup(user_uuid, 'e/{}', at, use_cache)
+            user_info = self._mo_lookup(user_uuid, 'e/{}', at, use_cache=use_cache)
         if user_cpr:
             if not org_uuid:
                 org_uuid = self.read_organisation()
             user = self._mo_lookup(user_cpr, 'o/' + org_uuid + '/e?query={}',
-                                   at, use_cache)
+                                   at, use_cache=use_cache)
             assert user['total'] < 2  # Only a single person can be found from cpr
 
             if user['total'] == 1:
                 user_info = self._mo_lookup(user['items'][0]['uuid'], 'e/{}',
-                                            at, use_cache)
+                                            at, use_cache=use_cache)
         return user_info
 
     def terminate_detail(self, mo_type, uuid, from_date):
@@ -356,7 +568,7 @@ class MoraHelper:
         if not read_all:
             associations = self._mo_lookup(user, 'e/{}/details/association',
                                            at, only_primary=only_primary,
-                                           use_cach=use_cache)
+                                           use_cache=use_cache)
         else:
             associations = []
             for validity in ['past', 'present', 'future']:
@@ -375,29 +587,13 @@ class MoraHelper:
         :param phone_type: Optionally add a specific phone_type class.
         :return: Dict witn phone number and email (if they exists in MO)
         """
-        addresses = self._mo_lookup(user, 'e/{}/details/address', at, use_cache)
-        return_address = {}
-        for address in addresses:
-            if address['address_type']['scope'] == 'PHONE':
-                if phone_type is None:
-                    return_address['Telefon'] = address['name']
-                else:
-                    if address['address_type']['uuid'] == phone_type:
-                        return_address['Telefon'] = address['name']
-
-            if address['address_type']['scope'] == 'EMAIL':
-                if email_type is None:
-                    return_address['E-mail'] = address['name']
-                else:
-                    if address['address_type']['uuid'] == email_type:
-                        return_address['E-mail'] = address['name']
+        addresses = self._mo_lookup(user, 'e/{}/details/address', at,
+                                    use_cache=use_cache)
+        personal_info = None
         if username or cpr:
             personal_info = self._mo_lookup(user, 'e/{}')
-            if username:
-                return_address['Brugernavn'] = personal_info['user_key']
-            if cpr:
-                return_address['CPR-Nummer'] = personal_info['cpr_no']
-        return return_address
+        return parse_user_address(addresses, personal_info, username, cpr,
+                                  phone_type, email_type)
 
     def read_user_manager_status(self, user):
         """ Returns True of user has responsibility:
@@ -435,7 +631,7 @@ class MoraHelper:
         user_manager = None
 
         url = 'http://localhost:8080/organisation/organisationfunktion/{}'
-        response = requests.get(url.format(engagement_uuid))
+        response = self._request('GET', url, url.format(engagement_uuid))
         data = response.json()
         relationer = data[engagement_uuid][0]['registreringer'][0]['relationer']
         user = relationer['tilknyttedebrugere'][0]
@@ -469,44 +665,12 @@ class MoraHelper:
         :param org_uuid: UUID of the OU to find the manager of
         :return: Returns 0 or 1 manager of the OU.
         """
-        manager_list = {}
         if inherit:
             managers = self._mo_lookup(unit_uuid,
                                        'ou/{}/details/manager?inherit_manager=1')
         else:
             managers = self._mo_lookup(unit_uuid, 'ou/{}/details/manager')
-        # Iterate over all managers, use uuid as key, if more than one
-        # distinct uuid shows up in list, rasie an error
-        for manager in managers:
-            responsibility = {'name': 'Intet ansvar'}
-            for responsibility in manager['responsibility']:
-                if responsibility['name'] == PRIMARY_RESPONSIBILITY:
-                    break
-            # TODO: if primary reponsibility is found, this is now selected,
-            # otherwise we simply use the last element in the list
-
-            if manager['person'] is not None:
-                uuid = manager['person']['uuid']
-                data = {'Navn': manager['person']['name'],
-                        # 'Ansvar': manager['responsibility'][0]['name'],
-                        'Ansvar': responsibility['name'],
-                        'uuid': uuid
-                        }
-                manager_list[uuid] = data
-            else:
-                # TODO: This is a vacant manager position
-                pass
-        if len(manager_list) == 0:
-            manager = {}
-        elif len(manager_list) == 1:
-            manager = manager_list[uuid]
-        elif len(manager_list) > 1:
-            # Currently we do not support multiple managers
-            logger.warning("multiple managers not supported for %s", unit_uuid)
-            manager = manager_list[uuid]
-            # TODO: Fix this...
-            # raise Exception('Too many managers')
-        return manager
+        return parse_ou_manager(unit_uuid, managers)
 
     def read_organisation_people(self, org_uuid, person_type='engagement',
                                  split_name=True, read_all=False, skip_past=False):
@@ -516,7 +680,6 @@ class MoraHelper:
         :read_all: Read all engagements, not only the present ones.
         :return: The list of emplyoees
         """
-        person_list = {}
         if not read_all:
             all_persons = self._mo_lookup(org_uuid, 'ou/{}/details/' + person_type)
         else:
@@ -530,40 +693,7 @@ class MoraHelper:
                 persons = self._mo_lookup(org_uuid, 'ou/{}/details/' + person_type,
                                           validity=validity)
                 all_persons = all_persons + persons
-
-        for person in all_persons:
-            uuid = person['person']['uuid']
-            data = {
-                'Ansættelse gyldig fra': person['validity']['from'],
-                'Ansættelse gyldig til': person['validity']['to'],
-                'Person UUID': uuid,
-                'Org-enhed': person['org_unit']['name'],
-                'Org-enhed UUID': person['org_unit']['uuid'],
-                'Engagement UUID': person['uuid']
-            }
-            if 'job_function' in person:
-                data['Stillingsbetegnelse'] = person['job_function']['name']
-
-            if 'engagement_type' in person:
-                data['engagement_type_uuid'] = person['engagement_type']['uuid']
-                data['Engagementstype'] = person['engagement_type']['name']
-
-            if 'association_type' in person:
-                data['Post'] = person['association_type']['name']
-
-            # Finally, add name
-            if split_name:
-                # If a split name i wanted, we prefer to get i directly from MO
-                # rather than an algorithmic split.
-                if person['person'].get('givenname'):
-                    data['Fornavn'] = person['person'].get('givenname')
-                    data['Efternavn'] = person['person'].get('surname')
-                else:
-                    data.update(self._split_name(person['person']['name']))
-            else:
-                data['Navn'] = person['person']['name']
-            person_list[uuid] = data
-        return person_list
+        return parse_organisation_people(all_persons, split_name)
 
     def read_top_units(self, organisation, use_cache=False):
         """ Read the ous tha refers directoly to the organisation
@@ -27,6 +27,7 @@ setup(
     },
     zip_safe=False,
     install_requires=[
+        "aiohttp",
         "anytree",
         "certifi",
         "chardet",
@@ -38,5 +39,6 @@ setup(
         "xlsxwriter",
         "xmltodict",
         "more_itertools",
+        "python-dateutil",
     ]
 )
@@ -0,0 +1,85 @@
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock
+
+from os2mo_data_import import ImportHelper
+
+
+class RecordingUtility:
+    """ImportUtility which records the order units and employees are imported in."""
+
+    def __init__(self, **kwargs):
+        self.inserted_org_unit_map = {}
+        self.imported_employees = []
+        self.flush_details = MagicMock()
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def _work(self):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.01)
+        with self.lock:
+            self.running -= 1
+
+    def import_org_unit(self, reference, organisation_unit, details):
+        parent_ref = organisation_unit.parent_ref
+        assert parent_ref is None or parent_ref in self.inserted_org_unit_map
+        self._work()
+        self.inserted_org_unit_map[reference] = reference
+
+    def import_employee(self, reference, employee, details):
+        # All units exist before the employees are imported
+        assert len(self.inserted_org_unit_map) == 7
+        self._work()
+        self.imported_employees.append(reference)
+
+
+class TestConcurrentImport(unittest.TestCase):
+    def setUp(self):
+        self.helper = ImportHelper(
+            create_defaults=False,
+            concurrent_imports=4,
+            ImportUtility=RecordingUtility,
+        )
+        # A tree of depth 3, added children first
+        units = [
+            ("c1", "b1"),
+            ("c2", "b1"),
+            ("c3", "b2"),
+            ("b1", "a"),
+            ("b2", "a"),
+            ("b3", "a"),
+            ("a", None),
+        ]
+        for reference, parent_ref in units:
+            self.helper.add_organisation_unit(
+                reference,
+                type_ref="type",
+                date_from="2020-01-01",
+                parent_ref=parent_ref,
+            )
+        for number in range(8):
+            self.helper.add_employee(
+                "employee{}".format(number), name="Test", cpr_no="0101010000"
+            )
+
+    def test_org_unit_levels(self):
+        levels = [sorted(level) for level in self.helper._org_unit_levels()]
+        self.assertEqual(levels, [["a"], ["b1", "b2", "b3"], ["c1", "c2", "c3"]])
+
+    def test_import(self):
+        self.helper._import_org_units()
+        self.helper._import_employees()
+
+        store = self.helper.store
+        self.assertEqual(len(store.inserted_org_unit_map), 7)
+        self.assertEqual(
+            sorted(store.imported_employees),
+            ["employee{}".format(number) for number in range(8)],
+        )
+        self.assertGreater(store.max_running, 1)
+        store.flush_details.assert_called_once_with()
@@ -0,0 +1,72 @@
+import json
+import unittest
+from unittest.mock import MagicMock
+
+from integration_abstraction import integration_abstraction
+from integration_abstraction.integration_abstraction import IntegrationAbstraction
+
+RESOURCE = "organisation/organisationenhed"
+
+
+def lora_object(uuid, integration_data):
+    return {
+        "id": uuid,
+        "registreringer": [
+            {
+                "attributter": {
+                    "organisationenhedegenskaber": [
+                        {"integrationsdata": json.dumps(integration_data)}
+                    ]
+                }
+            }
+        ],
+    }
+
+
+class TestIntegrationIndex(unittest.TestCase):
+    def setUp(self):
+        page_size = integration_abstraction.INDEX_PAGE_SIZE
+        integration_abstraction.INDEX_PAGE_SIZE = 2
+        self.addCleanup(setattr, integration_abstraction, "INDEX_PAGE_SIZE", page_size)
+
+        self.ia = IntegrationAbstraction("http://mox", "SD", "STOP", index=True)
+        self.ia.session = MagicMock()
+        pages = [
+            [
+                lora_object("uuid1", {"SD": '"unit1"STOP'}),
+                lora_object("uuid2", {"SD": '"unit2"STOP', "Opus": '"unit1"END'}),
+            ],
+            [lora_object("uuid3", {"SD": '{"a": 1}STOP'})],
+        ]
+        self.ia.session.get.return_value.json.side_effect = [
+            {"results": [page]} for page in pages
+        ]
+
+    def test_find_object(self):
+        self.assertEqual(self.ia.find_object(RESOURCE, "unit1"), "uuid1")
+        self.assertEqual(self.ia.find_object(RESOURCE, "unit2"), "uuid2")
+        self.assertEqual(self.ia.find_object(RESOURCE, {"a": 1}), "uuid3")
+        self.assertIsNone(self.ia.find_object(RESOURCE, "unit"))
+
+        # The resource is read in pages, once
+        self.assertEqual(self.ia.session.get.call_count, 2)
+        params = self.ia.session.get.call_args[1]["params"]
+        self.assertEqual(params["integrationsdata"], '%"SD"%')
+        self.assertEqual(params["foersteresultat"], 2)
+
+    def test_index_object(self):
+        self.ia.load_index(RESOURCE)
+
+        self.ia.index_object(RESOURCE, "uuid4", {"SD": '"unit4"STOP'})
+        self.assertEqual(self.ia.find_object(RESOURCE, "unit4"), "uuid4")
+
+        # Updated integration data replaces the old reference
+        data = self.ia.integration_data_payload(RESOURCE, "unit5", "uuid1")
+        self.ia.index_object(RESOURCE, "uuid1", data)
+        self.assertIsNone(self.ia.find_object(RESOURCE, "unit1"))
+        self.assertEqual(self.ia.find_object(RESOURCE, "unit5"), "uuid1")
+        self.assertEqual(self.ia.session.get.call_count, 2)
+
+        self.ia.index_object(RESOURCE, "uuid6", {"SD": '"unit5"STOP'})
+        with self.assertRaises(Exception):
+            self.ia.find_object(RESOURCE, "unit5")
@@ -0,0 +1,201 @@
+import unittest
+from unittest.mock import MagicMock
+
+from os2mo_data_import import utilities
+from os2mo_data_import.lora_details import employee_details
+from os2mo_data_import.mora_data_types import EmployeeType, mora_type_config
+from os2mo_data_import.utilities import ImportUtility
+
+
+def virkning(date_from, date_to="infinity"):
+    return {"from": date_from, "to": date_to}
+
+
+ENGAGEMENT = {
+    "id": "engagement_uuid",
+    "registreringer": [
+        {
+            "attributter": {
+                "organisationfunktionegenskaber": [
+                    {
+                        "brugervendtnoegle": "1234",
+                        "funktionsnavn": "Engagement",
+                        "virkning": virkning("2019-12-31 23:00:00+00"),
+                    }
+                ],
+                "organisationfunktionudvidelser": [
+                    {"fraktion": 500, "virkning": virkning("2019-12-31 23:00:00+00")}
+                ],
+            },
+            "relationer": {
+                "tilknyttedebrugere": [
+                    {
+                        "uuid": "user_uuid",
+                        "virkning": virkning("2019-12-31 23:00:00+00"),
+                    }
+                ],
+                "tilknyttedeenheder": [
+                    {
+                        "uuid": "unit1",
+                        "virkning": virkning(
+                            "2019-12-31 23:00:00+00", "2020-06-01 00:00:00+02"
+                        ),
+                    },
+                    {"uuid": "unit2", "virkning": virkning("2020-06-01 00:00:00+02")},
+                ],
+                "opgaver": [
+                    {"uuid": "job_uuid", "virkning": virkning("2019-12-31 23:00:00+00")}
+                ],
+            },
+            "tilstande": {
+                "organisationfunktiongyldighed": [
+                    {
+                        "gyldighed": "Aktiv",
+                        "virkning": virkning(
+                            "2019-12-31 23:00:00+00", "2021-01-01 00:00:00+01"
+                        ),
+                    },
+                    {
+                        "gyldighed": "Inaktiv",
+                        "virkning": virkning("2021-01-01 00:00:00+01"),
+                    },
+                ]
+            },
+        }
+    ],
+}
+
+ADDRESS = {
+    "id": "address_uuid",
+    "registreringer": [
+        {
+            "attributter": {
+                "organisationfunktionegenskaber": [
+                    {
+                        "brugervendtnoegle": "",
+                        "funktionsnavn": "Adresse",
+                        "virkning": virkning("2019-12-31 23:00:00+00"),
+                    }
+                ]
+            },
+            "relationer": {
+                "adresser": [
+                    {
+                        "objekttype": "EMAIL",
+                        "urn": "urn:mailto:test@example.com",
+                        "virkning": virkning("2019-12-31 23:00:00+00"),
+                    }
+                ]
+            },
+            "tilstande": {
+                "organisationfunktiongyldighed": [
+                    {
+                        "gyldighed": "Aktiv",
+                        "virkning": virkning("2019-12-31 23:00:00+00"),
+                    }
+                ]
+            },
+        }
+    ],
+}
+
+
+class TestLoraDetails(unittest.TestCase):
+    def test_employee_details(self):
+        details = employee_details([ENGAGEMENT, ADDRESS])
+        self.assertEqual(details["role"], [])
+        self.assertEqual(
+            details["engagement"],
+            [
+                {
+                    "validity": {"from": "2020-01-01", "to": "2020-05-31"},
+                    "org_unit": {"uuid": "unit1"},
+                    "user_key": "1234",
+                    "fraction": 500,
+                    "job_function": {"uuid": "job_uuid"},
+                },
+                {
+                    "validity": {"from": "2020-06-01", "to": "2020-12-31"},
+                    "org_unit": {"uuid": "unit2"},
+                    "user_key": "1234",
+                    "fraction": 500,
+                    "job_function": {"uuid": "job_uuid"},
+                },
+            ],
+        )
+        self.assertEqual(
+            details["address"],
+            [
+                {
+                    "validity": {"from": "2020-01-01", "to": None},
+                    "value": "test@example.com",
+                }
+            ],
+        )
+
+
+class TestBulkImport(unittest.TestCase):
+    def setUp(self):
+        mora_type_config("http://mox/", "Import", "_|-STOP")
+        self.store = ImportUtility(
+            "Import",
+            "_|-STOP",
+            "http://mox/",
+            "http://mora/",
+            demand_consistent_uuids=False,
+            bulk=True,
+        )
+        self.store.organisation_uuid = "org_uuid"
+        self.store.session = MagicMock()
+        self.store.session.get.return_value.json.return_value = {"results": [[ADDRESS]]}
+        self.store.insert_mora_data = MagicMock(return_value="user_uuid")
+
+    def address(self):
+        detail = MagicMock()
+        detail.date_from = "2020-01-01"
+        self.store.build_detail = MagicMock(
+            return_value={
+                "type": "address",
+                "value": "test@example.com",
+                "validity": {"from": "2020-01-01", "to": None},
+            }
+        )
+        return detail
+
+    def test_existing_details_read_from_lora(self):
+        employee = EmployeeType(
+            name="Test Testesen", cpr_no="0101010000", uuid="user_uuid"
+        )
+        self.store.existing_uuids = ["user_uuid"]
+        self.store.import_employee("ref", employee, [self.address()])
+
+        self.store.session.get.assert_called_once()
+        self.assertEqual(
+            self.store.session.get.call_args[1]["params"]["tilknyttedebrugere"],
+            "user_uuid",
+        )
+        # The address exists, so the employee is not re-imported
+        self.assertEqual(self.store.pending_details, [])
+
+    def test_details_created_in_batches(self):
+        utilities.DETAIL_BATCH_SIZE, batch_size = 2, utilities.DETAIL_BATCH_SIZE
+        self.addCleanup(setattr, utilities, "DETAIL_BATCH_SIZE", batch_size)
+
+        for number in range(3):
+            employee = EmployeeType(name="Test Testesen", cpr_no="0101010000")
+            self.store.import_employee(number, employee, [self.address()])
+        # New employees have no details to read
+        self.store.session.get.assert_not_called()
+
+        create_calls = [
+            call
+            for call in self.store.insert_mora_data.call_args_list
+            if call[1]["resource"] == "service/details/create"
+        ]
+        self.assertEqual(len(create_calls), 1)
+        self.assertEqual(len(create_calls[0][1]["data"]), 2)
+        self.assertEqual(len(self.store.pending_details), 1)
+
+        self.store.flush_details()
+        self.assertEqual(len(self.store.insert_mora_data.call_args_list), 5)
+        self.assertEqual(self.store.pending_details, [])
@@ -0,0 +1,210 @@
+import asyncio
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+from freezegun import freeze_time
+
+import requests
+
+from os2mo_helpers import mora_helpers
+from os2mo_helpers.async_mora_helpers import AsyncMoraHelper
+from os2mo_helpers.mo_cache import MoCache
+from os2mo_helpers.mora_helpers import MoraHelper
+
+UUID1 = "4f79e266-4080-4300-a800-000006180002"
+UUID2 = "23a2ace2-52ca-458d-bead-d1a42080579f"
+
+
+class Handler(BaseHTTPRequestHandler):
+    # Keep-alive requires HTTP/1.1
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        server.paths.append(self.path)
+        server.connections.add(self.client_address)
+        server.sessions.append(self.headers.get("SESSION"))
+        if server.failures:
+            server.failures -= 1
+            self.reply(503, {})
+        elif server.status == 401:
+            self.reply(401, {})
+        else:
+            self.reply(200, [{"uuid": "org"}])
+
+    def do_POST(self):
+        length = int(self.headers["Content-Length"])
+        self.server.posts.append(json.loads(self.rfile.read(length)))
+        self.reply(200, UUID1)
+
+    def reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestMoraHelperSession(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.paths = []
+        self.server.connections = set()
+        self.server.sessions = []
+        self.server.posts = []
+        self.server.failures = 0
+        self.server.status = 200
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        self.url = "http://{}:{}".format(*self.server.server_address)
+        self.helper = MoraHelper(self.url, use_cache=False, backoff_factor=0)
+        self.addCleanup(self.helper.session.close)
+
+    def test_keep_alive(self):
+        for _ in range(5):
+            self.assertEqual(self.helper.read_organisation(), "org")
+        self.assertEqual(len(self.server.paths), 5)
+        self.assertEqual(len(self.server.connections), 1)
+
+    def test_retry_server_errors(self):
+        self.server.failures = 2
+        self.assertEqual(self.helper.read_organisation(), "org")
+        self.assertEqual(self.server.paths, ["/service/o/"] * 3)
+
+    def test_give_up_after_retries(self):
+        self.server.failures = 10
+        helper = MoraHelper(self.url, retries=1, backoff_factor=0)
+        self.assertEqual(helper._mo_lookup(None, "o/"), {})
+        self.assertEqual(len(self.server.paths), 2)
+
+    def test_saml_token(self):
+        with patch.object(mora_helpers, "SAML_TOKEN", "token"):
+            self.helper.read_organisation()
+        self.helper.read_organisation()
+        self.assertEqual(self.server.sessions, ["token", None])
+
+        self.server.status = 401
+        with patch.object(mora_helpers, "SAML_TOKEN", "token"):
+            with self.assertRaises(requests.exceptions.RequestException):
+                self.helper.read_organisation()
+
+    def test_request_stats(self):
+        self.helper.read_organisation()
+        self.helper.read_organisation()
+        self.helper.read_ou("ou1")
+        self.assertEqual(self.helper.request_count, {"o/": 2, "ou/{}": 1})
+        self.assertEqual(self.helper.request_time.keys(), {"o/", "ou/{}"})
+        with self.assertLogs("mora-helper") as logs:
+            self.helper.log_request_stats()
+        self.assertEqual(len(logs.output), 3)
+
+    def test_cache(self):
+        helper = MoraHelper(self.url, backoff_factor=0)
+        helper.read_ou(UUID1)
+        helper.read_ou(UUID1)
+        helper.read_ou(UUID1, at="2020-01-01")
+        helper.read_ou(UUID1, at="2020-01-01")
+        helper.read_user_engagement(UUID2, only_primary=True)
+        helper.read_user_engagement(UUID2)
+        self.assertEqual(len(self.server.paths), 4)
+        self.assertEqual(helper.cache.hits, 2)
+        self.assertEqual(helper.cache.misses, 4)
+
+        # Writing to an employee forgets the lookups of the employee
+        helper._mo_post("details/edit", {"person": {"uuid": UUID2}})
+        helper.read_ou(UUID1)
+        helper.read_user_engagement(UUID2)
+        self.assertEqual(len(self.server.paths), 5)
+
+        helper.read_ou(UUID1, use_cache=False)
+        self.assertEqual(len(self.server.paths), 6)
+
+    def test_failed_lookups_not_cached(self):
+        helper = MoraHelper(self.url, retries=0, backoff_factor=0)
+        self.server.failures = 1
+        self.assertEqual(helper.read_ou(UUID1), {})
+        self.assertEqual(helper.read_ou(UUID1), [{"uuid": "org"}])
+
+    def test_async_helper(self):
+        helper = MoraHelper(self.url, backoff_factor=0)
+
+        async def read_units():
+            async_helper = AsyncMoraHelper.from_mora_helper(helper, concurrency=2)
+            async with async_helper:
+                return await asyncio.gather(
+                    *[async_helper.read_ou(uuid) for uuid in (UUID1, UUID2, UUID1)]
+                )
+
+        self.assertEqual(asyncio.run(read_units()), [[{"uuid": "org"}]] * 3)
+        # The reads share the cache of the blocking helper
+        self.assertEqual(helper.read_ou(UUID1), [{"uuid": "org"}])
+        self.assertEqual(helper.read_ou(UUID2), [{"uuid": "org"}])
+        self.assertLessEqual(len(self.server.paths), 3)
+        self.assertEqual(helper.cache.hits, 2)
+
+    def test_async_helper_retries(self):
+        self.server.failures = 2
+
+        async def read_engagements():
+            async with AsyncMoraHelper(self.url, backoff_factor=0) as helper:
+                return await helper.read_user_engagement(UUID1, read_all=True)
+
+        self.assertEqual(asyncio.run(read_engagements()), [{"uuid": "org"}] * 3)
+        self.assertEqual(len(self.server.paths), 5)
+
+        self.server.status = 401
+
+        async def read_organisation():
+            async with AsyncMoraHelper(self.url, backoff_factor=0) as helper:
+                return await helper.read_organisation()
+
+        with self.assertRaises(requests.exceptions.RequestException):
+            asyncio.run(read_organisation())
+
+
+class TestMoCache(unittest.TestCase):
+    def test_lru_eviction(self):
+        cache = MoCache(max_size=10)
+        cache.put(cache.key("a", {}), "a", 4)
+        cache.put(cache.key("b", {}), "b", 4)
+        self.assertEqual(cache.get(cache.key("a", {})), "a")
+        # b is the least recently used
+        cache.put(cache.key("c", {}), "c", 4)
+        self.assertIsNone(cache.get(cache.key("b", {})))
+        self.assertEqual(cache.get(cache.key("c", {})), "c")
+        # Too large to cache
+        cache.put(cache.key("d", {}), "d", 11)
+        self.assertEqual(
+            cache.stats(),
+            {"entries": 2, "size": 8, "hits": 2, "misses": 1, "evictions": 1},
+        )
+
+    def test_ttl(self):
+        cache = MoCache(ttl=60)
+        with freeze_time("2020-01-01 12:00:00"):
+            cache.put(cache.key("a", {"at": "2020-01-01"}), "a", 1)
+        with freeze_time("2020-01-01 12:00:59"):
+            self.assertEqual(cache.get(cache.key("a", {"at": "2020-01-01"})), "a")
+            self.assertIsNone(cache.get(cache.key("a", {})))
+        with freeze_time("2020-01-01 12:01:01"):
+            self.assertIsNone(cache.get(cache.key("a", {"at": "2020-01-01"})))
+        self.assertEqual(cache.size, 0)
+
+    def test_invalidate(self):
+        cache = MoCache()
+        url = "http://mo/service/e/{}/details/engagement".format(UUID1)
+        cache.put(cache.key(url, {"validity": "past"}), "past", 1)
+        cache.put(cache.key(url, {"validity": "future"}), "future", 1)
+        cache.put(cache.key("http://mo/service/o/", {}), "org", 1)
+        cache.invalidate({UUID1.upper()})
+        self.assertEqual(len(cache), 1)
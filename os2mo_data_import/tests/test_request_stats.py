@@ -0,0 +1,97 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+from os2mo_data_import import ImportHelper
+from os2mo_data_import.request_stats import RequestStats, mean_latencies, request_key
+
+UUID = "4f79e266-4080-4300-a800-000006180002"
+
+
+class TestRequestStats(unittest.TestCase):
+    def test_request_key(self):
+        self.assertEqual(
+            request_key(
+                "GET",
+                "http://mo/service/e/{}/details/engagement?validity=past".format(UUID),
+            ),
+            "GET /service/e/{uuid}/details/engagement",
+        )
+
+    def test_summary(self):
+        stats = RequestStats()
+        stats.record("GET", "http://mo/service/e/{}".format(UUID), 0.02)
+        stats.record("GET", "http://mo/service/e/{}".format(UUID), 0.2)
+        stats.record("POST", "http://mo/service/e/create", 20)
+
+        summary = json.loads(stats.to_json())
+        self.assertEqual(summary["requests"], 3)
+        self.assertAlmostEqual(summary["seconds"], 20.22)
+        lookups = summary["resources"]["GET /service/e/{uuid}"]
+        self.assertEqual(lookups["count"], 2)
+        self.assertAlmostEqual(lookups["mean"], 0.11)
+        self.assertEqual(lookups["max"], 0.2)
+        self.assertEqual(lookups["histogram"]["<=0.025"], 1)
+        self.assertEqual(lookups["histogram"]["<=0.25"], 1)
+        creates = summary["resources"]["POST /service/e/create"]
+        self.assertEqual(creates["histogram"][">10"], 1)
+
+        self.assertEqual(
+            mean_latencies(summary),
+            {"GET /service/e/{uuid}": 0.11, "POST /service/e/create": 20},
+        )
+
+
+class TestEstimateRequests(unittest.TestCase):
+    def setUp(self):
+        self.helper = ImportHelper(
+            create_defaults=False, mora_base="http://mo", mox_base="http://lora"
+        )
+        self.helper.add_organisation("Org")
+        self.helper.add_organisation_unit(
+            "unit", type_ref="type", date_from="2020-01-01"
+        )
+        for number in range(2):
+            employee = "employee{}".format(number)
+            self.helper.add_employee(employee, name="Test", cpr_no="0101010000")
+            self.helper.add_engagement(
+                employee,
+                "unit",
+                job_function_ref="job",
+                engagement_type_ref="type",
+                date_from="2020-01-01",
+            )
+        self.helper.store.import_organisation = MagicMock()
+
+    def test_estimate_requests(self):
+        estimate = self.helper.estimate_requests(
+            {"POST /service/e/create": 1, "GET /service/ou/{uuid}/details/address": 2}
+        )
+        resources = estimate["resources"]
+        self.assertEqual(resources["POST /organisation/organisation"], 1)
+        self.assertEqual(resources["POST /service/ou/create"], 1)
+        self.assertEqual(resources["POST /service/e/create"], 2)
+        self.assertEqual(resources["GET /service/e/{uuid}/details/engagement"], 6)
+        # The unit and both employees create details
+        self.assertEqual(resources["POST /service/details/create"], 3)
+        # Organisation and klassifikation, the unit and the employees
+        self.assertEqual(estimate["requests"], 2 + 5 + 2 * 23)
+        # Requests without a latency are assumed to take the mean latency, 1.5
+        self.assertEqual(
+            estimate["seconds"], 2 * 1.5 + (2 * 1.5 + 3 * 2) + 2 * (1 + 22 * 1.5)
+        )
+
+    def test_dry_run(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.helper.request_stats_file = os.path.join(directory, "stats.json")
+            estimate = self.helper.import_all(dry_run=True)
+            self.assertIsNone(estimate["seconds"])
+
+            with open(self.helper.request_stats_file, "w") as f:
+                json.dump({"resources": {"POST /service/e/create": {"mean": 2}}}, f)
+            estimate = self.helper.import_all(dry_run=True)
+            self.assertEqual(estimate["seconds"], estimate["requests"] * 2)
+
+        self.helper.store.import_organisation.assert_not_called()
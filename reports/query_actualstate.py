@@ -18,6 +18,7 @@ from exporters.sql_export.sql_table_defs import (
     Enhed,
     Tilknytning,
 )
+from exporters.sql_export.unit_tree import UnitTree
 from reports.XLSXExporter import XLSXExporter
 
 
@@ -25,25 +26,9 @@ def set_of_org_units(session, org_name: str) -> set:
     """Find all uuids of org_units under the organisation  :code:`org_name`. """
 
     hoved_enhed = session.query(Enhed.uuid).filter(Enhed.navn == org_name).one()[0]
-    # Find all children of the unit and collect in a set
-    def find_children(enheder):
-        """Return a set of children under :code:`enheder`."""
-        under_enheder = (
-            session.query(Enhed.uuid)
-            .filter(Enhed.forældreenhed_uuid.in_(enheder))
-            .all()
-        )
-        # query returns a list of tuples like [(uuid2,),(uuid2,)], so extract the first item in each.
-        return set(enheder[0] for enheder in under_enheder)
-
-    under_enheder = find_children(set([hoved_enhed]))
-    alle_enheder = under_enheder
-    # Update the set with any new units
-    while under_enheder:
-        under_enheder = find_children(under_enheder)
-        alle_enheder.update(under_enheder)
-
-    return alle_enheder
+    # Read the parent of every unit at once, rather than a query per level
+    tree = UnitTree(dict(session.query(Enhed.uuid, Enhed.forældreenhed_uuid)))
+    return set(tree.descendants(hoved_enhed))
 
 
 def list_MED_members(session, org_names: dict) -> list: